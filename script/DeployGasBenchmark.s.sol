@@ -0,0 +1,98 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.21;
+
+import "./lib/forge-std/src/Script.sol";
+import "./lib/forge-std/src/console2.sol";
+import {MetaMorpho} from "./morph-contracts/MetaMorpho.sol";
+import {ERC20Mock} from "./morph-contracts/mocks/ERC20Mock.sol";
+import {IrmMock} from "./morph-contracts/mocks/IrmMock.sol";
+import {OracleMock} from "./morph-contracts/mocks/OracleMock.sol";
+import {IMorpho, MarketParams} from "../lib/morpho-blue/src/interfaces/IMorpho.sol";
+
+/// @notice Deploys Morpho Blue, mock markets and a MetaMorpho vault on a local
+/// anvil chain for `gas_benchmark.py`. The vault's caps are only submitted: the
+/// harness accepts them once the timelock has passed, then fills the vault.
+contract DeployGasBenchmark is Script {
+    uint256 constant ORACLE_PRICE_SCALE = 1e36;
+
+    function run() external {
+        uint256 privateKey = vm.envUint("PRIVATE_KEY");
+        uint256 nMarkets = vm.envOr("GAS_BENCH_MARKETS", uint256(8));
+        uint256 liquidity = vm.envOr("GAS_BENCH_LIQUIDITY", uint256(1_000_000e18));
+        uint256 utilization = vm.envOr("GAS_BENCH_UTILIZATION", uint256(0.5e18));
+        string memory output = vm.envOr("GAS_BENCH_OUTPUT", string("gas_benchmark/deployment.json"));
+        address owner = vm.addr(privateKey);
+
+        vm.startBroadcast(privateKey);
+
+        // Morpho Blue is pinned to 0.8.19, so it is deployed from its artifact (built from MorphoArtifact.sol)
+        IMorpho morpho = IMorpho(deployCode("Morpho.sol:Morpho", abi.encode(owner)));
+
+        ERC20Mock loanToken = new ERC20Mock("Loan Token", "LOAN");
+        ERC20Mock collateralToken = new ERC20Mock("Collateral Token", "COLL");
+        IrmMock irm = new IrmMock();
+        irm.setApr(0.05e18);
+        morpho.enableIrm(address(irm));
+
+        uint256[4] memory lltvs = [uint256(0.77e18), 0.86e18, 0.915e18, 0.945e18];
+        for (uint256 i; i < lltvs.length; ++i) {
+            morpho.enableLltv(lltvs[i]);
+        }
+
+        // Market liquidity plus as much again for the vault deposits
+        loanToken.mint(owner, 2 * liquidity * nMarkets);
+        collateralToken.mint(owner, 2 * liquidity * nMarkets);
+        loanToken.approve(address(morpho), type(uint256).max);
+        collateralToken.approve(address(morpho), type(uint256).max);
+
+        MetaMorpho vault =
+            new MetaMorpho(owner, address(morpho), 1 days, address(loanToken), "Gas Benchmark Vault", "GBV");
+        vault.setCurator(owner);
+        vault.setIsAllocator(owner, true);
+
+        // One oracle per market, so markets with the same LLTV still have distinct ids
+        address[] memory oracles = new address[](nMarkets);
+        uint256[] memory marketLltvs = new uint256[](nMarkets);
+        for (uint256 i; i < nMarkets; ++i) {
+            OracleMock oracle = new OracleMock();
+            oracle.setPrice(ORACLE_PRICE_SCALE);
+
+            MarketParams memory marketParams = MarketParams({
+                loanToken: address(loanToken),
+                collateralToken: address(collateralToken),
+                oracle: address(oracle),
+                irm: address(irm),
+                lltv: lltvs[i % lltvs.length]
+            });
+            morpho.createMarket(marketParams);
+
+            // Outside liquidity and a borrower, so markets accrue interest
+            morpho.supply(marketParams, liquidity, 0, owner, "");
+            uint256 borrowed = liquidity * utilization / 1e18;
+            if (borrowed > 0) {
+                morpho.supplyCollateral(marketParams, 2 * borrowed, owner, "");
+                morpho.borrow(marketParams, borrowed, 0, owner, owner);
+            }
+
+            vault.submitCap(marketParams, type(uint184).max);
+            oracles[i] = address(oracle);
+            marketLltvs[i] = marketParams.lltv;
+        }
+
+        vm.stopBroadcast();
+
+        string memory key = "deployment";
+        vm.serializeAddress(key, "morpho", address(morpho));
+        vm.serializeAddress(key, "vault", address(vault));
+        vm.serializeAddress(key, "loan_token", address(loanToken));
+        vm.serializeAddress(key, "collateral_token", address(collateralToken));
+        vm.serializeAddress(key, "irm", address(irm));
+        vm.serializeAddress(key, "oracles", oracles);
+        string memory json = vm.serializeUint(key, "lltvs", marketLltvs);
+        vm.writeJson(json, output);
+
+        console2.log("Gas benchmark vault deployed:", address(vault));
+        console2.log("Morpho:", address(morpho));
+        console2.log("Markets:", nMarkets);
+    }
+}
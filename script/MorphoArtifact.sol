@@ -0,0 +1,7 @@
+// SPDX-License-Identifier: MIT
+pragma solidity 0.8.19;
+
+// Compile-only: brings Morpho Blue, pinned to 0.8.19, into the build so that its
+// artifact exists for `deployCode("Morpho.sol:Morpho")` in DeployGasBenchmark.s.sol,
+// which is compiled with ^0.8.21 and cannot import it.
+import {Morpho} from "../lib/morpho-blue/src/Morpho.sol";
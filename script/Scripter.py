@@ -1,14 +1,34 @@
-from web3 import Web3
 from dataclasses import dataclass
 from typing import List
 
+from abi_codec import encode_reallocate
+from fee_oracle import FeeOracle
+from metrics import REGISTRY, instrument_web3, rpc_call_count
+from profiling import profiled
+
 # -------------------------------------------------------------------------
-# 1. Connect to your local Foundry (or Hardhat) fork
+# 1. Connect to your local Foundry (or Hardhat) fork, on first use
 # -------------------------------------------------------------------------
-w3 = Web3(Web3.HTTPProvider('http://127.0.0.1:8545'))
-if not w3.is_connected():
-    print("❌ Not connected to local fork! Ensure anvil/HardHat is running.")
-    exit(1)
+RPC_URL = 'http://127.0.0.1:8545'
+_w3 = None
+
+def get_w3():
+    """Return the Web3 connection to the local fork, connecting on first use."""
+    global _w3
+    if _w3 is None:
+        from web3 import Web3
+
+        _w3 = Web3(Web3.HTTPProvider(RPC_URL))
+        if not _w3.is_connected():
+            print("❌ Not connected to local fork! Ensure anvil/HardHat is running.")
+            exit(1)
+    return _w3
+
+def __getattr__(name):
+    # `from Scripter import w3` keeps working, and only then imports web3 and connects
+    if name == "w3":
+        return get_w3()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # -------------------------------------------------------------------------
 # 2. Replace with the NEW MetaMorph Vault Address
@@ -20,6 +40,8 @@ NEW_METAMORPH_VAULT_ADDRESS = "0xf26f466633d7597192D7989a9e951B4B9725d1c1"
 # -------------------------------------------------------------------------
 TEST_ACCOUNT = "0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266"
 PRIVATE_KEY = "PRIVATE_KEY(its anyways tested one, but still good to not have it in repo)"
+# Well-known key of anvil's first dev account (TEST_ACCOUNT); only valid on local chains
+ANVIL_PRIVATE_KEY = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
 
 # -------------------------------------------------------------------------
 # 4. Data Structures (Same as your original code)
@@ -88,26 +110,39 @@ def format_allocations(allocations: List[MarketAllocation]):
     return formatted
 
 # -------------------------------------------------------------------------
-# 7. Simulate & Send Transaction (with build_transaction() in Web3.py 7.x)
+# 7. Simulate & Send Transaction (with pre-encoded calldata in Web3.py 7.x)
 # -------------------------------------------------------------------------
-def simulate_and_send_reallocate(allocations: List[MarketAllocation]):
+@profiled("simulate_and_send_reallocate")
+def simulate_and_send_reallocate(allocations: List[MarketAllocation], receipt_watcher=None, client=None,
+                                 vault_address: str = NEW_METAMORPH_VAULT_ADDRESS, urgency: str = "medium",
+                                 sender: str = TEST_ACCOUNT, private_key: str = PRIVATE_KEY):
     """
-    1. Create a contract instance using the NEW MetaMorph Vault address.
+    1. Encode the reallocate calldata (cached encoders from abi_codec.py).
     2. Simulate (call) the reallocate function with your allocations.
     3. Build the transaction, estimate gas, sign & send.
-    4. Wait for receipt.
+    4. Wait for receipt (through `receipt_watcher` when given, instead of polling).
+
+    `client` is the Web3 instance to use, the local fork by default; its
+    JSON-RPC calls are counted in the metrics registry.
+    Fees are EIP-1559 fields from the client's cached fee oracle at `urgency`.
+    The transaction is sent from `sender`, signed with `private_key`.
     """
-    contract = w3.eth.contract(address=NEW_METAMORPH_VAULT_ADDRESS, abi=REALLOCATE_ABI)
+    client = instrument_web3(client or get_w3())
+    rpc_calls_before = rpc_call_count(client)
 
-    # Prepare the data structures
-    formatted_allocs = format_allocations(allocations)
+    # Prepare the calldata once for the simulation, gas estimate and transaction
+    call = {
+        "from": sender,
+        "to":   vault_address,
+        "data": encode_reallocate(allocations)
+    }
 
     # ---------------------------
     # Step 1: Simulation (static call)
     # ---------------------------
     print("Step 1: Simulation (static call)...")
     try:
-        contract.functions.reallocate(formatted_allocs).call({"from": TEST_ACCOUNT})
+        client.eth.call(call)
         print("✔ Simulation successful (no revert).")
     except Exception as exc:
         print(f"✘ Simulation failed: {exc}")
@@ -116,42 +151,44 @@ def simulate_and_send_reallocate(allocations: List[MarketAllocation]):
     # ---------------------------
     # Step 2: Build & Send TX
     # ---------------------------
-    print("\nStep 2: Sending Transaction (using build_transaction + estimate_gas)...")
+    print("\nStep 2: Sending Transaction (using encoded calldata + estimate_gas)...")
     try:
-        # (a) Build a partial transaction that includes 'data'
-        #     but do NOT set 'nonce', 'gas', 'gasPrice', 'chainId' yet.
-        #     Then we can extract 'data' from it for gas estimation.
-        partial_tx = contract.functions.reallocate(formatted_allocs).build_transaction({
-            "from": TEST_ACCOUNT
-        })
-
-        # (b) Estimate gas using the 'data' & 'to'
-        gas_estimate = w3.eth.estimate_gas({
-            "from": TEST_ACCOUNT,
-            "to":   partial_tx['to'],
-            "data": partial_tx['data']
-        })
+        # (a) Estimate gas using the 'data' & 'to'
+        gas_estimate = client.eth.estimate_gas(call)
 
-        # (c) Build the final transaction with all fields
+        # (b) Build the final transaction with all fields
         final_tx = {
-            "from":      TEST_ACCOUNT,
-            "to":        partial_tx['to'],
-            "nonce":     w3.eth.get_transaction_count(TEST_ACCOUNT),
+            "from":      sender,
+            "to":        vault_address,
+            "nonce":     client.eth.get_transaction_count(sender),
             "gas":       gas_estimate + 50000,  # buffer
-            "gasPrice":  w3.eth.gas_price,
-            "chainId":   w3.eth.chain_id,
-            "data":      partial_tx['data']  # same data
+            "chainId":   client.eth.chain_id,
+            "data":      call['data'],  # same data
+            "type":      2,
+            **FeeOracle.for_client(client).fees(urgency)
         }
 
-        # (d) Sign & send
-        signed_tx = w3.eth.account.sign_transaction(final_tx, PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+        # (c) Sign & send
+        signed_tx = client.eth.account.sign_transaction(final_tx, private_key)
+        # Registered before sending so a receipt in the very next block is not missed
+        if receipt_watcher is not None:
+            receipt_watcher.register(signed_tx.hash)
+        try:
+            tx_hash = client.eth.send_raw_transaction(signed_tx.raw_transaction)
+        except Exception:
+            if receipt_watcher is not None:
+                receipt_watcher.unregister(signed_tx.hash)
+            raise
         print(f"✔ Transaction sent! Hash = {tx_hash.hex()}")
 
-        # (e) Wait for receipt
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        # (d) Wait for receipt
+        if receipt_watcher is not None:
+            receipt = receipt_watcher.wait(tx_hash)
+        else:
+            receipt = client.eth.wait_for_transaction_receipt(tx_hash)
         print("✔ Transaction confirmed!")
         print(f"Gas Used: {receipt.gasUsed}")
+        REGISTRY.observe("rpc_calls_per_transaction", rpc_call_count(client) - rpc_calls_before)
         return receipt
 
     except Exception as exc:
@@ -159,9 +196,127 @@ def simulate_and_send_reallocate(allocations: List[MarketAllocation]):
         return None
 
 # -------------------------------------------------------------------------
-# 8. Example: Using the newly created vault
+# 8. Read the vault's current supply on Morpho Blue
+# -------------------------------------------------------------------------
+MORPHO_ADDRESS = "0xBBBBBbbBBb9cC5e90e3b3Af64bdAF62C37EEFFCb"
+
+MORPHO_ABI = [{
+    "inputs": [
+        {"internalType": "Id",      "name": "id",   "type": "bytes32"},
+        {"internalType": "address", "name": "user", "type": "address"}
+    ],
+    "name": "position",
+    "outputs": [
+        {"internalType": "uint256", "name": "supplyShares", "type": "uint256"},
+        {"internalType": "uint128", "name": "borrowShares", "type": "uint128"},
+        {"internalType": "uint128", "name": "collateral",   "type": "uint128"}
+    ],
+    "stateMutability": "view",
+    "type": "function"
+}, {
+    "inputs": [{"internalType": "Id", "name": "id", "type": "bytes32"}],
+    "name": "market",
+    "outputs": [
+        {"internalType": "uint128", "name": "totalSupplyAssets", "type": "uint128"},
+        {"internalType": "uint128", "name": "totalSupplyShares", "type": "uint128"},
+        {"internalType": "uint128", "name": "totalBorrowAssets", "type": "uint128"},
+        {"internalType": "uint128", "name": "totalBorrowShares", "type": "uint128"},
+        {"internalType": "uint128", "name": "lastUpdate",        "type": "uint128"},
+        {"internalType": "uint128", "name": "fee",               "type": "uint128"}
+    ],
+    "stateMutability": "view",
+    "type": "function"
+}, {
+    "inputs": [{
+        "components": [
+            {"internalType": "address", "name": "loanToken",       "type": "address"},
+            {"internalType": "address", "name": "collateralToken", "type": "address"},
+            {"internalType": "address", "name": "oracle",          "type": "address"},
+            {"internalType": "address", "name": "irm",             "type": "address"},
+            {"internalType": "uint256", "name": "lltv",            "type": "uint256"}
+        ],
+        "internalType": "struct MarketParams",
+        "name": "marketParams",
+        "type": "tuple"
+    }],
+    "name": "accrueInterest",
+    "outputs": [],
+    "stateMutability": "nonpayable",
+    "type": "function"
+}]
+
+# Vault getters read by the offline model (vault_model.py) and `get_vault_caps`
+VAULT_STATE_ABI = [{
+    "inputs": [{"internalType": "Id", "name": "", "type": "bytes32"}],
+    "name": "config",
+    "outputs": [
+        {"internalType": "uint184", "name": "cap",         "type": "uint184"},
+        {"internalType": "bool",    "name": "enabled",     "type": "bool"},
+        {"internalType": "uint64",  "name": "removableAt", "type": "uint64"}
+    ],
+    "stateMutability": "view",
+    "type": "function"
+}, {
+    "inputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+    "name": "withdrawQueue",
+    "outputs": [{"internalType": "Id", "name": "", "type": "bytes32"}],
+    "stateMutability": "view",
+    "type": "function"
+}, {
+    "inputs": [],
+    "name": "withdrawQueueLength",
+    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+    "stateMutability": "view",
+    "type": "function"
+}]
+
+ERC20_BALANCE_ABI = [{
+    "inputs": [{"internalType": "address", "name": "account", "type": "address"}],
+    "name": "balanceOf",
+    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+    "stateMutability": "view",
+    "type": "function"
+}]
+
+# Virtual shares/assets used by Morpho Blue's SharesMathLib
+VIRTUAL_SHARES = 10**6
+VIRTUAL_ASSETS = 1
+
+def get_vault_supply_assets(market_ids: List[str], vault_address: str = NEW_METAMORPH_VAULT_ADDRESS):
+    """
+    Return the vault's supplied assets (in loan token units) for each market id,
+    rounded down like `_accruedSupplyBalance` (interest since the last update is not accrued).
+    """
+    morpho = get_w3().eth.contract(address=MORPHO_ADDRESS, abi=MORPHO_ABI)
+    supplied = {}
+    for market_id in market_ids:
+        supply_shares, _, _ = morpho.functions.position(market_id, vault_address).call()
+        total_supply_assets, total_supply_shares, *_ = morpho.functions.market(market_id).call()
+        supplied[market_id] = (
+            supply_shares * (total_supply_assets + VIRTUAL_ASSETS)
+            // (total_supply_shares + VIRTUAL_SHARES)
+        )
+    return supplied
+
+def get_vault_caps(market_ids: List[str], vault_address: str = NEW_METAMORPH_VAULT_ADDRESS):
+    """
+    Return the vault's supply cap (in loan token units) for each market id,
+    0 for markets the vault has not enabled.
+    """
+    vault = get_w3().eth.contract(address=vault_address, abi=VAULT_STATE_ABI)
+    caps = {}
+    for market_id in market_ids:
+        cap, enabled, _ = vault.functions.config(market_id).call()
+        caps[market_id] = cap if enabled else 0
+    return caps
+
+# -------------------------------------------------------------------------
+# 9. Example: Using the newly created vault
 # -------------------------------------------------------------------------
 def main():
+    from web3 import Web3
+
+    get_w3()
     print("✓ Connected to local fork.\n")
 
     # Example MarketParams
@@ -195,7 +350,7 @@ def main():
         print("Reallocate transaction not sent or failed.")
 
 # -------------------------------------------------------------------------
-# 9. Run if called directly
+# 10. Run if called directly
 # -------------------------------------------------------------------------
 if __name__ == "__main__":
     main()
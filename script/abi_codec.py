@@ -0,0 +1,131 @@
+import time
+from functools import lru_cache
+from typing import List, Sequence, Tuple, Union, Any
+
+# eth_hash directly: eth_utils would add ~200ms to the import of every script using the codec
+from eth_hash.auto import keccak
+
+MarketParamsTuple = Tuple[str, str, str, str, int]
+
+# Canonical signatures of the vault/Morpho calls we encode (MarketParams is a static tuple)
+MARKET_PARAMS_TYPE = "(address,address,address,address,uint256)"
+SIGNATURES = {
+    "reallocate":          f"reallocate(({MARKET_PARAMS_TYPE},uint256)[])",
+    "submitCap":           f"submitCap({MARKET_PARAMS_TYPE},uint256)",
+    "acceptCap":           f"acceptCap({MARKET_PARAMS_TYPE})",
+    "setSupplyQueue":      "setSupplyQueue(bytes32[])",
+    "updateWithdrawQueue": "updateWithdrawQueue(uint256[])",
+    "accrueInterest":      f"accrueInterest({MARKET_PARAMS_TYPE})",
+}
+SELECTORS = {name: keccak(signature.encode())[:4] for name, signature in SIGNATURES.items()}
+
+_OFFSET_WORD = (32).to_bytes(32, "big")
+
+def _uint256(value: int) -> bytes:
+    return value.to_bytes(32, "big")
+
+def _address(address: str) -> bytes:
+    raw = bytes.fromhex(address[2:] if address.startswith(("0x", "0X")) else address)
+    if len(raw) != 20:
+        raise ValueError(f"Invalid address: {address}")
+    return bytes(12) + raw
+
+def _bytes32(value: str) -> bytes:
+    raw = bytes.fromhex(value[2:] if value.startswith(("0x", "0X")) else value)
+    if len(raw) != 32:
+        raise ValueError(f"Invalid bytes32 (got {len(raw)} bytes): {value}")
+    return raw
+
+def market_params_tuple(market_params: Any) -> MarketParamsTuple:
+    if isinstance(market_params, tuple):
+        return market_params
+    return (market_params.loan_token, market_params.collateral_token,
+            market_params.oracle, market_params.irm, market_params.lltv)
+
+@lru_cache(maxsize=4096)
+def encode_market_params(market_params: MarketParamsTuple) -> bytes:
+    """ABI-encode a `MarketParams` tuple (5 words); cached since vaults reuse few markets."""
+    loan_token, collateral_token, oracle, irm, lltv = market_params
+    return (_address(loan_token) + _address(collateral_token)
+            + _address(oracle) + _address(irm) + _uint256(lltv))
+
+AllocationLike = Union[Any, Tuple[MarketParamsTuple, int]]
+
+def encode_reallocate(allocations: Sequence[AllocationLike]) -> bytes:
+    """
+    Encode the calldata of `reallocate(MarketAllocation[])`.
+
+    Args:
+        allocations: `MarketAllocation` dataclasses or compact
+            `((loanToken, collateralToken, oracle, irm, lltv), assets)` tuples
+
+    Returns:
+        bytes: Calldata, identical to web3's encoding
+    """
+    parts = [SELECTORS["reallocate"], _OFFSET_WORD, _uint256(len(allocations))]
+    for allocation in allocations:
+        if isinstance(allocation, tuple):
+            market_params, assets = allocation
+        else:
+            market_params, assets = allocation.market_params, allocation.assets
+        parts.append(encode_market_params(market_params_tuple(market_params)))
+        parts.append(_uint256(assets))
+    return b"".join(parts)
+
+def encode_reallocate_many(candidates: Sequence[Sequence[AllocationLike]]) -> List[bytes]:
+    """Encode the calldata of many `reallocate` calls."""
+    return [encode_reallocate(allocations) for allocations in candidates]
+
+def encode_submit_cap(market_params: Any, new_supply_cap: int) -> bytes:
+    """Encode `submitCap(MarketParams,uint256)`."""
+    return SELECTORS["submitCap"] + encode_market_params(market_params_tuple(market_params)) + _uint256(new_supply_cap)
+
+def encode_accept_cap(market_params: Any) -> bytes:
+    """Encode `acceptCap(MarketParams)`."""
+    return SELECTORS["acceptCap"] + encode_market_params(market_params_tuple(market_params))
+
+def encode_accrue_interest(market_params: Any) -> bytes:
+    """Encode Morpho's `accrueInterest(MarketParams)`."""
+    return SELECTORS["accrueInterest"] + encode_market_params(market_params_tuple(market_params))
+
+def encode_set_supply_queue(market_ids: Sequence[str]) -> bytes:
+    """Encode `setSupplyQueue(Id[])`; every id must be exactly 32 bytes."""
+    words = [_bytes32(market_id) for market_id in market_ids]
+    return SELECTORS["setSupplyQueue"] + _OFFSET_WORD + _uint256(len(words)) + b"".join(words)
+
+def encode_update_withdraw_queue(indexes: Sequence[int]) -> bytes:
+    """Encode `updateWithdrawQueue(uint256[])`."""
+    return (SELECTORS["updateWithdrawQueue"] + _OFFSET_WORD + _uint256(len(indexes))
+            + b"".join(_uint256(index) for index in indexes))
+
+def compare_with_web3(candidates: Sequence[Sequence[Any]]) -> dict:
+    """
+    Check `encode_reallocate` byte-for-byte against web3 and compare throughput.
+
+    Args:
+        candidates: Lists of `MarketAllocation` dataclasses
+
+    Returns:
+        dict: Whether all calldatas match and both encoders' calls per second
+    """
+    from web3 import Web3
+    from Scripter import REALLOCATE_ABI, NEW_METAMORPH_VAULT_ADDRESS, format_allocations
+
+    contract = Web3().eth.contract(address=NEW_METAMORPH_VAULT_ADDRESS, abi=REALLOCATE_ABI)
+
+    started = time.perf_counter()
+    expected = [
+        bytes.fromhex(contract.encode_abi("reallocate", args=[format_allocations(allocations)])[2:])
+        for allocations in candidates
+    ]
+    web3_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    actual = encode_reallocate_many(candidates)
+    codec_time = time.perf_counter() - started
+
+    return {
+        "match": actual == expected,
+        "web3_per_second": len(candidates) / web3_time if web3_time else float("inf"),
+        "codec_per_second": len(candidates) / codec_time if codec_time else float("inf"),
+    }
@@ -0,0 +1,353 @@
+import calendar
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict, field
+from typing import Dict, Iterator, List, Optional, Tuple, Any
+
+import numpy as np
+from pulp import PULP_CBC_CMD
+
+from main import MorphoMarketOptimizer, solve_allocation
+from replay_archive import ReplayArchive
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+Snapshot = Tuple[float, List[Dict[str, Any]]]
+
+def _parse_db_timestamp(value: str) -> float:
+    return float(calendar.timegm(time.strptime(value, "%Y-%m-%d %H:%M:%S")))
+
+def _format_db_timestamp(value: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(value))
+
+def iter_db_snapshots(db_path: str, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Snapshot]:
+    """
+    Stream market snapshots from the `markets` table in time order.
+
+    Rows stored in the same second form one snapshot. Rows are read through
+    the cursor, so only one snapshot is held in memory at a time.
+
+    Args:
+        db_path (str): Path to the SQLite database
+        start (Optional[float]): First Unix time included
+        end (Optional[float]): Last Unix time included
+
+    Yields:
+        Snapshot: Unix time and markets in the format of `_parse_market_data`
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute("""
+            SELECT unique_key, token_symbol, token_address, supply_apy, borrow_apy,
+                   utilization, lltv, max_supply, risk, timestamp
+            FROM markets
+            WHERE timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp, id
+        """, (
+            _format_db_timestamp(start) if start is not None else "",
+            _format_db_timestamp(end) if end is not None else "9999-12-31 23:59:59",
+        ))
+
+        current, markets = None, []
+        for key, symbol, address, supply_apy, borrow_apy, utilization, lltv, max_supply, risk, stamp in cursor:
+            if stamp != current:
+                if markets:
+                    yield _parse_db_timestamp(current), markets
+                current, markets = stamp, []
+            markets.append({
+                "market": key,
+                "token": {"symbol": symbol, "address": address},
+                "supply_apy": supply_apy or 0.0,
+                "borrow_apy": borrow_apy or 0.0,
+                "utilization": utilization or 0.0,
+                "lltv": lltv or 0.0,
+                "max_supply": max_supply or 0.0,
+                "risk": risk or 0.0,
+            })
+        if markets:
+            yield _parse_db_timestamp(current), markets
+    finally:
+        conn.close()
+
+def iter_archive_snapshots(directory: str, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Snapshot]:
+    """Stream market snapshots from a replay archive in time order (see `iter_db_snapshots`)."""
+    for timestamp, payload in ReplayArchive(directory).records(start, end):
+        yield timestamp, MorphoMarketOptimizer._parse_market_data(json.loads(payload))
+
+def iter_columnar_snapshots(directory: str, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Snapshot]:
+    """Stream market snapshots from the exported columnar history (see `columnar_store.py`)."""
+    from columnar_store import HistoryReader
+
+    yield from HistoryReader(directory).snapshots(start, end)
+
+SOURCES = {
+    "db": iter_db_snapshots,
+    "archive": iter_archive_snapshots,
+    "columnar": iter_columnar_snapshots,
+}
+
+def source_time_range(source: str, location: str) -> Optional[Tuple[float, float]]:
+    """Return the first and last snapshot times of a source."""
+    if source == "archive":
+        return ReplayArchive(location).time_range()
+    if source == "columnar":
+        from columnar_store import HistoryReader
+
+        return HistoryReader(location).time_range()
+
+    conn = sqlite3.connect(location)
+    try:
+        first, last = conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM markets").fetchone()
+    finally:
+        conn.close()
+    if first is None:
+        return None
+    return _parse_db_timestamp(first), _parse_db_timestamp(last)
+
+@dataclass
+class BacktestConfig:
+    available_funds: float = 1_000_000
+    max_risk: float = 0.2
+    max_utilization: float = 0.85
+    gas_cost_per_leg: float = 0.0
+    turnover_cost: float = 0.0
+    min_trade_size: float = 0.0
+    holding_period_days: float = 30.0
+    # Re-optimize every n-th snapshot, hold the allocation in between
+    rebalance_every: int = 1
+
+@dataclass
+class BacktestResult:
+    timestamps: np.ndarray
+    expected_return: np.ndarray
+    realized_return: np.ndarray
+    turnover: np.ndarray
+    utilization_breaches: np.ndarray
+    risk_breaches: np.ndarray
+    capacity_breaches: np.ndarray
+    solves: int = 0
+    config: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def concatenate(cls, parts: List["BacktestResult"]) -> "BacktestResult":
+        arrays = {
+            name: np.concatenate([getattr(part, name) for part in parts])
+            for name in ("timestamps", "expected_return", "realized_return", "turnover",
+                         "utilization_breaches", "risk_breaches", "capacity_breaches")
+        }
+        return cls(**arrays, solves=sum(part.solves for part in parts),
+                   config=parts[0].config if parts else {})
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregate the per-step series."""
+        if not len(self.timestamps):
+            return {"steps": 0}
+
+        funds = self.config.get("available_funds", 1.0)
+        elapsed = float(self.timestamps[-1] - self.timestamps[0])
+        realized = float(self.realized_return.sum())
+        return {
+            "steps": int(len(self.timestamps)),
+            "solves": self.solves,
+            "start": _format_db_timestamp(self.timestamps[0]),
+            "end": _format_db_timestamp(self.timestamps[-1]),
+            "expected_return": float(self.expected_return.sum()),
+            "realized_return": realized,
+            "realized_apy": realized / funds * SECONDS_PER_YEAR / elapsed if elapsed > 0 else 0.0,
+            "tracking_error": float(np.std(self.realized_return - self.expected_return)),
+            "turnover": float(self.turnover.sum()),
+            "utilization_breaches": int(np.count_nonzero(self.utilization_breaches)),
+            "risk_breaches": int(np.count_nonzero(self.risk_breaches)),
+            "capacity_breaches": int(np.count_nonzero(self.capacity_breaches)),
+        }
+
+def _run_window(source: str, location: str, start: Optional[float], end: Optional[float],
+                config: BacktestConfig) -> BacktestResult:
+    """
+    Backtest the snapshots in [start, end].
+
+    The allocation chosen at each snapshot is held until the next one and
+    earns that next snapshot's APYs; the first snapshot after `end` is read
+    only to realize the last holding period. The previous allocation is the
+    warm state of every solve, and unchanged market inputs reuse it without
+    solving.
+    """
+    solver = PULP_CBC_CMD(msg=False)
+    snapshots = SOURCES[source](location, start, None)
+
+    timestamps, expected, realized, turnover = [], [], [], []
+    utilization_breaches, risk_breaches, capacity_breaches = [], [], []
+    solves = 0
+
+    positions: Optional[Dict[str, float]] = None
+    previous_inputs = None
+    held: Optional[Tuple[float, List[str], np.ndarray, np.ndarray]] = None
+
+    for step, (timestamp, markets) in enumerate(snapshots):
+        by_key = {market["market"]: market for market in markets}
+
+        # Realize the holding period that ends at this snapshot
+        if held is not None:
+            held_at, keys, amounts, apys = held
+            dt = (timestamp - held_at) / SECONDS_PER_YEAR
+            later = [by_key.get(key) for key in keys]
+            apy_next = np.array([m["supply_apy"] if m else 0.0 for m in later])
+            utilization_next = np.array([m["utilization"] if m else 1.0 for m in later])
+            risk_next = np.array([m["risk"] if m else 1.0 for m in later])
+            max_supply_next = np.array([m["max_supply"] if m else 0.0 for m in later])
+
+            timestamps.append(held_at)
+            expected.append(float(amounts @ apys) * dt)
+            realized.append(float(amounts @ apy_next) * dt)
+            utilization_breaches.append(
+                amounts @ utilization_next > config.max_utilization * config.available_funds + 1e-6)
+            risk_breaches.append(amounts @ risk_next > config.max_risk * config.available_funds + 1e-6)
+            capacity_breaches.append(int(np.count_nonzero(amounts > max_supply_next + 1e-6)))
+
+        if end is not None and timestamp > end:
+            break
+
+        if positions is None or step % config.rebalance_every == 0:
+            inputs = tuple(sorted(
+                (m["market"], m["supply_apy"], m["utilization"], m["max_supply"], m["risk"]) for m in markets
+            ))
+            if inputs != previous_inputs:
+                try:
+                    allocation = solve_allocation(
+                        markets,
+                        config.available_funds,
+                        max_risk=config.max_risk,
+                        max_utilization=config.max_utilization,
+                        current_positions=positions,
+                        gas_cost_per_leg=config.gas_cost_per_leg,
+                        turnover_cost=config.turnover_cost,
+                        min_trade_size=config.min_trade_size,
+                        holding_period_days=config.holding_period_days,
+                        solver=solver
+                    )
+                except ValueError as e:
+                    if positions is None:
+                        raise
+                    # Held positions past the new limits with nowhere to move them: hold on
+                    logger.warning(f"Keeping the positions at {timestamp}: {str(e)}")
+                    allocation = positions
+                allocation = {key: amount for key, amount in allocation.items() if amount}
+                solves += 1
+                previous_inputs = inputs
+
+                # The first allocation of a window is its starting point, not turnover
+                if positions is not None:
+                    keys = list(set(positions) | set(allocation))
+                    moved = np.abs(np.array([allocation.get(k, 0.0) - positions.get(k, 0.0) for k in keys]))
+                    turnover.append(float(moved.sum()))
+                else:
+                    turnover.append(0.0)
+                positions = allocation
+            else:
+                turnover.append(0.0)
+        else:
+            turnover.append(0.0)
+
+        keys = list(positions)
+        held = (
+            timestamp,
+            keys,
+            np.array([positions[key] for key in keys]),
+            np.array([by_key[key]["supply_apy"] if key in by_key else 0.0 for key in keys]),
+        )
+
+    steps = len(timestamps)
+    return BacktestResult(
+        timestamps=np.array(timestamps),
+        expected_return=np.array(expected),
+        realized_return=np.array(realized),
+        turnover=np.array(turnover[:steps]),
+        utilization_breaches=np.array(utilization_breaches, dtype=bool),
+        risk_breaches=np.array(risk_breaches, dtype=bool),
+        capacity_breaches=np.array(capacity_breaches, dtype=int),
+        solves=solves,
+        config=asdict(config),
+    )
+
+class Backtester:
+    def __init__(self, source: str = "db", location: str = "morpho_markets.db",
+                 config: Optional[BacktestConfig] = None):
+        """
+        Replay the allocation strategy over stored market snapshots.
+
+        Args:
+            source (str): "db" for the `markets` table, "archive" for a replay
+                archive or "columnar" for the exported columnar history
+            location (str): Database path, archive or columnar history directory
+            config (Optional[BacktestConfig]): Strategy parameters
+        """
+        if source not in SOURCES:
+            raise ValueError(f"Unknown source {source!r}, expected one of {list(SOURCES)}")
+        self.source = source
+        self.location = location
+        self.config = config or BacktestConfig()
+
+    def run(self, start: Optional[float] = None, end: Optional[float] = None,
+            workers: Optional[int] = None) -> BacktestResult:
+        """
+        Backtest the period [start, end], split across worker processes.
+
+        Each worker takes a contiguous window and starts from a fresh
+        allocation at its first snapshot, so turnover at window boundaries is
+        not counted.
+
+        Args:
+            start (Optional[float]): First Unix time, the first snapshot by default
+            end (Optional[float]): Last Unix time, the last snapshot by default
+            workers (Optional[int]): Number of processes, the CPU count by default
+
+        Returns:
+            BacktestResult: Per-step series in time order
+        """
+        time_range = source_time_range(self.source, self.location)
+        if time_range is None:
+            raise ValueError(f"No snapshots in {self.location}")
+        start = time_range[0] if start is None else max(start, time_range[0])
+        end = time_range[1] if end is None else min(end, time_range[1])
+        workers = max(1, workers or os.cpu_count() or 1)
+
+        started = time.perf_counter()
+        if workers == 1:
+            result = _run_window(self.source, self.location, start, end, self.config)
+        else:
+            # Whole-second bounds (the database's resolution); windows are half-open except the last one
+            bounds = np.floor(np.linspace(start, end, workers + 1))
+            windows = [(bounds[i], bounds[i + 1] - 1e-6 if i < workers - 1 else end)
+                       for i in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parts = list(executor.map(
+                    _run_window,
+                    [self.source] * workers,
+                    [self.location] * workers,
+                    [float(window_start) for window_start, _ in windows],
+                    [float(window_end) for _, window_end in windows],
+                    [self.config] * workers,
+                ))
+            result = BacktestResult.concatenate(parts)
+
+        logger.info(f"Backtested {len(result.timestamps)} snapshots ({result.solves} solves) "
+                    f"on {workers} workers in {time.perf_counter() - started:.2f}s")
+        return result
+
+def main():
+    backtester = Backtester()
+    try:
+        result = backtester.run()
+        print(json.dumps(result.summary(), indent=2))
+    except Exception as e:
+        logger.error(f"Error while backtesting: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Offline benchmark suite of the data pipeline.
+
+Times parsing, storing, reading back and analyzing market data and the
+full `optimize_allocation` path at several market counts, against the
+local stub API of synthetic_markets.py, and compares the results with a
+stored baseline to flag regressions.
+"""
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from main import DatabaseManager, MorphoMarketOptimizer
+from synthetic_markets import StubMorphoAPI, generate_markets
+
+logger = logging.getLogger(__name__)
+
+SCALES = (100, 1_000, 10_000, 100_000)
+BENCHMARKS = ("parse", "store", "history", "trends", "optimize")
+# Rows of history stored before timing the reads, split across snapshots
+HISTORY_ROWS = 500_000
+MAX_HISTORY_SNAPSHOTS = 48
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(PROJECT_ROOT, "benchmarks", "results.json")
+BASELINE_FILE = os.path.join(PROJECT_ROOT, "benchmarks", "baseline.json")
+
+def _best_of(func: Callable[[], object], repeats: int) -> float:
+    """Best wall time of `repeats` calls, with the garbage collector off while timing."""
+    best = float("inf")
+    for _ in range(repeats):
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - started)
+        finally:
+            gc.enable()
+    return best
+
+def run_benchmarks(scales: Sequence[int] = SCALES,
+                   benchmarks: Sequence[str] = BENCHMARKS,
+                   repeats: int = 3,
+                   seed: int = 0) -> Dict[str, object]:
+    """
+    Run the benchmarks at every scale.
+
+    Each scale gets a fresh database in a temporary directory and a stub API
+    serving that many synthetic markets, so nothing touches the network.
+    "history" and "trends" read one market out of a table holding about
+    `HISTORY_ROWS` rows of earlier snapshots; "optimize" includes the
+    fetch from the stub, parse, store and solve.
+
+    Args:
+        scales (Sequence[int]): Market counts
+        benchmarks (Sequence[str]): Benchmarks to run, all by default
+        repeats (int): Runs per benchmark, the best one is kept
+        seed (int): Seed of the synthetic markets
+
+    Returns:
+        Dict[str, object]: Environment and `{"<benchmark>[<markets>]": seconds}` results
+    """
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {sorted(unknown)}, expected some of {list(BENCHMARKS)}")
+
+    from pulp import PULP_CBC_CMD
+
+    # Silent CBC: its log would be timed along with the solve
+    solver = PULP_CBC_CMD(msg=False)
+    results: Dict[str, float] = {}
+    with StubMorphoAPI(n_markets=10, seed=seed) as stub, tempfile.TemporaryDirectory() as workdir:
+        # Warm-up, so the first scale is not charged for imports and the first solver start
+        warmup = MorphoMarketOptimizer(api_url=stub.url, db=DatabaseManager(os.path.join(workdir, "warmup.db")))
+        warmup.optimize_allocation(available_funds=1_000_000, solver=solver)
+
+        for n_markets in scales:
+            logger.info(f"Benchmarking {n_markets} markets")
+            stub.set_markets(n_markets, seed)
+            response = generate_markets(n_markets, seed)
+            db = DatabaseManager(os.path.join(workdir, f"bench-{n_markets}.db"), persistent=True)
+            optimizer = MorphoMarketOptimizer(api_url=stub.url, db=db)
+            markets = optimizer._parse_market_data(response)
+
+            def record(name: str, func: Callable[[], object], runs: int = repeats):
+                if name in benchmarks:
+                    results[f"{name}[{n_markets}]"] = _best_of(func, runs)
+                    logger.info(f"  {name}: {results[f'{name}[{n_markets}]'] * 1000:.1f}ms")
+
+            record("parse", lambda: optimizer._parse_market_data(response))
+            record("store", lambda: db.store_market_data(markets))
+
+            if "history" in benchmarks or "trends" in benchmarks:
+                # Earlier snapshots, an hour apart, for the reads to search through
+                snapshots = max(2, min(MAX_HISTORY_SNAPSHOTS, HISTORY_ROWS // n_markets))
+                now = time.time()
+                for i in range(snapshots):
+                    db.store_market_data(markets, timestamp=now - (snapshots - i) * 3600)
+                key = markets[0]["market"]
+                record("history", lambda: db.get_historical_market_data(key, days=30))
+                record("trends", lambda: optimizer.analyze_market_trends(key, days=30))
+
+            record("optimize", lambda: optimizer.optimize_allocation(available_funds=1_000_000, solver=solver))
+
+            optimizer.session.close()
+            db.close()
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "repeats": repeats,
+        "results": results,
+    }
+
+def compare(results: Dict[str, object],
+            baseline: Dict[str, object],
+            tolerance: float = 0.25,
+            noise_floor: float = 0.002) -> List[str]:
+    """
+    List the benchmarks slower than the baseline by more than `tolerance`.
+
+    Differences under `noise_floor` seconds are ignored, so the fastest
+    benchmarks do not flag on timer jitter.
+
+    Args:
+        results (Dict[str, object]): Output of `run_benchmarks`
+        baseline (Dict[str, object]): Earlier output of `run_benchmarks`
+        tolerance (float): Allowed relative slowdown
+        noise_floor (float): Smallest slowdown in seconds reported
+
+    Returns:
+        List[str]: One line per regression
+    """
+    regressions = []
+    for name, seconds in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        if seconds > reference * (1 + tolerance) and seconds - reference > noise_floor:
+            regressions.append(f"{name}: {seconds * 1000:.1f}ms vs {reference * 1000:.1f}ms "
+                               f"({seconds / reference - 1:+.0%})")
+    return regressions
+
+def save_results(results: Dict[str, object], path: str = RESULTS_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def load_results(path: str = BASELINE_FILE) -> Optional[Dict[str, object]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def main():
+    try:
+        results = run_benchmarks()
+        save_results(results)
+        for name, seconds in results["results"].items():
+            print(f"{name:>24}: {seconds * 1000:10.2f}ms")
+
+        baseline = load_results()
+        if baseline is None:
+            save_results(results, BASELINE_FILE)
+            print(f"No baseline yet, saved these results as {BASELINE_FILE}")
+            return
+        regressions = compare(results, baseline)
+        for line in regressions:
+            print(f"Regression: {line}")
+        if regressions:
+            sys.exit(1)
+    except Exception as e:
+        logger.error(f"Error while benchmarking: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Command line entry point.
+
+Each subcommand imports what it needs when it runs, so `--help` and the
+light commands start without loading PuLP, requests, web3 or NumPy and
+without connecting to a node.
+"""
+import argparse
+import json
+import sys
+
+def cmd_fetch(args):
+    from main import MorphoMarketOptimizer
+
+    optimizer = MorphoMarketOptimizer(api_url=args.api_url)
+    if args.stream:
+        print(f"Streamed and stored {optimizer.stream_market_data(args.batch_size)} markets")
+        return
+    markets = optimizer.fetch_market_data()
+    print(f"Fetched and stored {len(markets)} markets")
+
+def cmd_optimize(args):
+    from main import MorphoMarketOptimizer
+
+    allocations = MorphoMarketOptimizer(api_url=args.api_url).optimize_allocation(
+        available_funds=args.funds,
+        max_risk=args.max_risk,
+        max_utilization=args.max_utilization,
+        robust=args.robust
+    )
+    print("\nOptimized Allocations:")
+    for market, amount in allocations.items():
+        if amount:
+            print(f"{market}: ${amount:,.2f}")
+
+def cmd_trends(args):
+    from main import MorphoMarketOptimizer
+
+    history = None
+    if args.history:
+        from columnar_store import HistoryReader
+        history = HistoryReader(args.history)
+    print(json.dumps(MorphoMarketOptimizer(history=history).analyze_market_trends(args.market, args.days), indent=2))
+
+def cmd_reallocate(args):
+    from main import MorphoMarketOptimizer
+    from reallocation import USDC_ADDRESS, execute_optimized_allocation
+
+    receipts = execute_optimized_allocation(
+        MorphoMarketOptimizer(api_url=args.api_url),
+        max_risk=args.max_risk,
+        max_utilization=args.max_utilization,
+        loan_token=args.loan_token or USDC_ADDRESS,
+        gas_cost_per_leg=args.gas_cost_per_leg,
+        min_trade_size=args.min_trade_size
+    )
+    sent = [receipt for receipt in receipts if receipt]
+    print(f"Sent {len(sent)}/{len(receipts)} reallocate transaction(s)")
+
+def cmd_serve(args):
+    import asyncio
+    from main import MorphoMarketOptimizer
+    from service import AllocationService
+
+    service = AllocationService(MorphoMarketOptimizer(api_url=args.api_url),
+                                refresh_interval=args.refresh_interval, workers=args.workers)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+def cmd_pipeline(args):
+    import asyncio
+    from main import MorphoMarketOptimizer
+    from pipeline import PipelineOrchestrator
+
+    orchestrator = PipelineOrchestrator(
+        MorphoMarketOptimizer(api_url=args.api_url),
+        solve_params={
+            "available_funds": args.funds,
+            "max_risk": args.max_risk,
+            "max_utilization": args.max_utilization,
+        },
+        interval=args.interval,
+        queue_size=args.queue_size
+    )
+    asyncio.run(orchestrator.run(args.cycles))
+
+def cmd_benchmark(args):
+    import benchmark
+
+    # The defaults live in the project root, wherever the CLI is run from
+    output = args.output or benchmark.RESULTS_FILE
+    baseline_path = args.baseline or benchmark.BASELINE_FILE
+
+    results = benchmark.run_benchmarks(args.scales, args.only or benchmark.BENCHMARKS, args.repeats)
+    benchmark.save_results(results, output)
+    for name, seconds in results["results"].items():
+        print(f"{name:>24}: {seconds * 1000:10.2f}ms")
+
+    if args.update_baseline:
+        benchmark.save_results(results, baseline_path)
+        print(f"Saved as the baseline {baseline_path}")
+        return
+    baseline = benchmark.load_results(baseline_path)
+    if baseline is None:
+        print(f"No baseline at {baseline_path}, run with --update-baseline to create it")
+        return
+    regressions = benchmark.compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"Regression: {line}")
+    if regressions:
+        sys.exit(1)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="Morpho market data, allocation and reallocation")
+    parser.add_argument("--api-url", default="https://blue-api.morpho.org/graphql", help="Morpho API URL")
+    parser.add_argument("--profile", nargs="?", const="1", metavar="DIR",
+                        help="Profile the hot paths into DIR (profiles/<time>-<pid> by default)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch = commands.add_parser("fetch", help="Fetch and store the current market data")
+    fetch.add_argument("--stream", action="store_true",
+                       help="Parse and store the response as it arrives, in constant memory")
+    fetch.add_argument("--batch-size", type=int, default=1000, help="Rows per insert when streaming")
+    fetch.set_defaults(func=cmd_fetch)
+
+    limit_args = argparse.ArgumentParser(add_help=False)
+    limit_args.add_argument("--max-risk", type=float, default=0.2, help="Maximum weighted risk")
+    limit_args.add_argument("--max-utilization", type=float, default=0.85, help="Maximum weighted utilization")
+    allocation_args = argparse.ArgumentParser(add_help=False, parents=[limit_args])
+    allocation_args.add_argument("--funds", type=float, default=1_000_000, help="Funds to allocate in USD")
+
+    optimize = commands.add_parser("optimize", parents=[allocation_args], help="Optimize the allocation")
+    optimize.add_argument("--robust", choices=["cvar", "worst_case"], help="Optimize against historical scenarios")
+    optimize.set_defaults(func=cmd_optimize)
+
+    trends = commands.add_parser("trends", help="Historical statistics of a market")
+    trends.add_argument("market", help="Market unique key")
+    trends.add_argument("--days", type=int, default=30, help="Days of history")
+    trends.add_argument("--history", metavar="DIR", help="Read the columnar history export in DIR instead of the database")
+    trends.set_defaults(func=cmd_trends)
+
+    # The vault's current positions are the funds reallocated
+    reallocate = commands.add_parser("reallocate", parents=[limit_args],
+                                     help="Optimize and send the vault reallocation")
+    reallocate.add_argument("--loan-token", help="Loan token of the vault, USDC by default")
+    reallocate.add_argument("--gas-cost-per-leg", type=float, default=5.0, help="Gas cost in USD per market touched")
+    reallocate.add_argument("--min-trade-size", type=float, default=1_000, help="Smallest move in USD")
+    reallocate.set_defaults(func=cmd_reallocate)
+
+    serve = commands.add_parser("serve", help="Run the HTTP allocation service")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--workers", type=int, default=4, help="Solver processes")
+    serve.add_argument("--refresh-interval", type=float, default=60.0, help="Seconds between snapshot refreshes")
+    serve.set_defaults(func=cmd_serve)
+
+    pipeline = commands.add_parser("pipeline", parents=[allocation_args],
+                                   help="Poll, store and optimize continuously, with the stages overlapped")
+    pipeline.add_argument("--interval", type=float, default=60.0, help="Seconds between polls, 0 for back to back")
+    pipeline.add_argument("--cycles", type=int, help="Number of polls, unbounded by default")
+    pipeline.add_argument("--queue-size", type=int, default=1, help="Snapshots fetched ahead of the solver")
+    pipeline.set_defaults(func=cmd_pipeline)
+
+    suite = commands.add_parser("benchmark", help="Run the offline pipeline benchmarks against a baseline")
+    suite.add_argument("--scales", type=int, nargs="+", default=[100, 1_000, 10_000, 100_000],
+                       help="Market counts")
+    suite.add_argument("--only", nargs="+", choices=["parse", "store", "history", "trends", "optimize"],
+                       help="Benchmarks to run, all by default")
+    suite.add_argument("--repeats", type=int, default=3, help="Runs per benchmark, the best one is kept")
+    suite.add_argument("--output", help="Results file, benchmarks/results.json in the project root by default")
+    suite.add_argument("--baseline", help="Baseline file, benchmarks/baseline.json in the project root by default")
+    suite.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown")
+    suite.add_argument("--update-baseline", action="store_true", help="Save the results as the new baseline")
+    suite.set_defaults(func=cmd_benchmark)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        # Before the command imports main and Scripter, whose hot paths check it
+        import profiling
+        profiling.enable(args.profile)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import glob
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for the columnar history
+    pa = None
+
+from main import DatabaseManager
+from stress_test import HISTORY_FIELDS, align_history
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoint.json"
+EXTENSIONS = {"arrow": ".arrow", "parquet": ".parquet"}
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("The columnar history requires the pyarrow package")
+
+def market_schema() -> "pa.Schema":
+    """Arrow schema of the exported `markets` rows."""
+    _require_pyarrow()
+    return pa.schema([
+        ("id", pa.int64()),
+        ("unique_key", pa.dictionary(pa.int32(), pa.string())),
+        ("token_symbol", pa.dictionary(pa.int32(), pa.string())),
+        ("token_address", pa.dictionary(pa.int32(), pa.string())),
+        ("supply_apy", pa.float64()),
+        ("borrow_apy", pa.float64()),
+        ("utilization", pa.float64()),
+        ("lltv", pa.float64()),
+        ("max_supply", pa.float64()),
+        ("risk", pa.float64()),
+        ("timestamp", pa.int64()),
+    ])
+
+def _load_checkpoint(directory: str) -> int:
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)["last_id"]
+
+def _save_checkpoint(directory: str, last_id: int):
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"last_id": last_id}, f)
+    os.replace(path + ".tmp", path)
+
+def _write_partition(directory: str, day: str, batch: "pa.RecordBatch", file_format: str):
+    partition = os.path.join(directory, f"date={day}")
+    os.makedirs(partition, exist_ok=True)
+    first_id, last_id = batch.column(0)[0].as_py(), batch.column(0)[-1].as_py()
+    path = os.path.join(partition, f"part-{first_id:012d}-{last_id:012d}{EXTENSIONS[file_format]}")
+
+    table = pa.Table.from_batches([batch])
+    if file_format == "parquet":
+        pq.write_table(table, path)
+    else:
+        # Uncompressed IPC files can be memory-mapped without decoding
+        with ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+def export_markets(db: DatabaseManager,
+                   directory: str = "history",
+                   file_format: str = "arrow",
+                   batch_size: int = 100_000) -> int:
+    """
+    Export new `markets` rows to columnar files partitioned by day.
+
+    Rows are read in id order in batches of `batch_size`, and only rows after
+    the last exported id are read, so repeated exports are incremental. Each
+    batch is written as one file per day it covers, under `date=YYYY-MM-DD/`.
+
+    Args:
+        db (DatabaseManager): Database with the `markets` table
+        directory (str): Root directory of the partitions
+        file_format (str): "arrow" (IPC, memory-mappable) or "parquet"
+        batch_size (int): Rows read and written at a time
+
+    Returns:
+        int: Number of rows exported
+    """
+    _require_pyarrow()
+    if file_format not in EXTENSIONS:
+        raise ValueError(f"Unknown format {file_format!r}, expected one of {list(EXTENSIONS)}")
+
+    os.makedirs(directory, exist_ok=True)
+    last_id = _load_checkpoint(directory)
+    schema = market_schema()
+    exported = 0
+    started = time.perf_counter()
+
+    with db.get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT id, unique_key, token_symbol, token_address, supply_apy, borrow_apy,
+                   utilization, lltv, max_supply, risk,
+                   CAST(strftime('%s', timestamp) AS INTEGER), date(timestamp)
+            FROM markets
+            WHERE id > ?
+            ORDER BY id
+        """, (last_id,))
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            columns = list(zip(*rows))
+            days = np.array(columns[-1])
+            batch = pa.RecordBatch.from_arrays([
+                pa.array(columns[0], pa.int64()),
+                pa.array(columns[1], pa.string()).dictionary_encode(),
+                pa.array(columns[2], pa.string()).dictionary_encode(),
+                pa.array(columns[3], pa.string()).dictionary_encode(),
+                # NULLs become NaN so float columns stay zero-copy readable; the
+                # readers then treat them as the SQLite readers do (see HistoryReader)
+                *[pa.array(np.array(column, dtype=float)) for column in columns[4:10]],
+                pa.array(columns[10], pa.int64()),
+            ], schema=schema)
+
+            # Ids follow insertion order, so each day is a contiguous slice
+            boundaries = np.flatnonzero(days[1:] != days[:-1]) + 1
+            for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(days)]):
+                _write_partition(directory, days[start], batch.slice(start, end - start), file_format)
+
+            exported += len(rows)
+            _save_checkpoint(directory, rows[-1][0])
+
+    logger.info(f"Exported {exported} market rows to {directory} in {time.perf_counter() - started:.2f}s")
+    return exported
+
+class HistoryReader:
+    def __init__(self, directory: str = "history"):
+        """
+        Reader of the exported market history.
+
+        Arrow IPC files are memory-mapped: columns are views on the page cache,
+        so reading millions of rows costs no more resident memory than the
+        pages actually touched. Parquet files are decoded on read.
+
+        NULL values of the `markets` table are exported as NaN and read back
+        the way the SQLite readers read them: as 0.0 in `snapshots` (like
+        `backtest.iter_db_snapshots` and the API parser), and as NaN in
+        `market_columns` and `market_history` (like
+        `DatabaseManager.get_historical_columns` and
+        `stress_test.load_market_history`), so both sources give the same results.
+
+        Args:
+            directory (str): Root directory of the partitions
+        """
+        _require_pyarrow()
+        self.directory = directory
+
+    def files(self, start_day: Optional[str] = None, end_day: Optional[str] = None) -> List[str]:
+        """Return the partition files of days in [start_day, end_day] (YYYY-MM-DD), in time order."""
+        paths = []
+        for partition in sorted(glob.glob(os.path.join(self.directory, "date=*"))):
+            day = os.path.basename(partition)[len("date="):]
+            if (start_day is None or day >= start_day) and (end_day is None or day <= end_day):
+                paths.extend(sorted(glob.glob(os.path.join(partition, "part-*"))))
+        return paths
+
+    def batches(self,
+                start_day: Optional[str] = None,
+                end_day: Optional[str] = None,
+                columns: Optional[List[str]] = None) -> Iterator["pa.RecordBatch"]:
+        """
+        Iterate over the record batches of the selected days, in time order.
+
+        Args:
+            start_day (Optional[str]): First day included (YYYY-MM-DD)
+            end_day (Optional[str]): Last day included (YYYY-MM-DD)
+            columns (Optional[List[str]]): Columns to read, all by default
+
+        Yields:
+            pa.RecordBatch: Zero-copy batches for Arrow files
+        """
+        for path in self.files(start_day, end_day):
+            yield from self._file_batches(path, columns)
+
+    @staticmethod
+    def _file_batches(path: str, columns: Optional[List[str]] = None) -> Iterator["pa.RecordBatch"]:
+        if path.endswith(EXTENSIONS["parquet"]):
+            yield from pq.read_table(path, columns=columns, memory_map=True).to_batches()
+            return
+
+        reader = ipc.open_file(pa.memory_map(path, "r"))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            yield batch.select(columns) if columns else batch
+
+    def table(self,
+              start_day: Optional[str] = None,
+              end_day: Optional[str] = None,
+              columns: Optional[List[str]] = None) -> "pa.Table":
+        """Return the selected days as one table (chunks still backed by the mapped files)."""
+        batches = list(self.batches(start_day, end_day, columns))
+        schema = market_schema()
+        if columns:
+            schema = pa.schema([schema.field(name) for name in columns])
+        return pa.Table.from_batches(batches, schema=schema)
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """Return the first and last snapshot times."""
+        files = self.files()
+        if not files:
+            return None
+        first = next(HistoryReader._file_batches(files[0], ["timestamp"])).column(0)[0].as_py()
+        *_, last = HistoryReader._file_batches(files[-1], ["timestamp"])
+        return float(first), float(last.column(0)[-1].as_py())
+
+    def market_columns(self,
+                       market_key: str,
+                       days: int = 30,
+                       fields: Tuple[str, ...] = ("supply_apy", "utilization")) -> Dict[str, np.ndarray]:
+        """
+        Read the history of one market as columns, newest first.
+
+        Same result as `DatabaseManager.get_historical_columns`, read from the
+        columnar files; timestamps are formatted like the `markets` table's.
+        """
+        since = time.time() - days * 86400
+        start_day = time.strftime("%Y-%m-%d", time.gmtime(since))
+
+        stamps, values = [], {name: [] for name in fields}
+        for batch in self.batches(start_day, columns=["unique_key", "timestamp", *fields]):
+            mask = pc.and_(pc.equal(batch.column(0).cast(pa.string()), market_key),
+                           pc.greater_equal(batch.column(1), int(since)))
+            selected = batch.filter(mask)
+            if not selected.num_rows:
+                continue
+            stamps.append(selected.column(1).to_numpy())
+            for name in fields:
+                values[name].append(selected.column(name).to_numpy())
+
+        stamps = np.concatenate(stamps) if stamps else np.empty(0, dtype=np.int64)
+        # Newest first, like the table's ORDER BY timestamp DESC
+        order = np.argsort(-stamps, kind="stable")
+        history = {"timestamp": np.array([time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(stamp))
+                                          for stamp in stamps[order]], dtype=object)}
+        for name in fields:
+            history[name] = (np.concatenate(values[name]) if values[name] else np.empty(0))[order]
+        return history
+
+    def market_history(self, market_keys: List[str], days: int = 30) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Load the history of several markets as aligned T x M matrices.
+
+        Same result as `stress_test.load_market_history`, read from the
+        columnar files one batch at a time.
+        """
+        since = time.time() - days * 86400
+        start_day = time.strftime("%Y-%m-%d", time.gmtime(since))
+        keys = pa.array(market_keys, pa.string())
+
+        stamps, column_index, values = [], [], []
+        for batch in self.batches(start_day, columns=["unique_key", "timestamp", *HISTORY_FIELDS]):
+            mask = pc.and_(pc.is_in(batch.column(0).cast(pa.string()), value_set=keys),
+                           pc.greater_equal(batch.column(1), int(since)))
+            selected = batch.filter(mask)
+            if not selected.num_rows:
+                continue
+            stamps.append(selected.column(1).to_numpy())
+            column_index.append(pc.index_in(selected.column(0).cast(pa.string()), value_set=keys).to_numpy())
+            values.append(np.column_stack([selected.column(name).to_numpy() for name in HISTORY_FIELDS]))
+
+        if not stamps:
+            return np.empty(0), {name: np.empty((0, len(market_keys))) for name in HISTORY_FIELDS}
+        return align_history(np.concatenate(stamps), np.concatenate(column_index),
+                             np.concatenate(values), len(market_keys))
+
+    def snapshots(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Tuple[float, List[Dict[str, Any]]]]:
+        """
+        Stream market snapshots in time order, like `backtest.iter_db_snapshots`.
+
+        Args:
+            start (Optional[float]): First Unix time included
+            end (Optional[float]): Last Unix time included
+
+        Yields:
+            Tuple[float, List[Dict[str, Any]]]: Unix time and markets
+        """
+        start_day = time.strftime("%Y-%m-%d", time.gmtime(start)) if start is not None else None
+        end_day = time.strftime("%Y-%m-%d", time.gmtime(end)) if end is not None else None
+
+        current, markets = None, []
+        for batch in self.batches(start_day, end_day):
+            columns = {name: batch.column(name) for name in batch.schema.names}
+            stamps = columns["timestamp"].to_numpy()
+            keep = np.ones(len(stamps), dtype=bool)
+            if start is not None:
+                keep &= stamps >= start
+            if end is not None:
+                keep &= stamps <= end
+
+            keys = columns["unique_key"].cast(pa.string()).to_pylist()
+            symbols = columns["token_symbol"].cast(pa.string()).to_pylist()
+            addresses = columns["token_address"].cast(pa.string()).to_pylist()
+            # Exported NULLs read as 0.0, as in `backtest.iter_db_snapshots`
+            numbers = {name: np.nan_to_num(columns[name].to_numpy()) for name in
+                       ("supply_apy", "borrow_apy", "utilization", "lltv", "max_supply", "risk")}
+
+            for i in np.flatnonzero(keep):
+                if stamps[i] != current:
+                    if markets:
+                        yield float(current), markets
+                    current, markets = stamps[i], []
+                market = {name: float(column[i]) for name, column in numbers.items()}
+                market["market"] = keys[i]
+                market["token"] = {"symbol": symbols[i], "address": addresses[i]}
+                markets.append(market)
+
+        if markets:
+            yield float(current), markets
+
+def main():
+    try:
+        exported = export_markets(DatabaseManager())
+        print(f"Exported {exported} market rows")
+    except Exception as e:
+        logger.error(f"Error while exporting market history: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import logging
+import random
+import signal
+import threading
+import time
+from typing import Dict, Optional, Any
+
+from main import DatabaseManager, MorphoMarketOptimizer, solve_allocation
+from metrics import record_run, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        Token-bucket rate limiter.
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (float): Maximum burst size
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take `tokens` if available, without waiting."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0, stop: Optional[threading.Event] = None) -> bool:
+        """Wait until `tokens` are available; False if `stop` is set meanwhile."""
+        while not self.try_acquire(tokens):
+            with self._lock:
+                wait = (tokens - self._tokens) / self.rate
+            if stop is not None:
+                if stop.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+        return True
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 300.0):
+        """
+        Circuit breaker around an unreliable dependency.
+
+        After `failure_threshold` consecutive failures the circuit opens and
+        calls are refused for `reset_timeout` seconds; then one trial call is
+        let through (half-open) and its outcome closes or reopens the circuit.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            reset_timeout (float): Seconds before a trial call is allowed
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        # A failure while open is the half-open trial: reopen for another timeout
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+class IngestionDaemon:
+    def __init__(self,
+                 optimizer: Optional[MorphoMarketOptimizer] = None,
+                 interval: float = 60.0,
+                 jitter: float = 0.1,
+                 max_backoff: float = 600.0,
+                 requests_per_minute: float = 30.0,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 optimize_params: Optional[Dict[str, Any]] = None):
+        """
+        Long-running poller around `MorphoMarketOptimizer`.
+
+        Ticks are scheduled on a fixed cadence of `interval` seconds (plus up
+        to `jitter` of it at random) and run one at a time in the daemon's
+        thread, so runs never overlap; ticks missed by a slow run are skipped.
+        Failed fetches are retried with exponential backoff, a circuit breaker
+        stops polling a failing API, and a token bucket caps the request rate.
+        The optimizer, its HTTP session and a persistent database connection
+        stay warm across ticks.
+
+        Args:
+            optimizer (Optional[MorphoMarketOptimizer]): Optimizer to poll with
+            interval (float): Seconds between ticks
+            jitter (float): Random extra delay as a fraction of `interval`
+            max_backoff (float): Longest retry delay in seconds
+            requests_per_minute (float): Sustained API request rate limit
+            circuit_breaker (Optional[CircuitBreaker]): Breaker of the API calls
+            optimize_params (Optional[Dict[str, Any]]): `solve_allocation`
+                parameters; when given, every snapshot is also optimized
+        """
+        self.optimizer = optimizer or MorphoMarketOptimizer(db=DatabaseManager(persistent=True))
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.rate_limiter = TokenBucket(requests_per_minute / 60.0, capacity=max(1.0, requests_per_minute / 60.0))
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.optimize_params = optimize_params
+
+        self.stop_event = threading.Event()
+        self.ticks = 0
+        self.failures = 0
+        self.last_success: Optional[float] = None
+        self.allocation: Optional[Dict[str, float]] = None
+
+    def stop(self, *_):
+        """Stop after the current tick (also the SIGINT/SIGTERM handler)."""
+        self.stop_event.set()
+
+    def _backoff(self) -> float:
+        # Exponential with "equal jitter": half fixed, half random
+        delay = min(self.max_backoff, self.interval * 2 ** (self.failures - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def tick(self) -> bool:
+        """
+        Run one poll: fetch and store a snapshot, then optimize it if configured.
+
+        Returns:
+            bool: Whether the poll succeeded
+        """
+        if not self.circuit_breaker.allow():
+            logger.info("Circuit open, skipping poll")
+            return False
+        if not self.rate_limiter.acquire(stop=self.stop_event):
+            return False
+
+        with record_run(self.optimizer.db, "daemon_tick"):
+            return self._poll()
+
+    def _poll(self) -> bool:
+        started = time.perf_counter()
+        try:
+            markets = self.optimizer.fetch_market_data()
+        except Exception as e:
+            self.failures += 1
+            self.circuit_breaker.record_failure()
+            logger.error(f"Poll failed ({self.failures} in a row): {str(e)}")
+            return False
+
+        self.failures = 0
+        self.circuit_breaker.record_success()
+        self.last_success = time.time()
+
+        if self.optimize_params is not None:
+            params = self.optimize_params
+            try:
+                self.allocation = solve_allocation(markets, **params)
+                self.optimizer.db.store_allocation_results(self.allocation, {
+                    'available_funds': params['available_funds'],
+                    'max_risk': params.get('max_risk', 0.2),
+                    'max_utilization': params.get('max_utilization', 0.85),
+                })
+            except Exception as e:
+                # The snapshot is stored; a failed solve must not stop the polling
+                logger.error(f"Optimization failed: {str(e)}")
+
+        logger.info(f"Tick {self.ticks}: {len(markets)} markets in {time.perf_counter() - started:.2f}s")
+        return True
+
+    def run(self, max_ticks: Optional[int] = None):
+        """
+        Poll until stopped (signal or `stop()`), or for `max_ticks` ticks.
+
+        Args:
+            max_ticks (Optional[int]): Number of ticks to run, unbounded by default
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+        next_tick = time.monotonic()
+        try:
+            while not self.stop_event.is_set() and (max_ticks is None or self.ticks < max_ticks):
+                ok = self.tick()
+                self.ticks += 1
+
+                now = time.monotonic()
+                if ok or not self.circuit_breaker.allow():
+                    # Stay on the cadence; skip the ticks a slow run overlapped
+                    next_tick += self.interval
+                    if next_tick < now:
+                        skipped = int((now - next_tick) // self.interval) + 1
+                        logger.warning(f"Run overran, skipping {skipped} tick(s)")
+                        next_tick += skipped * self.interval
+                    delay = next_tick - now + random.uniform(0, self.jitter * self.interval)
+                else:
+                    delay = self._backoff()
+                    next_tick = now + delay
+
+                self.stop_event.wait(max(0.0, delay))
+        finally:
+            self.optimizer.session.close()
+            self.optimizer.db.close()
+            logger.info(f"Daemon stopped after {self.ticks} ticks")
+
+def main():
+    start_metrics_server()
+    daemon = IngestionDaemon(optimize_params={
+        'available_funds': 1_000_000,
+        'max_risk': 0.2,
+        'max_utilization': 0.85,
+    })
+    daemon.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import logging
+import time
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+from web3 import Web3
+
+from main import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Canonical signatures of the MetaMorpho events we index (see EventsLib.sol, `Id` is bytes32)
+EVENT_SIGNATURES = {
+    "reallocate_supply":        "ReallocateSupply(address,bytes32,uint256,uint256)",
+    "reallocate_withdraw":      "ReallocateWithdraw(address,bytes32,uint256,uint256)",
+    "update_last_total_assets": "UpdateLastTotalAssets(uint256)",
+    "accrue_interest":          "AccrueInterest(uint256,uint256)",
+    "set_cap":                  "SetCap(address,bytes32,uint256)",
+}
+
+# Precomputed topic0 -> table
+EVENT_TOPICS = {
+    Web3.keccak(text=signature): table for table, signature in EVENT_SIGNATURES.items()
+}
+
+# Columns decoded from each event, after the common (vault, block_number, tx_hash, log_index).
+# uint256 values are stored as TEXT since they overflow SQLite integers.
+EVENT_COLUMNS = {
+    "reallocate_supply":        [("caller", "TEXT"), ("market_id", "TEXT"), ("supplied_assets", "TEXT"), ("supplied_shares", "TEXT")],
+    "reallocate_withdraw":      [("caller", "TEXT"), ("market_id", "TEXT"), ("withdrawn_assets", "TEXT"), ("withdrawn_shares", "TEXT")],
+    "update_last_total_assets": [("updated_total_assets", "TEXT")],
+    "accrue_interest":          [("new_total_assets", "TEXT"), ("fee_shares", "TEXT")],
+    "set_cap":                  [("caller", "TEXT"), ("market_id", "TEXT"), ("cap", "TEXT")],
+}
+
+def _topic_address(topic: bytes) -> str:
+    return "0x" + bytes(topic)[-20:].hex()
+
+def _words(data: bytes) -> List[str]:
+    data = bytes(data)
+    return [str(int.from_bytes(data[i:i + 32], "big")) for i in range(0, len(data), 32)]
+
+def decode_log(log: Dict[str, Any]) -> Tuple[str, Tuple]:
+    """
+    Decode a raw MetaMorpho log into its table and row.
+
+    Args:
+        log (Dict[str, Any]): Log as returned by `eth_getLogs`
+
+    Returns:
+        Tuple[str, Tuple]: Table name and row values
+    """
+    topics = log["topics"]
+    table = EVENT_TOPICS[bytes(topics[0])]
+    common = (
+        log["address"].lower(),
+        log["blockNumber"],
+        "0x" + bytes(log["transactionHash"]).hex(),
+        log["logIndex"],
+    )
+
+    indexed = []
+    if table in ("reallocate_supply", "reallocate_withdraw", "set_cap"):
+        indexed = [_topic_address(topics[1]), "0x" + bytes(topics[2]).hex()]
+
+    return table, common + tuple(indexed) + tuple(_words(log["data"]))
+
+class EventIndexer:
+    def __init__(self,
+                 w3: Web3,
+                 vault_address: str,
+                 db: Optional[DatabaseManager] = None,
+                 start_block: int = 0,
+                 reorg_depth: int = 5,
+                 initial_chunk: int = 2_000,
+                 max_chunk: int = 100_000,
+                 target_logs: int = 5_000):
+        """
+        Incrementally index MetaMorpho vault events into SQLite.
+
+        Args:
+            w3 (Web3): Connected Web3 instance
+            vault_address (str): MetaMorpho vault to index
+            db (Optional[DatabaseManager]): Database to write to
+            start_block (int): First block to index when there is no checkpoint
+            reorg_depth (int): Blocks re-indexed on every run to absorb reorgs
+            initial_chunk (int): Initial `eth_getLogs` block range
+            max_chunk (int): Largest `eth_getLogs` block range
+            target_logs (int): Chunk size grows while responses stay under this many logs
+        """
+        self.w3 = w3
+        self.vault_address = Web3.to_checksum_address(vault_address)
+        self.db = db or DatabaseManager()
+        self.start_block = start_block
+        self.reorg_depth = reorg_depth
+        self.chunk_size = initial_chunk
+        self.max_chunk = max_chunk
+        self.target_logs = target_logs
+        self.init_tables()
+
+    def init_tables(self):
+        """Initialize event and checkpoint tables if they don't exist."""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+
+            for table, columns in EVENT_COLUMNS.items():
+                column_defs = ",\n".join(f"{name} {sql_type}" for name, sql_type in columns)
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        vault TEXT NOT NULL,
+                        block_number INTEGER NOT NULL,
+                        tx_hash TEXT NOT NULL,
+                        log_index INTEGER NOT NULL,
+                        {column_defs},
+                        UNIQUE (tx_hash, log_index)
+                    )
+                """)
+                cursor.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_{table}_vault_block
+                    ON {table} (vault, block_number)
+                """)
+                if any(name == "market_id" for name, _ in columns):
+                    cursor.execute(f"""
+                        CREATE INDEX IF NOT EXISTS idx_{table}_market
+                        ON {table} (market_id, block_number)
+                    """)
+
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS indexer_checkpoints (
+                    vault TEXT PRIMARY KEY,
+                    last_block INTEGER NOT NULL,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            conn.commit()
+
+    def get_checkpoint(self) -> Optional[int]:
+        """Return the last indexed block of the vault, if any."""
+        with self.db.get_connection() as conn:
+            row = conn.execute(
+                "SELECT last_block FROM indexer_checkpoints WHERE vault = ?",
+                (self.vault_address.lower(),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _get_logs(self, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        return self.w3.eth.get_logs({
+            "address": self.vault_address,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [list(EVENT_TOPICS)],
+        })
+
+    def _fetch_chunk(self, from_block: int, head: int) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Fetch logs from `from_block`, shrinking the range until the node accepts it.
+
+        Returns:
+            Tuple[int, List[Dict[str, Any]]]: Last block covered and its logs
+        """
+        while True:
+            to_block = min(from_block + self.chunk_size - 1, head)
+            try:
+                logs = self._get_logs(from_block, to_block)
+            except Exception as e:
+                if self.chunk_size == 1:
+                    raise
+                self.chunk_size = max(1, self.chunk_size // 2)
+                logger.warning(f"eth_getLogs {from_block}-{to_block} failed ({e}), "
+                               f"retrying with {self.chunk_size} blocks")
+                continue
+
+            if len(logs) < self.target_logs // 2:
+                self.chunk_size = min(self.chunk_size * 2, self.max_chunk)
+            elif len(logs) > self.target_logs:
+                self.chunk_size = max(1, self.chunk_size // 2)
+            return to_block, logs
+
+    def _store_chunk(self, conn, from_block: int, to_block: int, logs: List[Dict[str, Any]]):
+        """Replace the chunk's rows and advance the checkpoint in one transaction."""
+        rows: Dict[str, List[Tuple]] = {table: [] for table in EVENT_COLUMNS}
+        for log in logs:
+            if log.get("removed"):
+                continue
+            table, row = decode_log(log)
+            rows[table].append(row)
+
+        vault = self.vault_address.lower()
+        cursor = conn.cursor()
+        for table, columns in EVENT_COLUMNS.items():
+            cursor.execute(
+                f"DELETE FROM {table} WHERE vault = ? AND block_number BETWEEN ? AND ?",
+                (vault, from_block, to_block)
+            )
+            if rows[table]:
+                names = ["vault", "block_number", "tx_hash", "log_index"] + [name for name, _ in columns]
+                cursor.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(names)}) "
+                    f"VALUES ({', '.join('?' for _ in names)})",
+                    rows[table]
+                )
+        cursor.execute("""
+            INSERT INTO indexer_checkpoints (vault, last_block) VALUES (?, ?)
+            ON CONFLICT(vault) DO UPDATE SET last_block = excluded.last_block,
+                                             updated_at = CURRENT_TIMESTAMP
+        """, (vault, to_block))
+        conn.commit()
+
+    def run(self, to_block: Optional[int] = None) -> int:
+        """
+        Index events from the checkpoint (minus `reorg_depth` blocks) up to `to_block`.
+
+        Args:
+            to_block (Optional[int]): Last block to index, chain head by default
+
+        Returns:
+            int: Number of logs indexed
+        """
+        head = self.w3.eth.block_number if to_block is None else to_block
+        checkpoint = self.get_checkpoint()
+        from_block = self.start_block if checkpoint is None else max(
+            self.start_block, checkpoint - self.reorg_depth + 1
+        )
+        if from_block > head:
+            return 0
+
+        indexed = 0
+        started = time.perf_counter()
+        with self.db.get_connection() as conn:
+            while from_block <= head:
+                chunk_end, logs = self._fetch_chunk(from_block, head)
+                self._store_chunk(conn, from_block, chunk_end, logs)
+                indexed += len(logs)
+                from_block = chunk_end + 1
+
+        logger.info(f"Indexed {indexed} events up to block {head} "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return indexed
+
+    def follow(self, poll_interval: float = 2.0, on_indexed: Optional[Callable[[int], None]] = None):
+        """Keep indexing new blocks until interrupted."""
+        while True:
+            indexed = self.run()
+            if on_indexed and indexed:
+                on_indexed(indexed)
+            time.sleep(poll_interval)
+
+def main():
+    from Scripter import w3, NEW_METAMORPH_VAULT_ADDRESS
+
+    indexer = EventIndexer(w3, NEW_METAMORPH_VAULT_ADDRESS)
+    try:
+        indexed = indexer.run()
+        print(f"Indexed {indexed} events for vault {NEW_METAMORPH_VAULT_ADDRESS}")
+    except Exception as e:
+        logger.error(f"Error while indexing events: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
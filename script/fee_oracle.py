@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Dict, Optional, Sequence
+
+if TYPE_CHECKING:
+    from web3 import Web3
+
+logger = logging.getLogger(__name__)
+
+# Reward percentile and base fee headroom for each urgency level.
+# 2x the next base fee survives six consecutive full blocks (+12.5% each).
+URGENCY_LEVELS = {
+    "low":    {"percentile": 10, "base_fee_multiplier": 1.25},
+    "medium": {"percentile": 50, "base_fee_multiplier": 2.0},
+    "high":   {"percentile": 90, "base_fee_multiplier": 3.0},
+}
+
+_oracles: "weakref.WeakKeyDictionary[Web3, FeeOracle]" = weakref.WeakKeyDictionary()
+
+class FeeOracle:
+    def __init__(self,
+                 w3: "Web3",
+                 window: int = 20,
+                 block_time: float = 12.0,
+                 min_priority_fee: int = 10**6):
+        """
+        EIP-1559 fee oracle backed by a rolling `eth_feeHistory` window.
+
+        The window is refreshed at most once per block: on every new block when
+        attached to a `ReceiptWatcher`, otherwise when older than `block_time`.
+
+        Args:
+            w3 (Web3): Connected Web3 instance
+            window (int): Number of past blocks in the fee history
+            block_time (float): Seconds after which an unattached window is stale
+            min_priority_fee (int): Floor of the priority fee, in wei
+        """
+        self.w3 = w3
+        self.window = window
+        self.block_time = block_time
+        self.min_priority_fee = min_priority_fee
+        self.percentiles: Sequence[int] = sorted({level["percentile"] for level in URGENCY_LEVELS.values()})
+
+        self._lock = threading.Lock()
+        self._next_base_fee: Optional[int] = None
+        self._rewards: Dict[int, int] = {}
+        self._block: Optional[int] = None
+        self._refreshed_at = 0.0
+        self._watcher = None
+
+    @classmethod
+    def for_client(cls, w3: "Web3") -> "FeeOracle":
+        """Return the shared oracle of a Web3 instance, creating it on first use."""
+        oracle = _oracles.get(w3)
+        if oracle is None:
+            oracle = _oracles[w3] = cls(w3)
+        return oracle
+
+    def attach(self, receipt_watcher):
+        """Refresh on every new block seen by `receipt_watcher` instead of by age."""
+        receipt_watcher.add_block_listener(self.on_block)
+        self._watcher = receipt_watcher
+
+    def on_block(self, block_number: int):
+        if self._block is None or block_number > self._block:
+            self.refresh()
+
+    def refresh(self):
+        """Fetch the fee history window (one RPC call)."""
+        started = time.perf_counter()
+        history = self.w3.eth.fee_history(self.window, "latest", list(self.percentiles))
+
+        rewards = {}
+        for column, percentile in enumerate(self.percentiles):
+            # Median of the window's rewards at this percentile, ignoring empty blocks
+            values = sorted(block[column] for block in history["reward"] if block and block[column] > 0)
+            rewards[percentile] = values[len(values) // 2] if values else self.min_priority_fee
+
+        with self._lock:
+            # The last base fee returned is the next block's
+            self._next_base_fee = history["baseFeePerGas"][-1]
+            self._rewards = rewards
+            self._block = history["oldestBlock"] + len(history["baseFeePerGas"]) - 2
+            self._refreshed_at = time.monotonic()
+
+        logger.debug(f"Fee history refreshed at block {self._block} "
+                     f"in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    def _is_stale(self) -> bool:
+        if self._next_base_fee is None:
+            return True
+        attached = self._watcher is not None and self._watcher.running
+        return not attached and time.monotonic() - self._refreshed_at > self.block_time
+
+    def fees(self, urgency: str = "medium") -> Dict[str, int]:
+        """
+        Return EIP-1559 fee fields for a transaction.
+
+        Args:
+            urgency (str): One of `URGENCY_LEVELS`
+
+        Returns:
+            Dict[str, int]: `maxFeePerGas` and `maxPriorityFeePerGas`, in wei
+        """
+        if urgency not in URGENCY_LEVELS:
+            raise ValueError(f"Unknown urgency {urgency!r}, expected one of {list(URGENCY_LEVELS)}")
+        level = URGENCY_LEVELS[urgency]
+
+        started = time.perf_counter()
+        source = "cache"
+        if self._is_stale():
+            self.refresh()
+            source = "rpc"
+
+        with self._lock:
+            priority_fee = max(self._rewards[level["percentile"]], self.min_priority_fee)
+            max_fee = int(self._next_base_fee * level["base_fee_multiplier"]) + priority_fee
+            base_fee, block = self._next_base_fee, self._block
+
+        logger.info(f"Fee decision ({urgency}, block {block}, {source}): base fee {base_fee}, "
+                    f"maxPriorityFeePerGas {priority_fee}, maxFeePerGas {max_fee} "
+                    f"in {(time.perf_counter() - started) * 1000:.2f}ms")
+        return {"maxFeePerGas": max_fee, "maxPriorityFeePerGas": priority_fee}
@@ -0,0 +1,423 @@
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from web3 import Web3
+
+from abi_codec import encode_accept_cap, encode_reallocate, encode_set_supply_queue
+from event_indexer import EVENT_SIGNATURES
+from main import DatabaseManager
+from reallocation import GAS_MODEL_PATH, MAX_UINT256, GasModel
+from vault_model import market_id
+from Scripter import (
+    ANVIL_PRIVATE_KEY,
+    MORPHO_ABI,
+    TEST_ACCOUNT,
+    VIRTUAL_ASSETS,
+    VIRTUAL_SHARES,
+    MarketAllocation,
+    MarketParams,
+    simulate_and_send_reallocate,
+)
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEPLOY_SCRIPT = "script/DeployGasBenchmark.s.sol:DeployGasBenchmark"
+DEPLOYMENT_FILE = os.path.join("gas_benchmark", "deployment.json")
+
+TIMELOCK = 86400
+
+# "fresh": the next block follows the setup; "accrued": a day of interest is pending
+STATES = ("fresh", "accrued")
+
+REALLOCATE_WITHDRAW_TOPIC = Web3.keccak(text=EVENT_SIGNATURES["reallocate_withdraw"])
+REALLOCATE_SUPPLY_TOPIC = Web3.keccak(text=EVENT_SIGNATURES["reallocate_supply"])
+
+ERC20_ABI = [{
+    "inputs": [
+        {"internalType": "address", "name": "spender", "type": "address"},
+        {"internalType": "uint256", "name": "value", "type": "uint256"}
+    ],
+    "name": "approve",
+    "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
+    "stateMutability": "nonpayable",
+    "type": "function"
+}]
+
+VAULT_DEPOSIT_ABI = [{
+    "inputs": [
+        {"internalType": "uint256", "name": "assets", "type": "uint256"},
+        {"internalType": "address", "name": "receiver", "type": "address"}
+    ],
+    "name": "deposit",
+    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+    "stateMutability": "nonpayable",
+    "type": "function"
+}]
+
+class GasBenchmark:
+    def __init__(self,
+                 n_markets: int = 8,
+                 port: int = 8555,
+                 rpc_url: Optional[str] = None,
+                 liquidity: int = 1_000_000 * 10**18,
+                 utilization: float = 0.5,
+                 db: Optional[DatabaseManager] = None):
+        """
+        Gas benchmark of `reallocate` on a local anvil chain.
+
+        `start()` spawns anvil (unless `rpc_url` points to a running one) and
+        deploys Morpho Blue, `n_markets` mock markets and a MetaMorpho vault
+        with `DeployGasBenchmark.s.sol`; `setup()` then accepts the caps after
+        the timelock and spreads a deposit evenly over the markets. Every
+        allocation shape is sent through `simulate_and_send_reallocate`
+        between `evm_snapshot` and `evm_revert`, so all shapes start from the
+        same state.
+
+        Args:
+            n_markets (int): Markets of the vault (at most 30, the queue length limit)
+            port (int): Port of the spawned anvil
+            rpc_url (Optional[str]): Existing anvil to use instead of spawning one
+            liquidity (int): Outside liquidity per market, also the vault deposit per market
+            utilization (float): Share of the outside liquidity borrowed
+            db (Optional[DatabaseManager]): Database to store results in
+        """
+        if not 2 <= n_markets <= 30:
+            raise ValueError("The benchmark needs between 2 and 30 markets")
+        self.n_markets = n_markets
+        self.port = port
+        self.rpc_url = rpc_url
+        self.liquidity = liquidity
+        self.utilization = utilization
+        self.db = db
+        if self.db:
+            self.init_table()
+
+        self.client: Optional[Web3] = None
+        self.deployment: Dict[str, Any] = {}
+        self.markets: List[MarketParams] = []
+        self.market_ids: List[str] = []
+        self._process: Optional[subprocess.Popen] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def init_table(self):
+        """Initialize the gas benchmark results table if it doesn't exist."""
+        with self.db.get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS gas_benchmark_results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    batch_id TEXT NOT NULL,
+                    legs INTEGER NOT NULL,
+                    withdrawals INTEGER NOT NULL,
+                    supplies INTEGER NOT NULL,
+                    full_exits INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    success INTEGER NOT NULL,
+                    gas_used INTEGER,
+                    calldata_bytes INTEGER NOT NULL,
+                    wall_time REAL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
+
+    # ------------------------------------------------------------------
+    # Chain setup
+    # ------------------------------------------------------------------
+    def _rpc(self, method: str, params: list) -> Any:
+        response = self.client.provider.make_request(method, params)
+        if "error" in response:
+            raise RuntimeError(f"{method} failed: {response['error']}")
+        return response["result"]
+
+    def _transact(self, to: str, data):
+        # Anvil's dev accounts are unlocked, the setup needs no signing
+        tx_hash = self.client.eth.send_transaction({"from": TEST_ACCOUNT, "to": to, "data": data})
+        receipt = self.client.eth.wait_for_transaction_receipt(tx_hash)
+        if receipt["status"] != 1:
+            raise RuntimeError(f"Setup transaction {tx_hash.hex()} reverted")
+
+    def start(self):
+        """Spawn anvil if needed, deploy the contracts and set the vault up."""
+        if self.rpc_url is None:
+            if shutil.which("anvil") is None:
+                raise RuntimeError("anvil not found; install Foundry or pass the rpc_url of a running anvil")
+            self._process = subprocess.Popen(["anvil", "--port", str(self.port), "--silent"],
+                                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.rpc_url = f"http://127.0.0.1:{self.port}"
+
+        self.client = Web3(Web3.HTTPProvider(self.rpc_url, request_kwargs={"timeout": 120}))
+        deadline = time.monotonic() + 30
+        while not self.client.is_connected():
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"anvil at {self.rpc_url} did not start")
+            time.sleep(0.2)
+
+        self.deploy()
+        self.setup()
+
+    def stop(self):
+        """Terminate the spawned anvil."""
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+    def deploy(self):
+        """Run the deployment script and load the deployed addresses."""
+        if shutil.which("forge") is None:
+            raise RuntimeError("forge not found; install Foundry to deploy the benchmark contracts")
+
+        os.makedirs(os.path.join(PROJECT_ROOT, os.path.dirname(DEPLOYMENT_FILE)), exist_ok=True)
+        env = dict(os.environ,
+                   PRIVATE_KEY=ANVIL_PRIVATE_KEY,
+                   GAS_BENCH_MARKETS=str(self.n_markets),
+                   GAS_BENCH_LIQUIDITY=str(self.liquidity),
+                   GAS_BENCH_UTILIZATION=str(int(self.utilization * 10**18)),
+                   GAS_BENCH_OUTPUT=DEPLOYMENT_FILE)
+        # A full build first: the script deploys Morpho Blue from the artifact of
+        # MorphoArtifact.sol, which is outside the script's own compilation unit
+        subprocess.run(["forge", "build"], cwd=PROJECT_ROOT, check=True, capture_output=True)
+        started = time.perf_counter()
+        subprocess.run(["forge", "script", DEPLOY_SCRIPT, "--rpc-url", self.rpc_url, "--broadcast"],
+                       cwd=PROJECT_ROOT, env=env, check=True, capture_output=True)
+
+        with open(os.path.join(PROJECT_ROOT, DEPLOYMENT_FILE)) as f:
+            self.deployment = json.load(f)
+        self.markets = [
+            MarketParams(
+                loan_token=Web3.to_checksum_address(self.deployment["loan_token"]),
+                collateral_token=Web3.to_checksum_address(self.deployment["collateral_token"]),
+                oracle=Web3.to_checksum_address(oracle),
+                irm=Web3.to_checksum_address(self.deployment["irm"]),
+                lltv=int(lltv)
+            )
+            for oracle, lltv in zip(self.deployment["oracles"], self.deployment["lltvs"])
+        ]
+        self.market_ids = [market_id(params) for params in self.markets]
+        logger.info(f"Deployed vault {self.deployment['vault']} with {len(self.markets)} markets "
+                    f"in {time.perf_counter() - started:.1f}s")
+
+    def setup(self):
+        """Accept the submitted caps after the timelock and deposit `liquidity` into every market."""
+        vault = Web3.to_checksum_address(self.deployment["vault"])
+        self._rpc("evm_increaseTime", [TIMELOCK + 1])
+        self._rpc("evm_mine", [])
+        for params in self.markets:
+            self._transact(vault, encode_accept_cap(params))
+
+        loan_token = self.client.eth.contract(address=self.markets[0].loan_token, abi=ERC20_ABI)
+        self._transact(loan_token.address, loan_token.encode_abi("approve", args=[vault, MAX_UINT256]))
+        deposit = self.client.eth.contract(address=vault, abi=VAULT_DEPOSIT_ABI).encode_abi(
+            "deposit", args=[self.liquidity, TEST_ACCOUNT])
+        # Deposits go down the supply queue; one market at a time spreads them evenly
+        for mid in self.market_ids:
+            self._transact(vault, encode_set_supply_queue([mid]))
+            self._transact(vault, deposit)
+        self._transact(vault, encode_set_supply_queue(self.market_ids))
+
+    # ------------------------------------------------------------------
+    # Sweep
+    # ------------------------------------------------------------------
+    def vault_supply(self) -> List[int]:
+        """Vault supply of every market in loan token units, as `reallocate` sees it before accrual."""
+        morpho = self.client.eth.contract(address=Web3.to_checksum_address(self.deployment["morpho"]),
+                                          abi=MORPHO_ABI)
+        vault = Web3.to_checksum_address(self.deployment["vault"])
+        supplies = []
+        for mid in self.market_ids:
+            supply_shares, _, _ = morpho.functions.position(mid, vault).call()
+            total_supply_assets, total_supply_shares, *_ = morpho.functions.market(mid).call()
+            supplies.append(supply_shares * (total_supply_assets + VIRTUAL_ASSETS)
+                            // (total_supply_shares + VIRTUAL_SHARES))
+        return supplies
+
+    def shapes(self, max_legs: Optional[int] = None) -> Iterator[Tuple[int, int, bool]]:
+        """
+        Allocation shapes of the sweep: every split of 2..`max_legs` legs into
+        withdrawals and supplies, each with partial withdrawals and full exits.
+
+        Yields:
+            Tuple[int, int, bool]: Withdrawals, supplies, whether withdrawals empty their market
+        """
+        for legs in range(2, (max_legs or self.n_markets) + 1):
+            for withdrawals in range(1, legs):
+                for full_exit in (False, True):
+                    yield withdrawals, legs - withdrawals, full_exit
+
+    def allocations(self, withdrawals: int, supplies: int, full_exit: bool,
+                    fraction: float = 0.1) -> List[MarketAllocation]:
+        """
+        Build a balanced reallocation: the first `withdrawals` markets give up
+        `fraction` of their supply (or all of it), which goes evenly to the
+        next `supplies` markets; the last one takes the remainder.
+        """
+        current = self.vault_supply()
+        allocations = []
+        for i in range(withdrawals):
+            target = 0 if full_exit else current[i] - int(current[i] * fraction)
+            allocations.append(MarketAllocation(self.markets[i], target))
+        moved = sum(current[i] - allocation.assets for i, allocation in enumerate(allocations))
+        for j in range(withdrawals, withdrawals + supplies - 1):
+            allocations.append(MarketAllocation(self.markets[j], current[j] + moved // supplies))
+        allocations.append(MarketAllocation(self.markets[withdrawals + supplies - 1], MAX_UINT256))
+        return allocations
+
+    def run_shape(self, withdrawals: int, supplies: int, full_exit: bool, state: str) -> Dict[str, Any]:
+        """
+        Send one shape from `state` and revert the chain afterwards.
+
+        Returns:
+            Dict[str, Any]: Shape, success, gas used, calldata size and wall time
+        """
+        if state not in STATES:
+            raise ValueError(f"Unknown state {state!r}, expected one of {list(STATES)}")
+
+        snapshot = self._rpc("evm_snapshot", [])
+        try:
+            if state == "accrued":
+                latest = self.client.eth.get_block("latest")
+                self._rpc("evm_setNextBlockTimestamp", [latest["timestamp"] + 86400])
+            allocations = self.allocations(withdrawals, supplies, full_exit)
+            started = time.perf_counter()
+            receipt = simulate_and_send_reallocate(
+                allocations,
+                client=self.client,
+                vault_address=Web3.to_checksum_address(self.deployment["vault"]),
+                private_key=ANVIL_PRIVATE_KEY
+            )
+            wall_time = time.perf_counter() - started
+        finally:
+            self._rpc("evm_revert", [snapshot])
+
+        if receipt and receipt["status"] == 1:
+            # The shape is built from supplies before the pending interest accrues, so
+            # in the "accrued" state a supply leg can end up withdrawing: count the
+            # legs the vault actually executed
+            withdrawals, supplies = self.executed_legs(receipt)
+
+        return {
+            "legs": len(allocations),
+            "withdrawals": withdrawals,
+            "supplies": supplies,
+            "full_exits": withdrawals if full_exit else 0,
+            "state": state,
+            "success": bool(receipt and receipt["status"] == 1),
+            "gas_used": receipt["gasUsed"] if receipt else None,
+            "calldata_bytes": len(encode_reallocate(allocations)),
+            "wall_time": wall_time,
+        }
+
+    def executed_legs(self, receipt) -> Tuple[int, int]:
+        """
+        Count the withdrawals and supplies of a `reallocate` from its
+        `ReallocateWithdraw` and `ReallocateSupply` events.
+
+        Returns:
+            Tuple[int, int]: Withdrawal and supply legs executed by the vault
+        """
+        vault = Web3.to_checksum_address(self.deployment["vault"])
+        topics = [bytes(log["topics"][0]) for log in receipt["logs"]
+                  if log["topics"] and Web3.to_checksum_address(log["address"]) == vault]
+        return topics.count(REALLOCATE_WITHDRAW_TOPIC), topics.count(REALLOCATE_SUPPLY_TOPIC)
+
+    def run(self,
+            states: Sequence[str] = STATES,
+            max_legs: Optional[int] = None,
+            batch_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Sweep every shape from every state.
+
+        Args:
+            states (Sequence[str]): Market states to start from
+            max_legs (Optional[int]): Largest number of legs, all markets by default
+            batch_id (Optional[str]): Identifier of the batch in the results table
+
+        Returns:
+            List[Dict[str, Any]]: One result row per shape and state
+        """
+        rows = []
+        started = time.perf_counter()
+        for state in states:
+            for withdrawals, supplies, full_exit in self.shapes(max_legs):
+                try:
+                    rows.append(self.run_shape(withdrawals, supplies, full_exit, state))
+                except Exception as e:
+                    logger.error(f"Shape {withdrawals}w/{supplies}s ({state}) failed: {str(e)}")
+
+        logger.info(f"Ran {len(rows)} reallocations in {time.perf_counter() - started:.1f}s "
+                    f"({sum(row['success'] for row in rows)} succeeded)")
+        if self.db:
+            self.store_results(batch_id or time.strftime("%Y%m%dT%H%M%S"), rows)
+        return rows
+
+    def store_results(self, batch_id: str, rows: List[Dict[str, Any]]):
+        """Store a batch of gas benchmark results in the database."""
+        with self.db.get_connection() as conn:
+            conn.executemany("""
+                INSERT INTO gas_benchmark_results (
+                    batch_id, legs, withdrawals, supplies, full_exits, state,
+                    success, gas_used, calldata_bytes, wall_time
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (batch_id, row["legs"], row["withdrawals"], row["supplies"], row["full_exits"],
+                 row["state"], int(row["success"]), row["gas_used"], row["calldata_bytes"], row["wall_time"])
+                for row in rows
+            ])
+            conn.commit()
+
+def fit_gas_model(rows: List[Dict[str, Any]]) -> GasModel:
+    """
+    Fit the planner's linear `GasModel` to measured reallocations.
+
+    Least squares of gas used on the numbers of withdrawal and supply legs,
+    with the intercept then raised by the largest underestimate, so the
+    model bounds every measured call from above: chunks planned with it
+    must never exceed their gas budget.
+
+    Args:
+        rows (List[Dict[str, Any]]): Results of `GasBenchmark.run`
+
+    Returns:
+        GasModel: Calibrated model
+    """
+    measured = [row for row in rows if row["success"]]
+    if len(measured) < 3:
+        raise ValueError(f"Need at least 3 successful reallocations to fit, got {len(measured)}")
+
+    X = np.array([[1.0, row["withdrawals"], row["supplies"]] for row in measured])
+    y = np.array([row["gas_used"] for row in measured], dtype=float)
+    (base, withdraw, supply), *_ = np.linalg.lstsq(X, y, rcond=None)
+    base += max(0.0, float(np.max(y - X @ np.array([base, withdraw, supply]))))
+
+    return GasModel(base_gas=math.ceil(base),
+                    withdraw_leg_gas=math.ceil(withdraw),
+                    supply_leg_gas=math.ceil(supply))
+
+def main():
+    try:
+        with GasBenchmark(db=DatabaseManager()) as benchmark:
+            rows = benchmark.run()
+        model = fit_gas_model(rows)
+        model.save(GAS_MODEL_PATH)
+        print(f"Calibrated gas model saved to {GAS_MODEL_PATH}:")
+        print(json.dumps(model.__dict__, indent=2))
+    except Exception as e:
+        logger.error(f"Error while benchmarking reallocate gas: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator, Sequence
+
+# Longest single array element accepted, in characters, so a malformed body
+# cannot make the parser buffer the rest of the stream
+MAX_ELEMENT_CHARS = 16 << 20
+
+_decoder = json.JSONDecoder()
+_SEPARATORS = " \t\n\r,"
+# Longest undecoded tail a number cut by a chunk boundary can leave: `1e-05`
+# cut after `1e-` decodes as 1 followed by `e-`
+_MAX_CUT_TAIL = 2
+
+def _find_array(buffer: str, path: Sequence[str]) -> int:
+    """
+    Return the index just after the `[` of the array at `path`, or -1 if the
+    buffer does not reach it yet.
+
+    Keys are located by their quoted name in order, which is enough for API
+    responses where these names do not appear earlier as string values.
+    """
+    position = 0
+    for key in path:
+        position = buffer.find(f'"{key}"', position)
+        if position < 0:
+            return -1
+        position += len(key) + 2
+    position = buffer.find("[", position)
+    return position + 1 if position >= 0 else -1
+
+def iter_array_items(chunks: Iterable[bytes], path: Sequence[str] = ("data", "markets", "items")) -> Iterator[Any]:
+    """
+    Decode the elements of one JSON array of a streamed document, one at a time.
+
+    Only the current element and the undecoded rest of the last chunk are
+    held in memory, so the memory used does not grow with the array length.
+    Elements are decoded with `json.JSONDecoder.raw_decode`; one that is cut
+    by a chunk boundary is decoded again once the next chunk has arrived.
+
+    Args:
+        chunks (Iterable[bytes]): UTF-8 body, in pieces of any size
+        path (Sequence[str]): Keys leading to the array
+
+    Yields:
+        Any: Decoded array elements
+
+    Raises:
+        ValueError: If the document has no such array, ends inside it or has
+            an element that does not decode
+    """
+    decode_utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+
+    def read() -> bool:
+        # Drop what has been consumed before appending, so the buffer stays small
+        nonlocal buffer, position
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[position:] + decode_utf8.decode(chunk)
+                position = 0
+                return True
+        buffer = buffer[position:] + decode_utf8.decode(b"", final=True)
+        position = 0
+        return False
+
+    start = _find_array(buffer, path)
+    while start < 0:
+        if not read():
+            raise ValueError(f"No array at {'.'.join(path)} in response: {buffer[:200]!r}")
+        start = _find_array(buffer, path)
+    position = start
+
+    while True:
+        while position < len(buffer) and buffer[position] in _SEPARATORS:
+            position += 1
+        if position >= len(buffer):
+            if not read():
+                raise ValueError("Response ended inside the array")
+            continue
+        if buffer[position] == "]":
+            return
+
+        try:
+            item, end = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Most likely cut by the chunk boundary
+            if len(buffer) - position > MAX_ELEMENT_CHARS:
+                raise ValueError("Malformed or oversized array element in response") from None
+            if not read():
+                raise ValueError("Malformed array element at the end of the response") from None
+            continue
+
+        # A number or literal ending at, or a fraction or exponent marker short
+        # of, the end of the buffer may continue in the next chunk
+        tail = buffer[end:]
+        if (not isinstance(item, (dict, list, str)) and len(tail) <= _MAX_CUT_TAIL
+                and not any(char in _SEPARATORS or char == "]" for char in tail)):
+            if read():
+                continue
+
+        yield item
+        position = end
@@ -1,10 +1,22 @@
-import requests
-from pulp import LpMaximize, LpProblem, LpVariable, lpSum
 import logging
 import sqlite3
-from typing import List, Dict, Any
+from typing import TYPE_CHECKING, List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
 from contextlib import contextmanager
 import json
+import itertools
+import time
+
+from json_stream import iter_array_items
+from market_data import NUMERIC_FIELDS, MarketColumns, MarketRecord
+from metrics import REGISTRY, record_run
+from profiling import profiled
+from replay_archive import ReplayArchive
+
+if TYPE_CHECKING:
+    # NumPy is imported where used, off the cold start of the light commands
+    import numpy as np
+
+    from columnar_store import HistoryReader
 
 # Configure logging
 logging.basicConfig(
@@ -13,26 +25,176 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def solve_allocation(market_data: Union[MarketColumns, List[Dict[str, Any]]],
+                     available_funds: float,
+                     max_risk: float = 0.2,
+                     max_utilization: float = 0.85,
+                     current_positions: Optional[Dict[str, float]] = None,
+                     gas_cost_per_leg: float = 0.0,
+                     turnover_cost: float = 0.0,
+                     min_trade_size: float = 0.0,
+                     holding_period_days: float = 30.0,
+                     solver=None,
+                     timings: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """
+    Optimize fund allocation across `market_data` using linear programming.
+
+    Pure function of its inputs (no fetching or storage), so it can be run
+    on historical snapshots and in worker processes.
+
+    When `current_positions` is given the allocation is rebalanced from them:
+    the objective becomes the yield earned over `holding_period_days` net of
+    turnover and per-leg gas costs, the net move of every market is either
+    nothing or at least `min_trade_size`, and funds withdrawn from a market
+    are supplied to others rather than left idle.
+
+    Args:
+        market_data (Union[MarketColumns, List[Dict[str, Any]]]): Parsed markets
+            (see `_parse_market_data`); the LP is built from its columns
+        available_funds (float): Funds to allocate in USD, including current positions
+        max_risk (float): Maximum weighted risk
+        max_utilization (float): Maximum weighted utilization
+        current_positions (Optional[Dict[str, float]]): Current allocation in USD by market
+        gas_cost_per_leg (float): Gas cost in USD of each market touched
+        turnover_cost (float): Cost per USD moved (slippage, fees)
+        min_trade_size (float): Smallest amount in USD worth moving in a market
+        holding_period_days (float): Horizon over which APY gains must repay costs
+        solver: PuLP solver, PuLP's default (CBC) when None
+        timings (Optional[Dict[str, float]]): Filled with the `lp_build` and
+            `lp_solve` seconds, for callers in other processes, whose copy of
+            the metrics registry is not the one served
+
+    Returns:
+        Dict[str, float]: Allocation in USD by market
+
+    Raises:
+        ValueError: If the problem has no optimal solution (e.g. infeasible limits)
+    """
+    # Imported here: PuLP is only needed by the commands that solve
+    from pulp import (LpAffineExpression, LpBinary, LpMaximize, LpProblem, LpStatus, LpStatusOptimal,
+                      LpVariable, lpSum)
+
+    build_started = time.perf_counter()
+    columns = MarketColumns.from_markets(market_data)
+    if len(columns.index) != len(columns):
+        # One variable per market: keep the last row of a repeated key
+        columns = columns.take(sorted(columns.index.values()))
+    keys = columns.keys
+
+    # Create optimization problem
+    prob = LpProblem("Morpho_Market_Allocation", LpMaximize)
+    current = current_positions or {}
+    
+    # Define variables
+    upper_bounds = columns.max_supply.tolist()
+    allocations = {
+        key: LpVariable(f"alloc_{key}", lowBound=0, upBound=max(upper, current.get(key, 0.0)))
+        for key, upper in zip(keys, upper_bounds)
+    }
+    variables = list(allocations.values())
+
+    def weighted(weights) -> LpAffineExpression:
+        # Built straight from (variable, coefficient) pairs, without one expression per term
+        return LpAffineExpression(zip(variables, weights.tolist()))
+
+    # Objective: Maximize total APY
+    expected_yield = weighted(columns.supply_apy)
+    
+    if current_positions is None:
+        prob += expected_yield
+    else:
+        unknown = set(current) - set(allocations)
+        if unknown:
+            logger.warning(f"Ignoring {len(unknown)} current positions without market data")
+
+        # Turnover: alloc = current + bought - sold
+        bought = {key: LpVariable(f"buy_{key}", lowBound=0) for key in allocations}
+        sold = {key: LpVariable(f"sell_{key}", lowBound=0, upBound=current.get(key, 0.0))
+                for key in allocations}
+        for key, alloc in allocations.items():
+            prob += alloc == current.get(key, 0.0) + bought[key] - sold[key]
+
+        costs = turnover_cost * lpSum([bought[key] + sold[key] for key in allocations])
+
+        # A market is either bought or sold, never both, so `bought`/`sold` is its
+        # net move: the leg is paid for (gas) and sized (materiality) on that move
+        if gas_cost_per_leg > 0 or min_trade_size > 0:
+            buys = {key: LpVariable(f"buy_leg_{key}", cat=LpBinary) for key in allocations}
+            sells = {key: LpVariable(f"sell_leg_{key}", cat=LpBinary) for key in allocations}
+            for key, alloc in allocations.items():
+                held = current.get(key, 0.0)
+                prob += buys[key] + sells[key] <= 1
+                prob += bought[key] <= (alloc.upBound - held) * buys[key]
+                prob += bought[key] >= min_trade_size * buys[key]
+                prob += sold[key] <= held * sells[key]
+                prob += sold[key] >= min_trade_size * sells[key]
+            costs += gas_cost_per_leg * (lpSum(buys.values()) + lpSum(sells.values()))
+
+        prob += expected_yield * (holding_period_days / 365) - costs
+    
+    # Constraints
+    prob += lpSum(variables) <= available_funds
+    if current_positions is not None:
+        # A rebalancing moves funds between markets: what is withdrawn is supplied elsewhere
+        prob += lpSum(variables) >= sum(current.get(key, 0.0) for key in allocations)
+    prob += weighted(columns.risk) <= max_risk * available_funds
+    prob += weighted(columns.utilization) <= max_utilization * available_funds
+    
+    # Solve and get results
+    solve_started = time.perf_counter()
+    prob.solve(solver)
+    stage_seconds = {"lp_build": solve_started - build_started, "lp_solve": time.perf_counter() - solve_started}
+    REGISTRY.observe_stages(stage_seconds)
+    if timings is not None:
+        timings.update(stage_seconds)
+    if prob.status != LpStatusOptimal:
+        raise ValueError(f"Allocation problem is {LpStatus[prob.status]}")
+    optimized_allocations = {key: allocations[key].varValue for key in keys}
+    
+    return optimized_allocations
+
 class DatabaseManager:
-    def __init__(self, db_path: str = "morpho_markets.db"):
+    def __init__(self, db_path: str = "morpho_markets.db", persistent: bool = False):
         """
         Initialize the database manager.
         
         Args:
             db_path (str): Path to SQLite database file
+            persistent (bool): Keep one connection open for all operations
+                (long-running processes) instead of one per operation
         """
         self.db_path = db_path
+        self.persistent = persistent
+        self._conn: Optional[sqlite3.Connection] = None
         self.init_database()
 
     @contextmanager
     def get_connection(self):
         """Context manager for database connections."""
+        if self.persistent:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            try:
+                yield self._conn
+            except BaseException:
+                # The connection outlives the operation: a later commit would
+                # otherwise save the rows of this failed one
+                self._conn.rollback()
+                raise
+            return
+
         conn = sqlite3.connect(self.db_path)
         try:
             yield conn
         finally:
             conn.close()
 
+    def close(self):
+        """Close the persistent connection, if any."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
     def init_database(self):
         """Initialize database tables if they don't exist."""
         with self.get_connection() as conn:
@@ -70,36 +232,91 @@ class DatabaseManager:
             
             conn.commit()
 
-    def store_market_data(self, market_data: List[Dict[str, Any]]):
+    @profiled("store_market_data")
+    def store_market_data(self, market_data: Union[MarketColumns, List[Dict[str, Any]]], timestamp: Optional[float] = None):
         """
         Store market data in the database.
         
         Args:
-            market_data (List[Dict[str, Any]]): List of market data to store
+            market_data (Union[MarketColumns, List[Dict[str, Any]]]): Market data to store
+            timestamp (Optional[float]): Unix time of the snapshot (replayed data), now by default
+        """
+        self.store_market_stream(market_data, timestamp)
+
+    def store_market_stream(self,
+                            markets: Iterable[Dict[str, Any]],
+                            timestamp: Optional[float] = None,
+                            batch_size: int = 1000) -> int:
+        """
+        Store a stream of markets in bounded batches, as one snapshot.
+
+        Rows are inserted `batch_size` at a time with `executemany` and
+        committed once at the end, so only one batch is held in memory and a
+        failed stream leaves no partial snapshot behind.
+
+        Args:
+            markets (Iterable[Dict[str, Any]]): Parsed markets, e.g. a generator, or `MarketColumns`
+            timestamp (Optional[float]): Unix time of the snapshot, now by default
+            batch_size (int): Rows per `executemany`
+
+        Returns:
+            int: Number of rows stored
         """
+        # Same format as CURRENT_TIMESTAMP so time filters keep working; fixed
+        # up front so a long stream is still stored under one snapshot time
+        recorded_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp))
+        stored = 0
+
+        if isinstance(markets, MarketColumns):
+            # Zip the columns rather than materializing a record per market
+            rows = zip(
+                markets.keys,
+                [token['symbol'] for token in markets.tokens],
+                [token['address'] for token in markets.tokens],
+                *(getattr(markets, name).tolist()
+                  for name in ('supply_apy', 'borrow_apy', 'utilization', 'lltv', 'max_supply', 'risk')),
+                itertools.repeat(recorded_at)
+            )
+        else:
+            rows = ((
+                market['market'],
+                market['token']['symbol'],
+                market['token']['address'],
+                market['supply_apy'],
+                market['borrow_apy'],
+                market['utilization'],
+                market['lltv'],
+                market['max_supply'],
+                market['risk'],
+                recorded_at
+            ) for market in markets)
+
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            for market in market_data:
-                cursor.execute("""
-                    INSERT INTO markets (
-                        unique_key, token_symbol, token_address, 
-                        supply_apy, borrow_apy, utilization, 
-                        lltv, max_supply, risk
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    market['market'],
-                    market['token']['symbol'],
-                    market['token']['address'],
-                    market['supply_apy'],
-                    market['borrow_apy'],
-                    market['utilization'],
-                    market['lltv'],
-                    market['max_supply'],
-                    market['risk']
-                ))
-            
-            conn.commit()
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self._insert_markets(conn, batch)
+                    stored += len(batch)
+                    batch = []
+            if batch:
+                self._insert_markets(conn, batch)
+                stored += len(batch)
+
+            with REGISTRY.stage("db_commit"):
+                conn.commit()
+        REGISTRY.inc("db_rows_written_total", stored, table="markets")
+        return stored
+
+    @staticmethod
+    def _insert_markets(conn: sqlite3.Connection, rows: List[tuple]):
+        conn.executemany("""
+            INSERT INTO markets (
+                unique_key, token_symbol, token_address, 
+                supply_apy, borrow_apy, utilization, 
+                lltv, max_supply, risk, timestamp
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
 
     def store_allocation_results(self, allocations: Dict[str, float], params: Dict[str, float]):
         """
@@ -126,7 +343,9 @@ class DatabaseManager:
                     params['max_utilization']
                 ))
             
-            conn.commit()
+            with REGISTRY.stage("db_commit"):
+                conn.commit()
+        REGISTRY.inc("db_rows_written_total", len(allocations), table="allocations")
 
     def get_historical_market_data(self, market_key: str, days: int = 30) -> List[Dict]:
         """
@@ -152,127 +371,315 @@ class DatabaseManager:
             columns = [description[0] for description in cursor.description]
             return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
+    def get_historical_columns(self,
+                               market_key: str,
+                               days: int = 30,
+                               fields: Tuple[str, ...] = ("supply_apy", "utilization")) -> Dict[str, "np.ndarray"]:
+        """
+        Retrieve the history of a market as columns, newest first.
+
+        Args:
+            market_key (str): Market identifier
+            days (int): Number of days of historical data to retrieve
+            fields (Tuple[str, ...]): Numeric fields to read (see `market_data.NUMERIC_FIELDS`)
+
+        Returns:
+            Dict[str, np.ndarray]: One float column per field, and the `timestamp` strings
+        """
+        import numpy as np
+
+        unknown = set(fields) - set(NUMERIC_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields {sorted(unknown)}")
+
+        with self.get_connection() as conn:
+            rows = conn.execute(f"""
+                SELECT timestamp, {', '.join(fields)} FROM markets
+                WHERE unique_key = ?
+                AND timestamp >= datetime('now', ?)
+                ORDER BY timestamp DESC
+            """, (market_key, f'-{days} days')).fetchall()
+
+        columns = list(zip(*rows)) or [()] * (len(fields) + 1)
+        history = {"timestamp": np.array(columns[0], dtype=object)}
+        for name, values in zip(fields, columns[1:]):
+            history[name] = np.array(values, dtype=float)
+        return history
+
 class MorphoMarketOptimizer:
-    def __init__(self, api_url: str = "https://blue-api.morpho.org/graphql"):
+    MARKETS_QUERY = """
+    query {
+        markets {
+            items {
+                uniqueKey
+                lltv
+                oracleAddress
+                irmAddress
+                loanAsset {
+                    address
+                    symbol
+                    decimals
+                }
+                collateralAsset {
+                    address
+                    symbol
+                    decimals
+                }
+                state {
+                    borrowApy
+                    borrowAssets
+                    borrowAssetsUsd
+                    supplyApy
+                    supplyAssets
+                    supplyAssetsUsd
+                    fee
+                    utilization
+                }
+            }
+        }
+    }
+    """
+
+    # Bytes read from the socket at a time by `stream_market_data`
+    STREAM_CHUNK_BYTES = 64 * 1024
+
+    def __init__(self,
+                 api_url: str = "https://blue-api.morpho.org/graphql",
+                 archive: Optional[ReplayArchive] = None,
+                 replay: bool = False,
+                 db: Optional[DatabaseManager] = None,
+                 history: Optional["HistoryReader"] = None):
         """
         Initialize the Morpho Market Optimizer.
+
+        With an `archive`, every raw API response is appended to it. With
+        `replay`, responses are read from the archive in time order instead of
+        the network, so a whole run can be reproduced offline.
         
         Args:
             api_url (str): Morpho API URL
+            archive (Optional[ReplayArchive]): Archive of raw API responses
+            replay (bool): Read responses from `archive` instead of the API
+            db (Optional[DatabaseManager]): Database, `morpho_markets.db` by default
+            history (Optional[HistoryReader]): Columnar export of the history
+                (see `columnar_store.py`) read by the analytics instead of `db`
         """
+        if replay and archive is None:
+            raise ValueError("Replay mode needs an archive")
+
         self.api_url = api_url
-        self.db = DatabaseManager()
+        self.db = db or DatabaseManager()
+        self.history = history
+        self.archive = archive
+        self.replay = replay
+        self.timeout = 30
+        self._session = None
+        # Last fetched markets, also looked up by key (`latest_markets.get(key)`)
+        self.latest_markets: MarketColumns = MarketColumns.from_markets([])
+        self.snapshot_time: Optional[float] = None
+        self._replay_records = archive.records() if replay else None
+
+    @property
+    def session(self):
+        """Keep-alive HTTP session, so repeated fetches reuse the connection."""
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+        return self._session
+
+    def replay_from(self, start: Optional[float] = None, end: Optional[float] = None):
+        """
+        Restart the replay at the first archived response at or after `start`.
+
+        Args:
+            start (Optional[float]): First Unix time replayed
+            end (Optional[float]): Unix time after which the replay is exhausted
+        """
+        if not self.replay:
+            raise RuntimeError("Optimizer is not in replay mode")
+        self._replay_records = self.archive.records(start, end)
 
-    def fetch_market_data(self) -> List[Dict[str, Any]]:
+    def _fetch_raw(self, query: str) -> bytes:
+        """Return the raw API response, from the archive in replay mode."""
+        if self.replay:
+            try:
+                self.snapshot_time, payload = next(self._replay_records)
+            except StopIteration:
+                raise EOFError("Replay archive exhausted") from None
+            return payload
+
+        started = time.perf_counter()
+        response = self.session.post(self.api_url, json={"query": query}, timeout=self.timeout)
+        REGISTRY.observe("http_request_seconds", time.perf_counter() - started)
+        REGISTRY.inc("http_response_bytes_total", len(response.content))
+        response.raise_for_status()
+        self.snapshot_time = time.time()
+        if self.archive is not None:
+            self.archive.append(response.content, self.snapshot_time)
+        return response.content
+
+    @profiled("fetch_market_data")
+    def fetch_market_data(self) -> MarketColumns:
         """
         Fetch market data from Morpho API and store in database.
         
         Returns:
-            List[Dict[str, Any]]: List of market data
+            MarketColumns: Market data (iterates as `MarketRecord`s)
         """
-        query = """
-        query {
-            markets {
-                items {
-                    uniqueKey
-                    lltv
-                    oracleAddress
-                    irmAddress
-                    loanAsset {
-                        address
-                        symbol
-                        decimals
-                    }
-                    collateralAsset {
-                        address
-                        symbol
-                        decimals
-                    }
-                    state {
-                        borrowApy
-                        borrowAssets
-                        borrowAssetsUsd
-                        supplyApy
-                        supplyAssets
-                        supplyAssetsUsd
-                        fee
-                        utilization
-                    }
-                }
-            }
-        }
-        """
-        
+        from requests.exceptions import RequestException
+
         try:
-            response = requests.post(self.api_url, json={"query": query})
-            response.raise_for_status()
-            data = response.json()
-            
-            parsed_data = self._parse_market_data(data)
-            self.db.store_market_data(parsed_data)
+            with REGISTRY.stage("fetch"):
+                raw = self._fetch_raw(self.MARKETS_QUERY)
+            with REGISTRY.stage("parse"):
+                parsed_data = self._parse_market_data(json.loads(raw))
+            with REGISTRY.stage("store"):
+                self.db.store_market_data(parsed_data, self.snapshot_time if self.replay else None)
+            self.latest_markets = parsed_data
 
             return parsed_data
             
-        except requests.exceptions.RequestException as e:
+        except RequestException as e:
             logger.error(f"Failed to fetch market data: {str(e)}")
             raise
 
-    def _parse_market_data(self, data: Dict) -> List[Dict[str, Any]]:
-        """Parse the raw market data into a structured format."""
-        parsed_markets = []
-        
-        for market in data["data"]["markets"]["items"]:
-            market_info = {
-                "market": market["uniqueKey"],
-                "token": market["loanAsset"],
-                "borrow_apy": float(market["state"]["borrowApy"] or 0.0),
-                "supply_apy": float(market["state"]["supplyApy"] or 0.0),
-                "utilization": float(market["state"]["utilization"] or 0.0),
-                "lltv": float(market["lltv"] or 0.0),
-                "max_supply": float(market["state"]["supplyAssetsUsd"] or 0.0),
-                "risk": float(market["state"]["fee"] or 0.0)
-            }
-            parsed_markets.append(market_info)
-            
-        return parsed_markets
+    def _iter_raw(self, query: str) -> Iterator[bytes]:
+        """Yield the raw API response in chunks as it arrives."""
+        started = time.perf_counter()
+        with self.session.post(self.api_url, json={"query": query}, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            self.snapshot_time = time.time()
+            received = 0
+            for chunk in response.iter_content(chunk_size=self.STREAM_CHUNK_BYTES):
+                received += len(chunk)
+                yield chunk
+        REGISTRY.observe("http_request_seconds", time.perf_counter() - started)
+        REGISTRY.inc("http_response_bytes_total", received)
+
+    @profiled("stream_market_data")
+    def stream_market_data(self, batch_size: int = 1000) -> int:
+        """
+        Fetch market data and store it without holding the whole response.
+
+        The body is decoded one market at a time as it arrives
+        (`json_stream.iter_array_items`), parsed, validated and inserted in
+        batches of `batch_size`, so peak memory does not depend on the number
+        of markets. Malformed markets are skipped. Unlike `fetch_market_data`
+        nothing is returned or kept in `latest_markets`.
+
+        Args:
+            batch_size (int): Rows per database insert
 
+        Returns:
+            int: Number of markets stored
+        """
+        from requests.exceptions import RequestException
+
+        if self.archive is not None and not self.replay:
+            raise ValueError("Streamed responses are not archived, use fetch_market_data to archive")
+
+        try:
+            with REGISTRY.stage("stream"):
+                # A replayed response is already in memory, and must be read before its time is used
+                chunks = [self._fetch_raw(self.MARKETS_QUERY)] if self.replay else self._iter_raw(self.MARKETS_QUERY)
+                markets = self._valid_markets(iter_array_items(chunks))
+                stored = self.db.store_market_stream(markets, self.snapshot_time if self.replay else None,
+                                                     batch_size)
+            logger.info(f"Streamed {stored} markets into the database")
+            return stored
+
+        except RequestException as e:
+            logger.error(f"Failed to fetch market data: {str(e)}")
+            raise
+
+    @staticmethod
+    @profiled("parse_market_data")
+    def _parse_market_data(data: Dict) -> MarketColumns:
+        """Parse the raw market data into columns (see `market_data.py`)."""
+        return MarketColumns.from_api(data["data"]["markets"]["items"])
+
+    @staticmethod
+    def _parse_market(market: Dict[str, Any]) -> MarketRecord:
+        """Parse one market of the API response."""
+        return MarketRecord.from_api(market)
+
+    @staticmethod
+    def _valid_markets(items: Iterable[Dict[str, Any]]) -> Iterator[MarketRecord]:
+        """Parse markets one at a time, skipping (and counting) malformed ones."""
+        for item in items:
+            try:
+                market = MorphoMarketOptimizer._parse_market(item)
+                if not market.market or not market.token or not market.token.get("address"):
+                    raise ValueError("missing market key or loan asset")
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                REGISTRY.inc("markets_invalid_total")
+                logger.warning(f"Skipping malformed market {str(item)[:100]}: {str(e)}")
+                continue
+            yield market
+
+    @profiled("optimize_allocation")
     def optimize_allocation(self, 
                           available_funds: float, 
                           max_risk: float = 0.2, 
-                          max_utilization: float = 0.85) -> Dict[str, float]:
-        """Optimize fund allocation across markets using linear programming."""
-        market_data = self.fetch_market_data()
-        
-        # Create optimization problem
-        prob = LpProblem("Morpho_Market_Allocation", LpMaximize)
-        
-        # Define variables
-        allocations = {
-            market['market']: LpVariable(f"alloc_{market['market']}", 
-                                       lowBound=0, 
-                                       upBound=market['max_supply'])
-            for market in market_data
-        }
-        
-        # Objective: Maximize total APY
-        prob += lpSum([
-            market['supply_apy'] * allocations[market['market']] 
-            for market in market_data
-        ])
-        
-        # Constraints
-        prob += lpSum(allocations.values()) <= available_funds
-        prob += lpSum([market['risk'] * allocations[market['market']] 
-                      for market in market_data]) <= max_risk * available_funds
-        prob += lpSum([market['utilization'] * allocations[market['market']] 
-                      for market in market_data]) <= max_utilization * available_funds
-        
-        # Solve and get results
-        prob.solve()
-        optimized_allocations = {
-            market['market']: allocations[market['market']].varValue 
-            for market in market_data
-        }
+                          max_utilization: float = 0.85,
+                          current_positions: Optional[Dict[str, float]] = None,
+                          gas_cost_per_leg: float = 0.0,
+                          turnover_cost: float = 0.0,
+                          min_trade_size: float = 0.0,
+                          holding_period_days: float = 30.0,
+                          robust: Optional[str] = None,
+                          alpha: float = 0.05,
+                          scenario_days: int = 30,
+                          market_data: Optional[Union[MarketColumns, List[Dict[str, Any]]]] = None,
+                          solver=None) -> Dict[str, float]:
+        """
+        Optimize fund allocation across markets, fetching the latest market data
+        unless a snapshot is given.
+
+        See `solve_allocation` for the parameters. With `robust` ("cvar" or
+        "worst_case") the yield is optimized against the APYs of the last
+        `scenario_days` of stored snapshots instead of the latest APYs only
+        (see `robust_optimization.py`); rebalancing costs are not modeled then,
+        and `solver` is not used.
+
+        Pass the snapshot already fetched in the same cycle as `market_data`:
+        every fetch stores a new snapshot, and in replay mode consumes an
+        archive record, so fetching again would solve a different snapshot.
+
+        Returns:
+            Dict[str, float]: Allocation in USD by market
+        """
+        if market_data is None:
+            market_data = self.fetch_market_data()
+
+        if robust is not None:
+            if current_positions is not None:
+                raise ValueError("Robust mode does not model rebalancing from current positions")
+            from robust_optimization import historical_scenarios, solve_robust_allocation
+
+            optimized_allocations = solve_robust_allocation(
+                market_data,
+                historical_scenarios(self.db, market_data, scenario_days),
+                available_funds,
+                max_risk=max_risk,
+                max_utilization=max_utilization,
+                objective=robust,
+                alpha=alpha
+            )
+        else:
+            optimized_allocations = solve_allocation(
+                market_data,
+                available_funds,
+                max_risk=max_risk,
+                max_utilization=max_utilization,
+                current_positions=current_positions,
+                gas_cost_per_leg=gas_cost_per_leg,
+                turnover_cost=turnover_cost,
+                min_trade_size=min_trade_size,
+                holding_period_days=holding_period_days,
+                solver=solver
+            )
         
         # Store results in database
         self.db.store_allocation_results(
@@ -289,6 +696,9 @@ class MorphoMarketOptimizer:
     def analyze_market_trends(self, market_key: str, days: int = 30) -> Dict[str, Any]:
         """
         Analyze historical trends for a specific market.
+
+        The history is read from the columnar export when the optimizer has
+        one (memory-mapped), from the database otherwise.
         
         Args:
             market_key (str): Market identifier
@@ -297,25 +707,31 @@ class MorphoMarketOptimizer:
         Returns:
             Dict[str, Any]: Analysis results
         """
-        historical_data = self.db.get_historical_market_data(market_key, days)
+        import numpy as np
+
+        if self.history is not None:
+            history = self.history.market_columns(market_key, days)
+        else:
+            history = self.db.get_historical_columns(market_key, days)
+        timestamps = history["timestamp"]
         
-        if not historical_data:
+        if not len(timestamps):
             return {"error": "No historical data available"}
         
-        # Calculate basic statistics
-        supply_apys = [d['supply_apy'] for d in historical_data]
-        utilizations = [d['utilization'] for d in historical_data]
+        # Calculate basic statistics; NULL values read as NaN from either source and are skipped
+        supply_apys = history["supply_apy"]
+        utilizations = history["utilization"]
         
         analysis = {
             "market_key": market_key,
-            "avg_supply_apy": sum(supply_apys) / len(supply_apys),
-            "max_supply_apy": max(supply_apys),
-            "min_supply_apy": min(supply_apys),
-            "avg_utilization": sum(utilizations) / len(utilizations),
-            "data_points": len(historical_data),
+            "avg_supply_apy": float(np.nanmean(supply_apys)),
+            "max_supply_apy": float(np.nanmax(supply_apys)),
+            "min_supply_apy": float(np.nanmin(supply_apys)),
+            "avg_utilization": float(np.nanmean(utilizations)),
+            "data_points": len(timestamps),
             "date_range": {
-                "start": historical_data[-1]['timestamp'],
-                "end": historical_data[0]['timestamp']
+                "start": timestamps[-1],
+                "end": timestamps[0]
             }
         }
         
@@ -326,27 +742,29 @@ def main():
     optimizer = MorphoMarketOptimizer()
     
     try:
-        # Fetch and store current market data
-        market_data = optimizer.fetch_market_data()
-        logger.info(f"Successfully fetched data for {len(market_data)} markets")
+        with record_run(optimizer.db, "main"):
+            # Fetch and store current market data
+            market_data = optimizer.fetch_market_data()
+            logger.info(f"Successfully fetched data for {len(market_data)} markets")
         
-        # Optimize allocation
-        allocations = optimizer.optimize_allocation(
-            available_funds=1_000_000,  # $1M USD
-            max_risk=0.2,
-            max_utilization=0.85
-        )
+            # Optimize allocation
+            allocations = optimizer.optimize_allocation(
+                available_funds=1_000_000,  # $1M USD
+                max_risk=0.2,
+                max_utilization=0.85,
+                market_data=market_data
+            )
         
-        # Print allocation results
-        print("\nOptimized Allocations:")
-        for market, amount in allocations.items():
-            print(f"{market}: ${amount:,.2f}")
+            # Print allocation results
+            print("\nOptimized Allocations:")
+            for market, amount in allocations.items():
+                print(f"{market}: ${amount:,.2f}")
             
-        # Analyze trends for a specific market
-        # sample_market = list(allocations.keys())[0]
-        # trends = optimizer.analyze_market_trends(sample_market)
-        # print(f"\nMarket Analysis for {sample_market}:")
-        # print(json.dumps(trends, indent=2))
+            # Analyze trends for a specific market
+            # sample_market = list(allocations.keys())[0]
+            # trends = optimizer.analyze_market_trends(sample_market)
+            # print(f"\nMarket Analysis for {sample_market}:")
+            # print(json.dumps(trends, indent=2))
         
     except Exception as e:
         logger.error(f"Error in main execution: {str(e)}")
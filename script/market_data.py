@@ -0,0 +1,244 @@
+import sys
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    # Imported where used: NumPy would double the cold start of every command
+    import numpy as np
+
+# Float fields, stored as NumPy columns by `MarketColumns`
+NUMERIC_FIELDS = ("borrow_apy", "supply_apy", "utilization", "lltv", "max_supply", "risk")
+FIELDS = ("market", "token", *NUMERIC_FIELDS, "collateral_token", "oracle", "irm", "lltv_raw", "supply_assets")
+
+# Asset dicts by (address, symbol, decimals): thousands of markets share a few
+# loan and collateral assets, so each asset is kept once. Treat them as read-only.
+_ASSETS: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+def _asset(asset: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if asset is None:
+        return None
+    key = (asset.get("address"), asset.get("symbol"), asset.get("decimals"))
+    shared = _ASSETS.get(key)
+    if shared is None:
+        shared = _ASSETS[key] = {name: _intern(value) for name, value in asset.items()}
+    return shared
+
+def _api_values(item: Dict[str, Any]) -> tuple:
+    """Values of one market of the API response, in `FIELDS` order."""
+    state = item["state"]
+    return (
+        _intern(item["uniqueKey"]),
+        _asset(item["loanAsset"]),
+        float(state["borrowApy"] or 0.0),
+        float(state["supplyApy"] or 0.0),
+        float(state["utilization"] or 0.0),
+        float(item["lltv"] or 0.0),
+        float(state["supplyAssetsUsd"] or 0.0),
+        float(state["fee"] or 0.0),
+        # On-chain identity of the market, needed to build `MarketParams`
+        _asset(item["collateralAsset"]),
+        _intern(item["oracleAddress"]),
+        _intern(item["irmAddress"]),
+        int(item["lltv"] or 0),
+        int(state["supplyAssets"] or 0),
+    )
+
+class MarketRecord:
+    """
+    One parsed market, with the fields of `FIELDS` as slots.
+
+    Supports `market["supply_apy"]`, `.get()` and `.keys()` like the dicts
+    it replaces, so code written against parsed dicts keeps working.
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, market: str, token: Dict[str, Any], borrow_apy: float, supply_apy: float,
+                 utilization: float, lltv: float, max_supply: float, risk: float,
+                 collateral_token: Optional[Dict[str, Any]] = None, oracle: Optional[str] = None,
+                 irm: Optional[str] = None, lltv_raw: int = 0, supply_assets: int = 0):
+        self.market = market
+        self.token = token
+        self.borrow_apy = borrow_apy
+        self.supply_apy = supply_apy
+        self.utilization = utilization
+        self.lltv = lltv
+        self.max_supply = max_supply
+        self.risk = risk
+        self.collateral_token = collateral_token
+        self.oracle = oracle
+        self.irm = irm
+        self.lltv_raw = lltv_raw
+        self.supply_assets = supply_assets
+
+    @classmethod
+    def from_api(cls, item: Dict[str, Any]) -> "MarketRecord":
+        """Parse one market of the API response."""
+        return cls(*_api_values(item))
+
+    @classmethod
+    def from_dict(cls, market: Dict[str, Any]) -> "MarketRecord":
+        """Build a record from a parsed-market dict (e.g. a database row); missing fields get defaults."""
+        return cls(**{name: market[name] for name in FIELDS if name in market})
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in FIELDS
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return getattr(self, name) if name in FIELDS else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return FIELDS
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, MarketRecord):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self) -> str:
+        return f"MarketRecord({self.market!r}, supply_apy={self.supply_apy}, max_supply={self.max_supply})"
+
+class MarketColumns:
+    def __init__(self,
+                 keys: List[str],
+                 tokens: List[Dict[str, Any]],
+                 numeric: Dict[str, "np.ndarray"],
+                 collateral_tokens: Optional[List[Optional[Dict[str, Any]]]] = None,
+                 oracles: Optional[List[Optional[str]]] = None,
+                 irms: Optional[List[Optional[str]]] = None,
+                 lltv_raw: Optional["np.ndarray"] = None,
+                 supply_assets: Optional[List[int]] = None):
+        """
+        Struct-of-arrays snapshot of many markets.
+
+        The float fields are NumPy columns (`columns.supply_apy`, ...) for
+        the optimizer and analytics; keys and addresses are interned strings
+        and assets are shared dicts. `supply_assets` stays a list of Python
+        ints, as token amounts overflow int64.
+
+        It also behaves like the list of parsed markets it replaces: `len()`,
+        iteration and `columns[i]` give `MarketRecord`s, and `columns[key]`,
+        `.get(key)` and `key in columns` look markets up by unique key.
+
+        Args:
+            keys (List[str]): Market unique keys
+            tokens (List[Dict[str, Any]]): Loan asset of every market
+            numeric (Dict[str, np.ndarray]): Column of every `NUMERIC_FIELDS` name
+            collateral_tokens (Optional[List[Optional[Dict[str, Any]]]]): Collateral assets
+            oracles (Optional[List[Optional[str]]]): Oracle addresses
+            irms (Optional[List[Optional[str]]]): IRM addresses
+            lltv_raw (Optional[np.ndarray]): LLTVs in WAD (int64)
+            supply_assets (Optional[List[int]]): Total supply in loan token units
+        """
+        import numpy as np
+
+        size = len(keys)
+        self.keys = keys
+        self.index = {key: i for i, key in enumerate(keys)}
+        self.tokens = tokens
+        for name in NUMERIC_FIELDS:
+            setattr(self, name, np.asarray(numeric[name], dtype=float))
+        self.collateral_tokens = collateral_tokens if collateral_tokens is not None else [None] * size
+        self.oracles = oracles if oracles is not None else [None] * size
+        self.irms = irms if irms is not None else [None] * size
+        self.lltv_raw = np.asarray(lltv_raw if lltv_raw is not None else np.zeros(size), dtype=np.int64)
+        self.supply_assets = supply_assets if supply_assets is not None else [0] * size
+
+    @classmethod
+    def from_api(cls, items: Iterable[Dict[str, Any]]) -> "MarketColumns":
+        """Parse the `markets.items` of an API response straight into columns."""
+        return cls._from_values(map(_api_values, items))
+
+    @classmethod
+    def from_markets(cls, markets: Iterable[Union[Dict[str, Any], MarketRecord]]) -> "MarketColumns":
+        """Build columns from parsed markets (dicts or records); columns are returned as they are."""
+        if isinstance(markets, MarketColumns):
+            return markets
+        records = (market if isinstance(market, MarketRecord) else MarketRecord.from_dict(market)
+                   for market in markets)
+        return cls._from_values(tuple(getattr(record, name) for name in FIELDS) for record in records)
+
+    @classmethod
+    def _from_values(cls, rows: Iterable[tuple]) -> "MarketColumns":
+        import numpy as np
+
+        # Transpose rows to columns in one pass of `zip`
+        columns = list(zip(*rows)) or [()] * len(FIELDS)
+        values = dict(zip(FIELDS, map(list, columns)))
+        return cls(
+            keys=values["market"],
+            tokens=values["token"],
+            numeric={name: np.array(values[name], dtype=float) for name in NUMERIC_FIELDS},
+            collateral_tokens=values["collateral_token"],
+            oracles=values["oracle"],
+            irms=values["irm"],
+            lltv_raw=np.array(values["lltv_raw"], dtype=np.int64),
+            supply_assets=values["supply_assets"],
+        )
+
+    def column(self, name: str) -> "np.ndarray":
+        """Return the NumPy column of a `NUMERIC_FIELDS` name."""
+        if name not in NUMERIC_FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def take(self, rows: Union["np.ndarray", List[int]]) -> "MarketColumns":
+        """Return the markets at `rows` (indices or boolean mask) as new columns."""
+        import numpy as np
+
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows, dtype=int)
+        return MarketColumns(
+            keys=[self.keys[i] for i in rows],
+            tokens=[self.tokens[i] for i in rows],
+            numeric={name: getattr(self, name)[rows] for name in NUMERIC_FIELDS},
+            collateral_tokens=[self.collateral_tokens[i] for i in rows],
+            oracles=[self.oracles[i] for i in rows],
+            irms=[self.irms[i] for i in rows],
+            lltv_raw=self.lltv_raw[rows],
+            supply_assets=[self.supply_assets[i] for i in rows],
+        )
+
+    def record(self, row: int) -> MarketRecord:
+        return MarketRecord(
+            self.keys[row], self.tokens[row],
+            *(float(getattr(self, name)[row]) for name in NUMERIC_FIELDS),
+            self.collateral_tokens[row], self.oracles[row], self.irms[row],
+            int(self.lltv_raw[row]), self.supply_assets[row],
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __iter__(self) -> Iterator[MarketRecord]:
+        numeric = [getattr(self, name).tolist() for name in NUMERIC_FIELDS]
+        for row in zip(self.keys, self.tokens, *numeric, self.collateral_tokens,
+                       self.oracles, self.irms, self.lltv_raw.tolist(), self.supply_assets):
+            yield MarketRecord(*row)
+
+    def __getitem__(self, item: Union[int, str]) -> MarketRecord:
+        if isinstance(item, str):
+            return self.record(self.index[item])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        return self.record(item)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def get(self, key: str, default: Any = None) -> Optional[MarketRecord]:
+        row = self.index.get(key)
+        return default if row is None else self.record(row)
+
+    def __repr__(self) -> str:
+        return f"MarketColumns({len(self)} markets)"
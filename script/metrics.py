@@ -0,0 +1,240 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets: seconds by default, counts for some series
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HISTOGRAM_BUCKETS = {
+    "rpc_calls_per_transaction": (1, 2, 5, 10, 20, 50, 100),
+}
+
+HELP = {
+    "pipeline_stage_seconds": "Duration of pipeline stages",
+    "pipeline_cycle_seconds": "Time between consecutive allocations of the pipeline orchestrator",
+    "http_request_seconds": "Morpho API request latency",
+    "http_response_bytes_total": "Bytes received from the Morpho API",
+    "db_rows_written_total": "Rows written to SQLite",
+    "rpc_calls_total": "JSON-RPC calls made to the node",
+    "rpc_calls_per_transaction": "JSON-RPC calls made to send one transaction",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Metrics:
+    def __init__(self):
+        """
+        In-process registry of counters and histograms with labels.
+
+        Rendered in the Prometheus text format by `render()`, and summarized
+        per run by `record_run`.
+        """
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        # name -> labels -> [bucket counts..., sum, count]
+        self.histograms: Dict[str, Dict[Labels, list]] = {}
+
+    @staticmethod
+    def _labels(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """Increase a counter."""
+        key = self._labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record one observation in a histogram."""
+        key = self._labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            buckets = HISTOGRAM_BUCKETS.get(name, BUCKETS)
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a block as the pipeline stage `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("pipeline_stage_seconds", time.perf_counter() - started, stage=name)
+
+    def observe_stages(self, seconds: Dict[str, float]):
+        """Record stage durations measured elsewhere (e.g. in a worker process)."""
+        for name, value in seconds.items():
+            self.observe("pipeline_stage_seconds", value, stage=name)
+
+    def totals(self) -> Dict[str, float]:
+        """Flat view of all counters and histogram sums/counts, for run summaries."""
+        with self._lock:
+            flat = {}
+            for name, series in self.counters.items():
+                for labels, value in series.items():
+                    flat[self._series_name(name, labels)] = value
+            for name, series in self.histograms.items():
+                for labels, state in series.items():
+                    flat[self._series_name(f"{name}_sum", labels)] = state[-2]
+                    flat[self._series_name(f"{name}_count", labels)] = state[-1]
+            return flat
+
+    @staticmethod
+    def _series_name(name: str, labels: Labels, extra: Labels = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    def render(self) -> str:
+        """Render all series in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{self._series_name(name, labels)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, state in sorted(series.items()):
+                    # Bucket counts are cumulative, as Prometheus expects
+                    for bound, count in zip(HISTOGRAM_BUCKETS.get(name, BUCKETS), state):
+                        lines.append(f"{self._series_name(f'{name}_bucket', labels, (('le', str(bound)),))} {count}")
+                    lines.append(f"{self._series_name(f'{name}_bucket', labels, (('le', '+Inf'),))} {state[-1]}")
+                    lines.append(f"{self._series_name(f'{name}_sum', labels)} {state[-2]}")
+                    lines.append(f"{self._series_name(f'{name}_count', labels)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Metrics()
+
+def init_table(db):
+    """Initialize the run metrics table if it doesn't exist."""
+    with db.get_connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS run_metrics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                duration REAL,
+                success INTEGER NOT NULL,
+                summary TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+
+@contextmanager
+def record_run(db, name: str, registry: Metrics = REGISTRY) -> Iterator[str]:
+    """
+    Write a summary of what a run did to the `run_metrics` table.
+
+    The summary is the change of every counter and histogram sum/count
+    during the block, as JSON, so runs can be compared over time.
+
+    Args:
+        db (DatabaseManager): Database to write the summary to
+        name (str): Kind of run (e.g. "main", "daemon_tick")
+        registry (Metrics): Registry to summarize
+
+    Yields:
+        str: Run id
+    """
+    run_id = uuid.uuid4().hex
+    before = registry.totals()
+    started = time.perf_counter()
+    success = False
+    try:
+        yield run_id
+        success = True
+    finally:
+        duration = time.perf_counter() - started
+        after = registry.totals()
+        summary = {key: value - before.get(key, 0.0) for key, value in after.items()
+                   if value != before.get(key, 0.0)}
+        try:
+            init_table(db)
+            with db.get_connection() as conn:
+                conn.execute("""
+                    INSERT INTO run_metrics (run_id, name, duration, success, summary)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (run_id, name, duration, int(success), json.dumps(summary, sort_keys=True)))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to store run metrics: {str(e)}")
+        logger.info(f"Run {name} {run_id[:8]} took {duration:.2f}s")
+
+def instrument_web3(client):
+    """
+    Count the JSON-RPC calls of a Web3 client by method (idempotent).
+
+    Besides the registry's process-wide `rpc_calls_total`, the client keeps
+    its own count per thread (see `rpc_call_count`), so concurrent clients,
+    and watcher threads sharing a client, do not count each other's calls.
+    """
+    from web3.middleware import Web3Middleware
+
+    if "rpc_call_counter" in client.middleware_onion:
+        return client
+    calls = threading.local()
+
+    class RpcCallCounter(Web3Middleware):
+        def wrap_make_request(self, make_request):
+            def middleware(method, params):
+                REGISTRY.inc("rpc_calls_total", method=method)
+                calls.count = getattr(calls, "count", 0) + 1
+                return make_request(method, params)
+            return middleware
+
+    client.middleware_onion.add(RpcCallCounter, name="rpc_call_counter")
+    client.rpc_calls = calls
+    return client
+
+def rpc_call_count(client=None, registry: Metrics = REGISTRY) -> float:
+    """
+    JSON-RPC calls made so far by the current thread through an instrumented
+    `client`, or all calls counted in `registry` without a client.
+    """
+    if client is not None:
+        return getattr(client.rpc_calls, "count", 0)
+    with registry._lock:
+        return sum(registry.counters.get("rpc_calls_total", {}).values())
+
+def start_metrics_server(host: str = "127.0.0.1", port: int = 9100):
+    """Serve `/metrics` in a background thread and return the `ThreadingHTTPServer`."""
+    # Imported here: http.server costs ~40ms at the import of every command
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
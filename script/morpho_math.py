@@ -0,0 +1,220 @@
+import math
+from typing import List, Dict, Any, Tuple, Union
+
+import numpy as np
+
+from market_data import MarketColumns
+
+WAD = 10**18
+VIRTUAL_SHARES = 10**6
+VIRTUAL_ASSETS = 1
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+# -------------------------------------------------------------------------
+# Exact integer reference, mirroring MathLib / SharesMathLib / UtilsLib
+# -------------------------------------------------------------------------
+def mul_div_down(x: int, y: int, d: int) -> int:
+    return (x * y) // d
+
+def mul_div_up(x: int, y: int, d: int) -> int:
+    return (x * y + (d - 1)) // d
+
+def w_mul_down(x: int, y: int) -> int:
+    return mul_div_down(x, y, WAD)
+
+def w_taylor_compounded(x: int, n: int) -> int:
+    """Third order Taylor approximation of e^(x * n) - 1, in WAD."""
+    first_term = x * n
+    second_term = mul_div_down(first_term, first_term, 2 * WAD)
+    third_term = mul_div_down(second_term, first_term, 3 * WAD)
+    return first_term + second_term + third_term
+
+def to_shares_down(assets: int, total_assets: int, total_shares: int) -> int:
+    return mul_div_down(assets, total_shares + VIRTUAL_SHARES, total_assets + VIRTUAL_ASSETS)
+
+def to_shares_up(assets: int, total_assets: int, total_shares: int) -> int:
+    return mul_div_up(assets, total_shares + VIRTUAL_SHARES, total_assets + VIRTUAL_ASSETS)
+
+def to_assets_down(shares: int, total_assets: int, total_shares: int) -> int:
+    return mul_div_down(shares, total_assets + VIRTUAL_ASSETS, total_shares + VIRTUAL_SHARES)
+
+def to_assets_up(shares: int, total_assets: int, total_shares: int) -> int:
+    return mul_div_up(shares, total_assets + VIRTUAL_ASSETS, total_shares + VIRTUAL_SHARES)
+
+def zero_floor_sub(x: int, y: int) -> int:
+    return x - y if x > y else 0
+
+def accrue_interest(total_supply_assets: int,
+                    total_supply_shares: int,
+                    total_borrow_assets: int,
+                    fee: int,
+                    borrow_rate: int,
+                    elapsed: int) -> Tuple[int, int, int, int]:
+    """
+    Model Morpho Blue's `_accrueInterest` for one market.
+
+    Args:
+        total_supply_assets (int): Market total supply assets
+        total_supply_shares (int): Market total supply shares
+        total_borrow_assets (int): Market total borrow assets
+        fee (int): Market fee, in WAD
+        borrow_rate (int): IRM borrow rate per second, in WAD
+        elapsed (int): Seconds since the market's last update
+
+    Returns:
+        Tuple[int, int, int, int]: New total supply assets, total supply shares,
+        total borrow assets and the fee shares minted
+    """
+    if elapsed == 0:
+        return total_supply_assets, total_supply_shares, total_borrow_assets, 0
+
+    interest = w_mul_down(total_borrow_assets, w_taylor_compounded(borrow_rate, elapsed))
+    total_borrow_assets += interest
+    total_supply_assets += interest
+
+    fee_shares = 0
+    if fee != 0:
+        fee_amount = w_mul_down(interest, fee)
+        fee_shares = to_shares_down(fee_amount, total_supply_assets - fee_amount, total_supply_shares)
+        total_supply_shares += fee_shares
+
+    return total_supply_assets, total_supply_shares, total_borrow_assets, fee_shares
+
+def accrued_fee_shares(new_total_assets: int,
+                       last_total_assets: int,
+                       fee: int,
+                       total_supply: int,
+                       decimals_offset: int) -> int:
+    """
+    Model MetaMorpho's `_accruedFeeShares`.
+
+    Args:
+        new_total_assets (int): Vault total assets after accrual
+        last_total_assets (int): Vault `lastTotalAssets`
+        fee (int): Vault performance fee, in WAD
+        total_supply (int): Vault share supply
+        decimals_offset (int): Vault `DECIMALS_OFFSET`
+
+    Returns:
+        int: Fee shares minted to the fee recipient
+    """
+    total_interest = zero_floor_sub(new_total_assets, last_total_assets)
+    if total_interest == 0 or fee == 0:
+        return 0
+
+    fee_assets = mul_div_down(total_interest, fee, WAD)
+    return mul_div_down(fee_assets, total_supply + 10**decimals_offset, new_total_assets - fee_assets + 1)
+
+def supply_apy(borrow_rate: int, total_supply_assets: int, total_borrow_assets: int, fee: int) -> float:
+    """Supply APY of a market: continuously compounded borrow APY x utilization x (1 - fee)."""
+    if total_supply_assets == 0:
+        return 0.0
+    borrow_apy = math.expm1(borrow_rate / WAD * SECONDS_PER_YEAR)
+    return borrow_apy * (total_borrow_assets / total_supply_assets) * (1 - fee / WAD)
+
+# -------------------------------------------------------------------------
+# Vectorized float64 path over arrays of markets
+# -------------------------------------------------------------------------
+def w_taylor_compounded_np(rate: np.ndarray, elapsed: np.ndarray) -> np.ndarray:
+    """`w_taylor_compounded` on per-second rates as fractions (not WAD)."""
+    first_term = np.asarray(rate, dtype=np.float64) * np.asarray(elapsed, dtype=np.float64)
+    return first_term + first_term**2 / 2 + first_term**3 / 6
+
+def to_assets_down_np(shares, total_assets, total_shares) -> np.ndarray:
+    return np.floor(np.asarray(shares, dtype=np.float64) * (np.asarray(total_assets, dtype=np.float64) + VIRTUAL_ASSETS)
+                    / (np.asarray(total_shares, dtype=np.float64) + VIRTUAL_SHARES))
+
+def to_shares_down_np(assets, total_assets, total_shares) -> np.ndarray:
+    return np.floor(np.asarray(assets, dtype=np.float64) * (np.asarray(total_shares, dtype=np.float64) + VIRTUAL_SHARES)
+                    / (np.asarray(total_assets, dtype=np.float64) + VIRTUAL_ASSETS))
+
+def accrue_interest_np(total_supply_assets,
+                       total_supply_shares,
+                       total_borrow_assets,
+                       fee,
+                       borrow_rate,
+                       elapsed) -> Dict[str, np.ndarray]:
+    """
+    Vectorized `accrue_interest` over arrays of markets.
+
+    Amounts are float64 token units; `fee` is a fraction and `borrow_rate` a
+    per-second fraction. Results match the integer path to float precision.
+
+    Returns:
+        Dict[str, np.ndarray]: `total_supply_assets`, `total_supply_shares`,
+        `total_borrow_assets`, `fee_shares`, `utilization` and `supply_apy`
+    """
+    supply = np.asarray(total_supply_assets, dtype=np.float64)
+    shares = np.asarray(total_supply_shares, dtype=np.float64)
+    borrow = np.asarray(total_borrow_assets, dtype=np.float64)
+    fee = np.asarray(fee, dtype=np.float64)
+    rate = np.asarray(borrow_rate, dtype=np.float64)
+
+    interest = np.floor(borrow * w_taylor_compounded_np(rate, elapsed))
+    borrow = borrow + interest
+    supply = supply + interest
+
+    fee_amount = np.floor(interest * fee)
+    fee_shares = to_shares_down_np(fee_amount, supply - fee_amount, shares)
+    shares = shares + fee_shares
+
+    utilization = np.divide(borrow, supply, out=np.zeros_like(supply), where=supply > 0)
+    apy = np.expm1(rate * SECONDS_PER_YEAR) * utilization * (1 - fee)
+
+    return {
+        "total_supply_assets": supply,
+        "total_supply_shares": shares,
+        "total_borrow_assets": borrow,
+        "fee_shares": fee_shares,
+        "utilization": utilization,
+        "supply_apy": apy,
+    }
+
+def accrue_interest_exact(total_supply_assets: List[int],
+                          total_supply_shares: List[int],
+                          total_borrow_assets: List[int],
+                          fee: List[int],
+                          borrow_rate: List[int],
+                          elapsed: List[int]) -> Dict[str, List[int]]:
+    """Integer reference for `accrue_interest_np`, with WAD fees and rates."""
+    results = [
+        accrue_interest(*market)
+        for market in zip(total_supply_assets, total_supply_shares, total_borrow_assets, fee, borrow_rate, elapsed)
+    ]
+    columns = list(zip(*results)) if results else [[], [], [], []]
+    return {
+        "total_supply_assets": list(columns[0]),
+        "total_supply_shares": list(columns[1]),
+        "total_borrow_assets": list(columns[2]),
+        "fee_shares": list(columns[3]),
+    }
+
+def project_market_apys(markets: Union[MarketColumns, List[Dict[str, Any]]], elapsed: float) -> np.ndarray:
+    """
+    Project the supply APY of parsed markets `elapsed` seconds after the API snapshot.
+
+    The borrow rate is backed out of the reported borrow APY and held constant,
+    and the market's `fee` (parsed as `risk`) is applied, so APYs can be refreshed
+    between API polls without an RPC or API call.
+
+    Args:
+        markets (Union[MarketColumns, List[Dict[str, Any]]]): Markets parsed by `_parse_market_data`
+        elapsed (float): Seconds since the snapshot
+
+    Returns:
+        np.ndarray: Projected supply APY of each market
+    """
+    columns = MarketColumns.from_markets(markets)
+    borrow_apy, utilization, fee = columns.borrow_apy, columns.utilization, columns.risk
+    supply = np.array(columns.supply_assets, dtype=np.float64)
+
+    rate = np.log1p(borrow_apy) / SECONDS_PER_YEAR
+    projected = accrue_interest_np(
+        total_supply_assets=supply,
+        total_supply_shares=supply * VIRTUAL_SHARES,
+        total_borrow_assets=supply * utilization,
+        fee=fee,
+        borrow_rate=rate,
+        elapsed=elapsed
+    )
+    return projected["supply_apy"]
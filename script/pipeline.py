@@ -0,0 +1,266 @@
+"""
+Asyncio pipeline that overlaps fetching, storing and optimizing snapshots.
+
+A sequential run waits on the API, then on SQLite, then on the solver. Here
+each stage runs on its own: the fetch loop polls the API in a thread, the
+solve loop optimizes in a worker process, and a writer thread stores
+snapshots and allocations behind both. The next poll is fetched while the
+current snapshot is being solved, so once the pipeline is full a cycle
+takes about as long as its slowest stage instead of the sum of all stages.
+
+The stages are connected by bounded queues: when the solver falls behind,
+the fetch loop waits for room in the snapshot queue, and when SQLite falls
+behind, both loops wait for room in the write queue.
+"""
+import asyncio
+import json
+import logging
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from main import DatabaseManager, MorphoMarketOptimizer, solve_allocation
+from market_data import MarketColumns
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# (cycle, fetch start in loop time, markets), or None once the fetch loop is done
+Snapshot = Optional[Tuple[int, float, MarketColumns]]
+
+def _solve(markets: MarketColumns, params: Dict[str, float]) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Process pool entry point: one silent CBC solve, with its LP build/solve seconds."""
+    from pulp import PULP_CBC_CMD
+
+    timings: Dict[str, float] = {}
+    allocation = solve_allocation(markets, solver=PULP_CBC_CMD(msg=False), timings=timings, **params)
+    return allocation, timings
+
+class DatabaseWriter:
+    def __init__(self, db_path: str, max_pending: int = 8):
+        """
+        Write-behind thread for SQLite.
+
+        Writes are `DatabaseManager` method calls queued with `submit` and
+        run in order on the writer's own persistent connection, so callers
+        do not wait for inserts and commits. `submit` blocks while
+        `max_pending` writes are queued. A failed write is logged and
+        counted in `errors`; the following writes still run.
+
+        Args:
+            db_path (str): Path to the SQLite database
+            max_pending (int): Queued writes before `submit` blocks
+        """
+        self.db_path = db_path
+        self.errors = 0
+        self._queue: "queue.Queue[Optional[Tuple[str, tuple]]]" = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, method: str, *args):
+        """Queue `DatabaseManager.<method>(*args)`, waiting for room if the queue is full."""
+        self._queue.put((method, args))
+
+    def flush(self):
+        """Wait until every queued write has run."""
+        self._queue.join()
+
+    def close(self):
+        """Run the queued writes, then stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        db = DatabaseManager(self.db_path, persistent=True)
+        try:
+            while True:
+                job = self._queue.get()
+                try:
+                    if job is None:
+                        return
+                    method, args = job
+                    with REGISTRY.stage(f"write_{method}"):
+                        getattr(db, method)(*args)
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Background write {job[0]} failed: {str(e)}")
+                finally:
+                    self._queue.task_done()
+        finally:
+            db.close()
+
+class PipelineOrchestrator:
+    def __init__(self,
+                 optimizer: Optional[MorphoMarketOptimizer] = None,
+                 solve_params: Optional[Dict[str, Any]] = None,
+                 interval: float = 60.0,
+                 queue_size: int = 1,
+                 max_pending_writes: int = 8):
+        """
+        Run fetch, store and solve as overlapping stages of a pipeline.
+
+        Polls start every `interval` seconds, or back to back with 0; a poll
+        that would start while the snapshot queue is full waits for the
+        solver instead (backpressure). Each snapshot is solved with
+        `solve_allocation(**solve_params)` in a worker process, and the
+        snapshot and its allocation are stored by a `DatabaseWriter`.
+        A failed poll is logged and retried at the next interval; a failed
+        solve skips that snapshot.
+
+        Args:
+            optimizer (Optional[MorphoMarketOptimizer]): Fetches and parses the
+                snapshots; its database is written through the writer thread
+            solve_params (Optional[Dict[str, Any]]): `solve_allocation`
+                parameters, $1M with the default limits by default
+            interval (float): Seconds between poll starts
+            queue_size (int): Snapshots fetched ahead of the solver
+            max_pending_writes (int): Writes queued before the stages wait on SQLite
+        """
+        self.optimizer = optimizer or MorphoMarketOptimizer()
+        self.solve_params = solve_params or {"available_funds": 1_000_000}
+        self.interval = interval
+        self.queue_size = queue_size
+        self.writer = DatabaseWriter(self.optimizer.db.db_path, max_pending_writes)
+
+        self.cycles = 0
+        self.failures = 0
+        self.allocation: Optional[Dict[str, float]] = None
+        self._stop: Optional[asyncio.Event] = None
+
+    def stop(self, *_):
+        """Stop polling; snapshots already fetched are still solved and stored."""
+        if self._stop is not None:
+            self._stop.set()
+
+    def _fetch(self) -> Tuple[MarketColumns, float]:
+        """Fetch and parse one snapshot (runs in a thread)."""
+        with REGISTRY.stage("fetch"):
+            raw = self.optimizer._fetch_raw(self.optimizer.MARKETS_QUERY)
+        snapshot_time = self.optimizer.snapshot_time
+        with REGISTRY.stage("parse"):
+            markets = self.optimizer._parse_market_data(json.loads(raw))
+        return markets, snapshot_time
+
+    async def _write(self, method: str, *args):
+        await asyncio.to_thread(self.writer.submit, method, *args)
+
+    async def _fetch_loop(self, snapshots: "asyncio.Queue[Snapshot]", max_cycles: Optional[int]):
+        loop = asyncio.get_running_loop()
+        cycle = 0
+        next_poll = loop.time()
+        try:
+            while not self._stop.is_set() and (max_cycles is None or cycle < max_cycles):
+                started = loop.time()
+                try:
+                    markets, snapshot_time = await asyncio.to_thread(self._fetch)
+                except EOFError:
+                    logger.info("Replay archive exhausted, stopping")
+                    break
+                except Exception as e:
+                    self.failures += 1
+                    logger.error(f"Poll failed ({self.failures} in a row): {str(e)}")
+                else:
+                    self.failures = 0
+                    self.optimizer.latest_markets = markets
+                    # The snapshot time is fixed here, as the write may run later
+                    await self._write("store_market_data", markets, snapshot_time)
+                    await snapshots.put((cycle, started, markets))
+                    cycle += 1
+
+                next_poll = max(next_poll + self.interval, loop.time())
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=next_poll - loop.time())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await snapshots.put(None)
+
+    async def _solve_loop(self, snapshots: "asyncio.Queue[Snapshot]", pool: ProcessPoolExecutor):
+        loop = asyncio.get_running_loop()
+        stored_params = {
+            "available_funds": self.solve_params["available_funds"],
+            "max_risk": self.solve_params.get("max_risk", 0.2),
+            "max_utilization": self.solve_params.get("max_utilization", 0.85),
+        }
+        last_done: Optional[float] = None
+        while True:
+            snapshot = await snapshots.get()
+            if snapshot is None:
+                return
+            cycle, fetch_started, markets = snapshot
+
+            try:
+                with REGISTRY.stage("solve"):
+                    allocation, timings = await loop.run_in_executor(pool, _solve, markets, self.solve_params)
+            except Exception as e:
+                logger.error(f"Optimization of snapshot {cycle} failed: {str(e)}")
+                continue
+            # Recorded here: the worker's registry is a copy that is never served
+            REGISTRY.observe_stages(timings)
+            self.allocation = allocation
+            await self._write("store_allocation_results", allocation, stored_params)
+
+            # Time between consecutive allocations: the pipeline's cycle time
+            done = loop.time()
+            if last_done is not None:
+                REGISTRY.observe("pipeline_cycle_seconds", done - last_done)
+            last_done = done
+            self.cycles += 1
+            logger.info(f"Cycle {cycle}: {len(markets)} markets, "
+                        f"{done - fetch_started:.2f}s from poll to allocation")
+
+    async def run(self, max_cycles: Optional[int] = None):
+        """
+        Run the pipeline until stopped (signal or `stop()`), or for `max_cycles` polls.
+
+        Returns once every fetched snapshot has been solved and every write
+        has been committed.
+
+        Args:
+            max_cycles (Optional[int]): Number of successful polls, unbounded by default
+        """
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, self.stop)
+                except NotImplementedError:
+                    pass
+
+        snapshots: "asyncio.Queue[Snapshot]" = asyncio.Queue(maxsize=self.queue_size)
+        self.writer.start()
+        # One process: snapshots are solved in order, overlapping the next fetch
+        pool = ProcessPoolExecutor(max_workers=1)
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(
+                self._fetch_loop(snapshots, max_cycles),
+                self._solve_loop(snapshots, pool),
+            )
+        finally:
+            pool.shutdown(cancel_futures=True)
+            await asyncio.to_thread(self.writer.close)
+            self.optimizer.session.close()
+            logger.info(f"Pipeline stopped after {self.cycles} cycles in {time.perf_counter() - started:.2f}s "
+                        f"({self.writer.errors} failed writes)")
+
+def main():
+    try:
+        orchestrator = PipelineOrchestrator(solve_params={
+            'available_funds': 1_000_000,
+            'max_risk': 0.2,
+            'max_utilization': 0.85,
+        })
+        asyncio.run(orchestrator.run())
+    except Exception as e:
+        logger.error(f"Error in pipeline: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
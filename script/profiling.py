@@ -0,0 +1,127 @@
+"""
+Opt-in profiling of the hot paths.
+
+Set MORPHO_PROFILE to a run directory (or to 1 for profiles/<time>-<pid>),
+or pass `--profile` to cli.py, and every call of a function decorated with
+`profiled` writes a cProfile dump and a tracemalloc snapshot to the run
+directory and appends its top functions by time and allocations to
+summary.txt.
+
+The decision is taken when the decorated function is defined: when
+profiling is off, `profiled` returns the function itself, so there is no
+overhead at all. Profiling must therefore be enabled before the profiled
+modules are imported.
+"""
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENV = "MORPHO_PROFILE"
+TOP_FUNCTIONS = 15
+TRACEMALLOC_FRAMES = 10
+
+_run_dir: Optional[str] = None
+_calls = itertools.count(1)
+# Profilers of the stages running on each thread, innermost last: cProfile
+# profiles the thread that enables it, so stages only nest within a thread
+_local = threading.local()
+_summary_lock = threading.Lock()
+
+def enable(directory: Optional[str] = None) -> str:
+    """
+    Turn profiling on for the functions decorated from now on.
+
+    Args:
+        directory (Optional[str]): Run directory, profiles/<time>-<pid> by default
+
+    Returns:
+        str: Run directory
+    """
+    global _run_dir
+    import tracemalloc
+
+    if directory is None or directory == "1":
+        directory = os.path.join("profiles", f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    os.makedirs(directory, exist_ok=True)
+    _run_dir = directory
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    logger.info(f"Profiling enabled, writing to {directory}")
+    return directory
+
+def enabled() -> bool:
+    return _run_dir is not None
+
+def _summarize(stage: str, seq: int, elapsed: float, profiler, before, after) -> str:
+    import io
+    import pstats
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+
+    lines = [f"=== {seq:04d} {stage}: {elapsed:.3f}s", "--- Top functions by cumulative time",
+             stream.getvalue().strip(), "--- Top allocations (net, by line)"]
+    for diff in after.compare_to(before, "lineno")[:TOP_FUNCTIONS]:
+        lines.append(f"{diff.size_diff / 1024:+10.1f} KiB {diff.count_diff:+8d} blocks  {diff.traceback[0]}")
+    return "\n".join(lines) + "\n\n"
+
+def profiled(stage: str) -> Callable[[Callable], Callable]:
+    """
+    Profile every call of the decorated function as `stage`.
+
+    Dumps are exclusive: a stage called from another one (the fetch inside
+    `optimize_allocation`) pauses the enclosing stage's profiler, so each
+    dump only holds its own stage; stages running on other threads (the
+    pipeline's fetches, the service's refreshes) are profiled separately.
+    Allocation snapshots are inclusive and process-wide.
+    """
+    def decorator(func: Callable) -> Callable:
+        if not enabled():
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            import cProfile
+            import tracemalloc
+
+            seq = next(_calls)
+            active = _local.__dict__.setdefault("active", [])
+            profiler = cProfile.Profile()
+            if active:
+                active[-1].disable()
+            active.append(profiler)
+
+            before = tracemalloc.take_snapshot()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.disable()
+                elapsed = time.perf_counter() - started
+                after = tracemalloc.take_snapshot()
+                active.pop()
+                try:
+                    prefix = os.path.join(_run_dir, f"{seq:04d}-{stage}")
+                    profiler.dump_stats(prefix + ".prof")
+                    after.dump(prefix + ".tracemalloc")
+                    summary = _summarize(stage, seq, elapsed, profiler, before, after)
+                    with _summary_lock, open(os.path.join(_run_dir, "summary.txt"), "a") as f:
+                        f.write(summary)
+                except Exception as e:
+                    logger.error(f"Failed to write the {stage} profile: {str(e)}")
+                if active:
+                    active[-1].enable()
+
+        return wrapper
+    return decorator
+
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV])
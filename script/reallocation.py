@@ -0,0 +1,467 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, asdict
+from decimal import Decimal, ROUND_DOWN
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+from web3 import Web3
+
+from main import MorphoMarketOptimizer
+from market_data import MarketColumns
+from fee_oracle import FeeOracle
+from receipt_watcher import ReceiptWatcher
+from Scripter import (
+    get_w3,
+    MarketParams,
+    MarketAllocation,
+    NEW_METAMORPH_VAULT_ADDRESS,
+    get_vault_caps,
+    get_vault_supply_assets,
+    simulate_and_send_reallocate,
+)
+
+logger = logging.getLogger(__name__)
+
+# `reallocate` treats `type(uint256).max` as "supply everything withdrawn so far"
+MAX_UINT256 = 2**256 - 1
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+USDC_ADDRESS = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+
+BLOCK_GAS_LIMIT = 30_000_000
+# Converting USD targets to token units rounds each leg down by less than one unit,
+# and markets imply slightly different loan token prices (`supplyAssetsUsd / supplyAssets`)
+MAX_ROUNDING_UNITS_PER_LEG = 1
+MAX_PRICE_MISMATCH = 1e-6
+GAS_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gas_model.json")
+
+@dataclass
+class ReallocationLeg:
+    """Move of one market from its current supply to a target supply, in loan token units."""
+    market_key: str
+    market_params: MarketParams
+    current_assets: int
+    target_assets: int
+
+    @property
+    def is_withdrawal(self) -> bool:
+        return self.target_assets < self.current_assets
+
+    @property
+    def amount(self) -> int:
+        """Absolute amount of assets moved by this leg."""
+        return abs(self.target_assets - self.current_assets)
+
+def market_params_from_market(market: Dict[str, Any]) -> MarketParams:
+    """
+    Build the on-chain `MarketParams` of a market parsed by `_parse_market_data`.
+
+    Args:
+        market (Dict[str, Any]): Parsed market data
+
+    Returns:
+        MarketParams: Market parameters as expected by `reallocate`
+    """
+    collateral = market["collateral_token"]
+    return MarketParams(
+        loan_token=Web3.to_checksum_address(market["token"]["address"]),
+        collateral_token=Web3.to_checksum_address(collateral["address"] if collateral else ZERO_ADDRESS),
+        oracle=Web3.to_checksum_address(market["oracle"] or ZERO_ADDRESS),
+        irm=Web3.to_checksum_address(market["irm"] or ZERO_ADDRESS),
+        lltv=market["lltv_raw"]
+    )
+
+def usd_to_token_units(amount_usd: float, market: Dict[str, Any]) -> int:
+    """
+    Convert a USD amount into integer loan token units of a market.
+
+    The loan token price is implied by the market's `supplyAssetsUsd / supplyAssets`.
+
+    Args:
+        amount_usd (float): Amount in USD
+        market (Dict[str, Any]): Parsed market data
+
+    Returns:
+        int: Amount in loan token units, rounded down
+    """
+    decimals = int(market["token"]["decimals"])
+    if market["supply_assets"] <= 0 or market["max_supply"] <= 0:
+        raise ValueError(f"Cannot price loan token of market {market['market']}: no supply")
+
+    price = Decimal(str(market["max_supply"])) * 10**decimals / Decimal(market["supply_assets"])
+    units = Decimal(str(amount_usd)) / price * 10**decimals
+    return int(units.to_integral_value(rounding=ROUND_DOWN))
+
+def token_units_to_usd(assets: int, market: Dict[str, Any]) -> float:
+    """
+    Convert integer loan token units of a market into USD.
+
+    Args:
+        assets (int): Amount in loan token units
+        market (Dict[str, Any]): Parsed market data
+
+    Returns:
+        float: Amount in USD
+    """
+    if market["supply_assets"] <= 0:
+        raise ValueError(f"Cannot price loan token of market {market['market']}: no supply")
+    return float(Decimal(assets) * Decimal(str(market["max_supply"])) / Decimal(market["supply_assets"]))
+
+def build_reallocation_legs(allocations_usd: Dict[str, float],
+                            markets: Union[MarketColumns, Dict[str, Dict[str, Any]]],
+                            current_assets: Optional[Dict[str, int]] = None,
+                            loan_token: Optional[str] = None,
+                            min_trade_size: float = 0.01) -> List[ReallocationLeg]:
+    """
+    Turn optimizer output into reallocation legs.
+
+    Markets currently held but absent from `allocations_usd` are withdrawn entirely.
+    Markets neither held nor targeted are ignored, and markets whose loan token
+    cannot be priced (no supply) are skipped with a warning.
+
+    Args:
+        allocations_usd (Dict[str, float]): Target allocation in USD by market key
+        markets (Union[MarketColumns, Dict[str, Dict[str, Any]]]): Parsed market data by market key
+        current_assets (Optional[Dict[str, int]]): Vault supply in token units by market key
+        loan_token (Optional[str]): Vault asset; markets with another loan token are skipped
+        min_trade_size (float): Moves smaller than this amount in USD are skipped
+
+    Returns:
+        List[ReallocationLeg]: Legs that change the vault's supply
+    """
+    current_assets = current_assets or {}
+    legs = []
+
+    for market_key in dict.fromkeys([*allocations_usd, *current_assets]):
+        market = markets.get(market_key)
+        if market is None:
+            logger.warning(f"Skipping market {market_key}: no market data")
+            continue
+        if loan_token and market["token"]["address"].lower() != loan_token.lower():
+            logger.warning(f"Skipping market {market_key}: loan token {market['token']['symbol']} is not the vault asset")
+            continue
+
+        current = current_assets.get(market_key, 0)
+        # Solver tolerance can leave tiny negative amounts, which would become negative units
+        target_usd = max(allocations_usd.get(market_key) or 0.0, 0.0)
+        if current == 0 and target_usd <= 0:
+            continue
+        try:
+            if abs(target_usd - token_units_to_usd(current, market)) < min_trade_size:
+                continue
+            target = usd_to_token_units(target_usd, market)
+        except ValueError as e:
+            logger.warning(f"Skipping market {market_key}: {str(e)}")
+            continue
+
+        legs.append(ReallocationLeg(
+            market_key=market_key,
+            market_params=market_params_from_market(market),
+            current_assets=current,
+            target_assets=target
+        ))
+
+    return legs
+
+def to_market_allocations(legs: List[ReallocationLeg]) -> List[MarketAllocation]:
+    """
+    Order legs the way `reallocate` requires: withdrawals first, then supplies.
+
+    The last supply targets `type(uint256).max` so that it absorbs rounding in the
+    withdrawn amounts and the call stays balanced.
+
+    Args:
+        legs (List[ReallocationLeg]): Reallocation legs
+
+    Returns:
+        List[MarketAllocation]: Allocations ready for `simulate_and_send_reallocate`
+    """
+    withdrawals = [leg for leg in legs if leg.is_withdrawal]
+    supplies = [leg for leg in legs if not leg.is_withdrawal]
+
+    allocations = [
+        MarketAllocation(market_params=leg.market_params, assets=leg.target_assets)
+        for leg in withdrawals + supplies
+    ]
+    if withdrawals and supplies:
+        allocations[-1].assets = MAX_UINT256
+
+    return allocations
+
+@dataclass
+class GasModel:
+    """
+    Linear gas cost model of a `reallocate` transaction.
+
+    The defaults are conservative; `GasModel.load` reads the calibration measured on anvil.
+    """
+    base_gas: int = 60_000
+    withdraw_leg_gas: int = 90_000
+    supply_leg_gas: int = 110_000
+
+    @classmethod
+    def load(cls, path: str = GAS_MODEL_PATH) -> "GasModel":
+        """Load a calibrated model, falling back to the defaults if no calibration exists."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str = GAS_MODEL_PATH):
+        with open(path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+
+    def leg_gas(self, leg: ReallocationLeg) -> int:
+        return self.withdraw_leg_gas if leg.is_withdrawal else self.supply_leg_gas
+
+    def estimate(self, legs: List[ReallocationLeg]) -> int:
+        """Estimate the gas used by a `reallocate` call made of `legs`."""
+        return self.base_gas + sum(self.leg_gas(leg) for leg in legs)
+
+def _pair_transfers(legs: List[ReallocationLeg]) -> List[Tuple[int, int, int]]:
+    """
+    Match withdrawals with supplies in order.
+
+    Returns:
+        List[Tuple[int, int, int]]: (withdrawal index, supply index, amount) transfers
+    """
+    withdrawals = [leg for leg in legs if leg.is_withdrawal]
+    supplies = [leg for leg in legs if not leg.is_withdrawal]
+    withdraw_left = [leg.amount for leg in withdrawals]
+    supply_left = [leg.amount for leg in supplies]
+
+    transfers = []
+    i = j = 0
+    while i < len(withdrawals) and j < len(supplies):
+        amount = min(withdraw_left[i], supply_left[j])
+        transfers.append((i, j, amount))
+        withdraw_left[i] -= amount
+        supply_left[j] -= amount
+        if withdraw_left[i] == 0:
+            i += 1
+        if supply_left[j] == 0:
+            j += 1
+
+    # Token unit rounding rarely balances exactly: rounding-sized spare withdrawals go
+    # to the last supply (which `reallocate` fills with `type(uint256).max`), and
+    # rounding-sized unfunded supplies are cut. A larger imbalance either way means
+    # the targets do not add up to what the vault holds, which moving the difference
+    # into one market or cutting it would only hide.
+    withdrawn = sum(leg.amount for leg in withdrawals)
+    supplied = sum(leg.amount for leg in supplies)
+    tolerance = MAX_ROUNDING_UNITS_PER_LEG * len(legs) + int(max(withdrawn, supplied) * MAX_PRICE_MISMATCH)
+    if i < len(withdrawals):
+        if not supplies:
+            raise ValueError("Reallocation is unbalanced: withdrawals have no supply to go to")
+        spare = sum(withdraw_left[i:])
+        if spare > tolerance:
+            raise ValueError(f"Reallocation is unbalanced: withdrawals exceed supplies by {spare} units "
+                             f"({supplied} supplied, {withdrawn} withdrawn)")
+        for k in range(i, len(withdrawals)):
+            transfers.append((k, len(supplies) - 1, withdraw_left[k]))
+        logger.warning(f"Supplying {spare} spare withdrawn units to the last market (rounding)")
+    elif j < len(supplies):
+        unfunded = sum(supply_left[j:])
+        if unfunded > tolerance:
+            raise ValueError(f"Reallocation is unbalanced: supplies exceed withdrawals by {unfunded} units "
+                             f"({supplied} supplied, {withdrawn} withdrawn)")
+        logger.warning(f"Cutting {unfunded} unfunded supply units (rounding)")
+
+    return [transfer for transfer in transfers if transfer[2] > 0]
+
+def plan_reallocation_chunks(legs: List[ReallocationLeg],
+                             gas_model: Optional[GasModel] = None,
+                             gas_budget: int = BLOCK_GAS_LIMIT) -> List[List[MarketAllocation]]:
+    """
+    Split a reallocation into the fewest `reallocate` calls that fit a gas budget.
+
+    Withdrawals are matched with supplies into transfers, which are packed in order
+    into chunks. Every chunk only contains whole transfers, so it is balanced; a
+    market split across chunks gets an intermediate target in each of them.
+
+    Args:
+        legs (List[ReallocationLeg]): Balanced reallocation legs
+        gas_model (Optional[GasModel]): Gas cost model, calibrated one by default
+        gas_budget (int): Maximum gas per transaction
+
+    Returns:
+        List[List[MarketAllocation]]: Allocations of each transaction, in sending order
+
+    Raises:
+        ValueError: If a withdraw/supply pair does not fit the budget, or the legs
+            supply more or less than they withdraw beyond token unit rounding
+    """
+    gas_model = gas_model or GasModel.load()
+    withdrawals = [leg for leg in legs if leg.is_withdrawal]
+    supplies = [leg for leg in legs if not leg.is_withdrawal]
+
+    if gas_model.base_gas + gas_model.withdraw_leg_gas + gas_model.supply_leg_gas > gas_budget:
+        raise ValueError(f"Gas budget {gas_budget} cannot fit a single withdraw/supply pair")
+
+    chunks: List[List[Tuple[int, int, int]]] = []
+    chunk_withdrawals, chunk_supplies, chunk_transfers = set(), set(), []
+    for i, j, amount in _pair_transfers(legs):
+        new_withdrawals = chunk_withdrawals | {i}
+        new_supplies = chunk_supplies | {j}
+        gas = (gas_model.base_gas
+               + gas_model.withdraw_leg_gas * len(new_withdrawals)
+               + gas_model.supply_leg_gas * len(new_supplies))
+        if gas > gas_budget:
+            chunks.append(chunk_transfers)
+            new_withdrawals, new_supplies, chunk_transfers = {i}, {j}, []
+        chunk_withdrawals, chunk_supplies = new_withdrawals, new_supplies
+        chunk_transfers.append((i, j, amount))
+    if chunk_transfers:
+        chunks.append(chunk_transfers)
+
+    # Track each market's supply as the chunks are executed
+    withdrawn = [0] * len(withdrawals)
+    supplied = [0] * len(supplies)
+    planned = []
+    for transfers in chunks:
+        touched_withdrawals, touched_supplies = [], []
+        for i, j, amount in transfers:
+            withdrawn[i] += amount
+            supplied[j] += amount
+            if i not in touched_withdrawals:
+                touched_withdrawals.append(i)
+            if j not in touched_supplies:
+                touched_supplies.append(j)
+
+        chunk_legs = [
+            ReallocationLeg(withdrawals[i].market_key, withdrawals[i].market_params,
+                            withdrawals[i].current_assets, withdrawals[i].current_assets - withdrawn[i])
+            for i in touched_withdrawals
+        ] + [
+            ReallocationLeg(supplies[j].market_key, supplies[j].market_params,
+                            supplies[j].current_assets, supplies[j].current_assets + supplied[j])
+            for j in touched_supplies
+        ]
+        planned.append(to_market_allocations(chunk_legs))
+
+    logger.info(f"Planned {len(legs)} legs into {len(planned)} reallocate transactions "
+                f"(gas budget {gas_budget:,})")
+    return planned
+
+def send_reallocation_chunks(chunks: List[List[MarketAllocation]]) -> List[Any]:
+    """
+    Send planned chunks in sequence, stopping at the first failed transaction.
+
+    Returns:
+        List: Receipts of the confirmed transactions
+    """
+    receipts = []
+    client = get_w3()
+    with ReceiptWatcher(client) as watcher:
+        FeeOracle.for_client(client).attach(watcher)
+        for index, allocations in enumerate(chunks, start=1):
+            logger.info(f"Sending reallocate chunk {index}/{len(chunks)} ({len(allocations)} markets)")
+            receipt = simulate_and_send_reallocate(allocations, receipt_watcher=watcher)
+            if receipt is None:
+                logger.error(f"Reallocate chunk {index}/{len(chunks)} failed, stopping")
+                break
+            receipts.append(receipt)
+    return receipts
+
+def execute_optimized_allocation(optimizer: MorphoMarketOptimizer,
+                                 max_risk: float = 0.2,
+                                 max_utilization: float = 0.85,
+                                 loan_token: str = USDC_ADDRESS,
+                                 vault_address: str = NEW_METAMORPH_VAULT_ADDRESS,
+                                 gas_budget: int = BLOCK_GAS_LIMIT,
+                                 gas_cost_per_leg: float = 0.0,
+                                 min_trade_size: float = 0.01) -> List[Any]:
+    """
+    Run the full data -> decision -> transaction cycle.
+
+    The optimizer rebalances from the vault's current positions, so markets whose
+    APY gain does not cover `gas_cost_per_leg` are left untouched. It only
+    allocates across markets of the vault asset that the vault has enabled with
+    a non-zero cap, and only the USD value of the vault's current positions:
+    `reallocate` moves funds between markets, it cannot add any.
+
+    Args:
+        optimizer (MorphoMarketOptimizer): Optimizer used to fetch data and solve
+        max_risk (float): Maximum weighted risk
+        max_utilization (float): Maximum weighted utilization
+        loan_token (str): Vault asset
+        vault_address (str): MetaMorpho vault to reallocate
+        gas_budget (int): Maximum gas per `reallocate` transaction
+        gas_cost_per_leg (float): Gas cost in USD of each market touched
+        min_trade_size (float): Smallest amount in USD worth moving in a market
+
+    Returns:
+        List: Receipts of the confirmed transactions
+    """
+    # One snapshot for the whole cycle: positions are priced, solved and turned
+    # into legs at the same market state
+    markets = optimizer.fetch_market_data()
+
+    vault_asset = list(dict.fromkeys(
+        market["market"] for market in markets
+        if market["token"]["address"].lower() == loan_token.lower()
+    ))
+    caps = get_vault_caps(vault_asset, vault_address)
+    eligible = [key for key in vault_asset if caps[key] > 0]
+
+    # Positions in markets without a cap are not solved over: they are withdrawn entirely
+    current_assets = {
+        key: assets
+        for key, assets in get_vault_supply_assets(vault_asset, vault_address).items()
+        if assets > 0
+    }
+    current_usd = {}
+    for key, assets in current_assets.items():
+        try:
+            current_usd[key] = token_units_to_usd(assets, markets[key])
+        except ValueError as e:
+            logger.warning(f"Leaving position in market {key} untouched: {str(e)}")
+    current_assets = {key: current_assets[key] for key in current_usd}
+
+    available_funds = sum(current_usd.values())
+    if not eligible or available_funds <= 0:
+        logger.info("Nothing to reallocate: the vault has no positions or no capped market of its asset")
+        return []
+    logger.info(f"Reallocating ${available_funds:,.2f} across {len(eligible)} capped markets")
+
+    allocations_usd = optimizer.optimize_allocation(
+        available_funds=available_funds,
+        max_risk=max_risk,
+        max_utilization=max_utilization,
+        current_positions={key: current_usd[key] for key in eligible if key in current_usd},
+        gas_cost_per_leg=gas_cost_per_leg,
+        min_trade_size=min_trade_size,
+        market_data=markets.take([markets.index[key] for key in eligible])
+    )
+
+    legs = build_reallocation_legs(allocations_usd, markets, current_assets, loan_token, min_trade_size)
+    if not legs:
+        logger.info("Vault already matches the optimized allocation")
+        return []
+
+    logger.info(f"Reallocating {len(legs)} markets "
+                f"({sum(leg.is_withdrawal for leg in legs)} withdrawals)")
+    chunks = plan_reallocation_chunks(legs, gas_budget=gas_budget)
+    return send_reallocation_chunks(chunks)
+
+def main():
+    optimizer = MorphoMarketOptimizer()
+
+    try:
+        receipts = execute_optimized_allocation(
+            optimizer,
+            gas_cost_per_leg=5.0,
+            min_trade_size=1_000
+        )
+        if receipts:
+            print(f"Optimized reallocation completed in {len(receipts)} transaction(s).")
+        else:
+            print("Optimized reallocation not sent or failed.")
+
+    except Exception as e:
+        logger.error(f"Error in reallocation pipeline: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
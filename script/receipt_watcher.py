@@ -0,0 +1,160 @@
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Callable, Optional, Any
+
+from web3 import Web3
+
+logger = logging.getLogger(__name__)
+
+def _normalize_hash(tx_hash) -> str:
+    if isinstance(tx_hash, (bytes, bytearray)):
+        return "0x" + bytes(tx_hash).hex()
+    return tx_hash.lower() if tx_hash.startswith("0x") else "0x" + tx_hash.lower()
+
+class ReceiptWatcher:
+    def __init__(self, w3: Web3, poll_interval: float = 1.0):
+        """
+        Resolve transaction receipts from a single block watcher.
+
+        One `eth_blockNumber` call is made per poll and one `eth_getBlockReceipts`
+        call per new block, however many transactions are waiting.
+
+        Args:
+            w3 (Web3): Connected Web3 instance
+            poll_interval (float): Seconds between head polls
+        """
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self._pending: Dict[str, Future] = {}
+        self._block_listeners: List[Callable[[int], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_block: Optional[int] = None
+        self.rpc_calls = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Start watching new blocks in a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._last_block = self.w3.eth.block_number
+        self.rpc_calls += 1
+        self._thread = threading.Thread(target=self._run, name="receipt-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the watcher; waiting transactions can still fall back to a direct lookup."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_block_listener(self, listener: Callable[[int], None]):
+        """Call `listener(block_number)` for every new block seen by the watcher."""
+        self._block_listeners.append(listener)
+
+    def register(self, tx_hash) -> Future:
+        """
+        Register a transaction before sending it.
+
+        Args:
+            tx_hash: Hash of the signed transaction
+
+        Returns:
+            Future: Resolved with the receipt once the transaction is mined
+        """
+        key = _normalize_hash(tx_hash)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+        return future
+
+    def unregister(self, tx_hash):
+        """Stop watching a transaction, e.g. one whose sending failed."""
+        with self._lock:
+            future = self._pending.pop(_normalize_hash(tx_hash), None)
+        if future is not None:
+            future.cancel()
+
+    def wait(self, tx_hash, timeout: float = 120) -> Any:
+        """
+        Wait for the receipt of a registered transaction.
+
+        Args:
+            tx_hash: Hash of the transaction
+            timeout (float): Seconds to wait before a direct receipt lookup
+
+        Returns:
+            The transaction receipt
+        """
+        future = self.register(tx_hash)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # The transaction may have been mined before the watcher saw it
+            try:
+                return self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=self.poll_interval * 5)
+            finally:
+                self.unregister(tx_hash)
+
+    def _block_receipts(self, block_number: int, pending: set) -> List[Any]:
+        try:
+            self.rpc_calls += 1
+            return self.w3.eth.get_block_receipts(block_number)
+        except Exception as e:
+            # Nodes without eth_getBlockReceipts: look up only the waiting transactions
+            logger.debug(f"eth_getBlockReceipts unavailable ({e}), falling back to the block's transactions")
+            block = self.w3.eth.get_block(block_number)
+            self.rpc_calls += 1
+            receipts = []
+            for tx_hash in block["transactions"]:
+                if _normalize_hash(tx_hash) in pending:
+                    receipts.append(self.w3.eth.get_transaction_receipt(tx_hash))
+                    self.rpc_calls += 1
+            return receipts
+
+    def _process_block(self, block_number: int):
+        with self._lock:
+            pending = set(self._pending)
+
+        if pending:
+            for receipt in self._block_receipts(block_number, pending):
+                key = _normalize_hash(receipt["transactionHash"])
+                if key not in pending:
+                    continue
+                with self._lock:
+                    future = self._pending.pop(key, None)
+                if future is not None:
+                    future.set_result(receipt)
+
+        for listener in self._block_listeners:
+            try:
+                listener(block_number)
+            except Exception as e:
+                logger.error(f"Block listener failed on block {block_number}: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                head = self.w3.eth.block_number
+                self.rpc_calls += 1
+                for block_number in range(self._last_block + 1, head + 1):
+                    self._process_block(block_number)
+                    self._last_block = block_number
+            except Exception as e:
+                logger.warning(f"Receipt watcher poll failed: {str(e)}")
+            self._stop.wait(self.poll_interval)
@@ -0,0 +1,171 @@
+import bisect
+import gzip
+import logging
+import os
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional, gzip is used without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.tsv"
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+class ReplayArchive:
+    def __init__(self,
+                 directory: str = "archive",
+                 compression: str = "gzip",
+                 segment_bytes: int = 256 * 1024**2,
+                 level: int = 6):
+        """
+        Append-only archive of raw API responses.
+
+        Every response is compressed on its own (a gzip member or a zstd frame)
+        and appended to the current segment file, so any record can be read by
+        seeking to its offset. `index.tsv` maps each record's timestamp to its
+        segment, offset and length; it is small enough to be kept in memory.
+
+        Args:
+            directory (str): Directory of the segments and the index
+            compression (str): "gzip" or "zstd" (needs the zstandard package)
+            segment_bytes (int): Size after which a new segment is started
+            level (int): Compression level
+        """
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown compression {compression!r}, expected one of {list(EXTENSIONS)}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires the zstandard package")
+
+        self.directory = directory
+        self.compression = compression
+        self.segment_bytes = segment_bytes
+        self.level = level
+
+        self._lock = threading.Lock()
+        self._timestamps: List[float] = []
+        self._entries: List[Tuple[str, int, int]] = []
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path) as index:
+            for line in index:
+                timestamp, segment, offset, length = line.rstrip("\n").split("\t")
+                self._timestamps.append(float(timestamp))
+                self._entries.append((segment, int(offset), int(length)))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _current_segment(self) -> str:
+        sequence = 0
+        if self._entries:
+            segment = self._entries[-1][0]
+            if (segment.endswith(EXTENSIONS[self.compression])
+                    and os.path.getsize(os.path.join(self.directory, segment)) < self.segment_bytes):
+                return segment
+            sequence = int(segment.split("-")[1].split(".")[0]) + 1
+        return f"segment-{sequence:06d}{EXTENSIONS[self.compression]}"
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(payload)
+        return gzip.compress(payload, compresslevel=self.level)
+
+    @staticmethod
+    def _decompress(segment: str, blob: bytes) -> bytes:
+        if segment.endswith(EXTENSIONS["zstd"]):
+            if zstandard is None:
+                raise ImportError(f"Reading {segment} requires the zstandard package")
+            return zstandard.ZstdDecompressor().decompress(blob)
+        return gzip.decompress(blob)
+
+    def append(self, payload: bytes, timestamp: Optional[float] = None) -> float:
+        """
+        Archive one raw response.
+
+        Args:
+            payload (bytes): Response body as received
+            timestamp (Optional[float]): Unix time of the response, now by default
+
+        Returns:
+            float: Timestamp the record was indexed under
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        blob = self._compress(payload)
+
+        with self._lock:
+            if self._timestamps and timestamp < self._timestamps[-1]:
+                raise ValueError(f"Timestamp {timestamp} is older than the last archived record")
+
+            segment = self._current_segment()
+            with open(os.path.join(self.directory, segment), "ab") as f:
+                offset = f.tell()
+                f.write(blob)
+
+            # The index is written last: a crash in between only leaves unindexed bytes
+            with open(os.path.join(self.directory, INDEX_FILE), "a") as index:
+                index.write(f"{timestamp:.6f}\t{segment}\t{offset}\t{len(blob)}\n")
+
+            self._timestamps.append(timestamp)
+            self._entries.append((segment, offset, len(blob)))
+
+        logger.debug(f"Archived {len(payload)} bytes as {len(blob)} in {segment}@{offset}")
+        return timestamp
+
+    def _read(self, position: int) -> bytes:
+        segment, offset, length = self._entries[position]
+        with open(os.path.join(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            return self._decompress(segment, f.read(length))
+
+    def records(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Tuple[float, bytes]]:
+        """
+        Iterate over archived responses in time order.
+
+        Args:
+            start (Optional[float]): First Unix time included
+            end (Optional[float]): Unix time up to which records are included
+
+        Yields:
+            Tuple[float, bytes]: Timestamp and raw response
+        """
+        first = 0 if start is None else bisect.bisect_left(self._timestamps, start)
+        last = len(self._timestamps) if end is None else bisect.bisect_right(self._timestamps, end)
+
+        # Records are read sequentially, so only the current segment is kept open
+        current, f = None, None
+        try:
+            for position in range(first, last):
+                segment, offset, length = self._entries[position]
+                if segment != current:
+                    if f is not None:
+                        f.close()
+                    current, f = segment, open(os.path.join(self.directory, segment), "rb")
+                f.seek(offset)
+                yield self._timestamps[position], self._decompress(segment, f.read(length))
+        finally:
+            if f is not None:
+                f.close()
+
+    def at(self, timestamp: float) -> Optional[Tuple[float, bytes]]:
+        """Return the last response archived at or before `timestamp`, if any."""
+        position = bisect.bisect_right(self._timestamps, timestamp) - 1
+        if position < 0:
+            return None
+        return self._timestamps[position], self._read(position)
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """Return the timestamps of the first and last archived responses."""
+        if not self._timestamps:
+            return None
+        return self._timestamps[0], self._timestamps[-1]
@@ -0,0 +1,141 @@
+import logging
+import time
+from typing import Dict, List, Any, Union
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog
+
+from main import DatabaseManager
+from market_data import MarketColumns
+from stress_test import load_market_history
+
+logger = logging.getLogger(__name__)
+
+OBJECTIVES = ("cvar", "worst_case")
+
+def historical_scenarios(db: DatabaseManager,
+                         market_data: Union[MarketColumns, List[Dict[str, Any]]],
+                         days: int = 30,
+                         max_scenarios: int = 1000) -> np.ndarray:
+    """
+    Build an S x M matrix of APY scenarios from the `markets` history.
+
+    Each stored snapshot is one scenario (evenly subsampled down to
+    `max_scenarios`). Markets without history get their current APY in every
+    scenario.
+
+    Args:
+        db (DatabaseManager): Database with the `markets` table
+        market_data (Union[MarketColumns, List[Dict[str, Any]]]): Parsed markets, in column order
+        days (int): Days of history
+        max_scenarios (int): Maximum number of scenarios
+
+    Returns:
+        np.ndarray: Scenario APYs, one column per market of `market_data`
+    """
+    columns = MarketColumns.from_markets(market_data)
+    keys = columns.keys
+    current = columns.supply_apy
+
+    _, history = load_market_history(db, keys, days)
+    scenarios = history["supply_apy"]
+    if not len(scenarios):
+        return current[None, :]
+
+    with db.get_connection() as conn:
+        seen = {key for key, in conn.execute(f"""
+            SELECT DISTINCT unique_key FROM markets
+            WHERE unique_key IN ({",".join("?" * len(keys))})
+            AND timestamp >= datetime('now', ?)
+        """, (*keys, f'-{days} days'))}
+    missing = np.array([key not in seen for key in keys])
+    scenarios[:, missing] = current[missing]
+
+    if len(scenarios) > max_scenarios:
+        scenarios = scenarios[np.linspace(0, len(scenarios) - 1, max_scenarios).astype(int)]
+    return scenarios
+
+def solve_robust_allocation(market_data: Union[MarketColumns, List[Dict[str, Any]]],
+                            scenarios: np.ndarray,
+                            available_funds: float,
+                            max_risk: float = 0.2,
+                            max_utilization: float = 0.85,
+                            objective: str = "cvar",
+                            alpha: float = 0.05,
+                            risk_aversion: float = 1.0) -> Dict[str, float]:
+    """
+    Optimize fund allocation against a set of APY scenarios with one sparse LP.
+
+    "cvar" maximizes `(1 - risk_aversion) * mean yield + risk_aversion * CVaR`,
+    where CVaR is the mean yield of the worst `alpha` fraction of scenarios
+    (Rockafellar-Uryasev form with one auxiliary variable per scenario).
+    "worst_case" maximizes the yield of the worst scenario. The capacity,
+    risk and utilization constraints are those of `solve_allocation`.
+
+    The constraint matrix is assembled from the scenario matrix with sparse
+    block operations, without building one expression per scenario.
+
+    Args:
+        market_data (Union[MarketColumns, List[Dict[str, Any]]]): Parsed markets (see `_parse_market_data`)
+        scenarios (np.ndarray): S x M scenario APYs, columns in `market_data` order
+        available_funds (float): Funds to allocate in USD
+        max_risk (float): Maximum weighted risk
+        max_utilization (float): Maximum weighted utilization
+        objective (str): "cvar" or "worst_case"
+        alpha (float): Tail fraction of the CVaR
+        risk_aversion (float): Weight of the CVaR against the mean yield
+
+    Returns:
+        Dict[str, float]: Allocation in USD by market
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective!r}, expected one of {list(OBJECTIVES)}")
+    scenarios = np.asarray(scenarios, dtype=float)
+    count, markets = scenarios.shape
+    if markets != len(market_data):
+        raise ValueError(f"Scenario matrix has {markets} columns for {len(market_data)} markets")
+
+    started = time.perf_counter()
+    columns = MarketColumns.from_markets(market_data)
+    max_supply, risk, utilization = columns.max_supply, columns.risk, columns.utilization
+
+    # Variables: allocations x (M), threshold eta (1), then for "cvar" shortfalls u (S)
+    returns = sparse.csr_matrix(scenarios)
+    if objective == "cvar":
+        # u_s >= eta - R_s x  <=>  -R_s x + eta - u_s <= 0
+        scenario_rows = sparse.hstack([-returns, np.ones((count, 1)), -sparse.identity(count)])
+        cost = np.concatenate([
+            -(1 - risk_aversion) * scenarios.mean(axis=0),
+            [-risk_aversion],
+            np.full(count, risk_aversion / (alpha * count)),
+        ])
+        auxiliary = count + 1
+        bounds = ([(0, cap) for cap in max_supply] + [(None, None)] + [(0, None)] * count)
+    else:
+        # eta <= R_s x
+        scenario_rows = sparse.hstack([-returns, np.ones((count, 1))])
+        cost = np.concatenate([np.zeros(markets), [-1.0]])
+        auxiliary = 1
+        bounds = [(0, cap) for cap in max_supply] + [(None, None)]
+
+    portfolio_rows = sparse.hstack([
+        sparse.csr_matrix(np.vstack([np.ones(markets), risk, utilization])),
+        sparse.csr_matrix((3, auxiliary)),
+    ])
+    a_ub = sparse.vstack([scenario_rows, portfolio_rows], format="csr")
+    b_ub = np.concatenate([
+        np.zeros(count),
+        [available_funds, max_risk * available_funds, max_utilization * available_funds],
+    ])
+    built = time.perf_counter()
+
+    result = linprog(cost, A_ub=a_ub, b_ub=b_ub, bounds=bounds, method="highs")
+    if not result.success:
+        raise RuntimeError(f"Robust allocation failed: {result.message}")
+
+    logger.info(f"Robust ({objective}) LP with {markets} markets x {count} scenarios: "
+                f"built in {built - started:.2f}s, solved in {time.perf_counter() - built:.2f}s")
+
+    allocation = result.x[:markets]
+    return dict(zip(columns.keys, allocation.tolist()))
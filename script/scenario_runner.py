@@ -0,0 +1,302 @@
+import logging
+import queue
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from web3 import Web3
+
+from main import DatabaseManager
+from vault_model import market_id
+from Scripter import (
+    ANVIL_PRIVATE_KEY,
+    MarketAllocation,
+    MORPHO_ADDRESS,
+    MORPHO_ABI,
+    NEW_METAMORPH_VAULT_ADDRESS,
+    TEST_ACCOUNT,
+    simulate_and_send_reallocate,
+)
+
+logger = logging.getLogger(__name__)
+
+VAULT_TOTALS_ABI = [{
+    "inputs": [],
+    "name": "totalAssets",
+    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+    "stateMutability": "view",
+    "type": "function"
+}, {
+    "inputs": [],
+    "name": "totalSupply",
+    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+    "stateMutability": "view",
+    "type": "function"
+}]
+
+class AnvilPool:
+    def __init__(self,
+                 source_url: str = "http://127.0.0.1:8545",
+                 size: int = 4,
+                 base_port: int = 8546,
+                 urls: Optional[List[str]] = None,
+                 fork_url: Optional[str] = None):
+        """
+        Pool of local anvil instances holding the same chain state.
+
+        Spawned instances fork the upstream the source node was forked from, at
+        the same block, and load the source node's state with
+        `anvil_dumpState`/`anvil_loadState`, so the vault deployed on the source
+        node exists on every instance. The upstream is read from the source's
+        `anvil_nodeInfo` unless `fork_url` is given; a forked source whose
+        upstream cannot be determined is an error, as instances holding only the
+        dumped state would miss the fork state the scenarios read.
+
+        Args:
+            source_url (str): Node whose state is replicated
+            size (int): Number of anvil instances to spawn
+            base_port (int): First port of the spawned instances
+            urls (Optional[List[str]]): Existing instances to use instead of spawning
+            fork_url (Optional[str]): Upstream RPC the source node was forked from,
+                detected from the source node by default
+        """
+        self.source_url = source_url
+        self.size = size
+        self.base_port = base_port
+        self.urls = list(urls or [])
+        self.fork_url = fork_url
+        self.clients: List[Web3] = []
+        self._processes: List[subprocess.Popen] = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _spawn(self, port: int, fork_block: int) -> str:
+        if shutil.which("anvil") is None:
+            raise RuntimeError("anvil not found; install Foundry or pass existing instance urls")
+
+        command = ["anvil", "--port", str(port), "--silent"]
+        if self.fork_url:
+            command += ["--fork-url", self.fork_url, "--fork-block-number", str(fork_block)]
+        self._processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        return f"http://127.0.0.1:{port}"
+
+    @staticmethod
+    def _wait_ready(client: Web3, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while not client.is_connected():
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"anvil at {client.provider.endpoint_uri} did not start")
+            time.sleep(0.2)
+
+    def _resolve_fork(self, source: Web3) -> int:
+        """Set `fork_url` from the source node if needed and return the block to fork at."""
+        response = source.provider.make_request("anvil_nodeInfo", [])
+        fork_config = (response.get("result") or {}).get("forkConfig") or {}
+        if self.fork_url is None:
+            self.fork_url = fork_config.get("forkUrl")
+            if self.fork_url is None and "error" in response:
+                raise RuntimeError(f"Cannot tell whether {self.source_url} is a fork "
+                                   f"({response['error']}); pass fork_url")
+        # Blocks mined locally after the fork do not exist upstream
+        return fork_config.get("forkBlockNumber") or source.eth.block_number
+
+    def start(self):
+        """Spawn or attach to the instances and replicate the source state."""
+        if self.urls:
+            self.clients = [Web3(Web3.HTTPProvider(url)) for url in self.urls]
+            return
+
+        source = Web3(Web3.HTTPProvider(self.source_url))
+        fork_block = self._resolve_fork(source)
+        state = source.provider.make_request("anvil_dumpState", [])["result"]
+
+        for i in range(self.size):
+            url = self._spawn(self.base_port + i, fork_block)
+            client = Web3(Web3.HTTPProvider(url, request_kwargs={"timeout": 120}))
+            self._wait_ready(client)
+            client.provider.make_request("anvil_loadState", [state])
+            self.urls.append(url)
+            self.clients.append(client)
+
+        logger.info(f"Started {len(self.clients)} anvil instances from {self.source_url} at block {fork_block}"
+                    f"{f' of {self.fork_url}' if self.fork_url else ''}")
+
+    def stop(self):
+        """Terminate the spawned instances."""
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.wait()
+        self._processes = []
+
+def run_scenario(client: Web3,
+                 allocations: List[MarketAllocation],
+                 vault_address: str = NEW_METAMORPH_VAULT_ADDRESS,
+                 morpho_address: str = MORPHO_ADDRESS,
+                 sender: str = TEST_ACCOUNT,
+                 private_key: str = ANVIL_PRIVATE_KEY) -> Dict[str, Any]:
+    """
+    Execute one candidate on `client` and revert the chain afterwards.
+
+    Args:
+        client (Web3): Anvil instance
+        allocations (List[MarketAllocation]): Candidate reallocation
+        vault_address (str): MetaMorpho vault
+        morpho_address (str): Morpho Blue
+        sender (str): Allocator of the vault sending the reallocation
+        private_key (str): Key of `sender`, anvil's first dev account by default
+
+    Returns:
+        Dict[str, Any]: Status, gas, post-trade utilization and share price
+    """
+    morpho = client.eth.contract(address=morpho_address, abi=MORPHO_ABI)
+    vault = client.eth.contract(address=vault_address, abi=VAULT_TOTALS_ABI)
+
+    snapshot = client.provider.make_request("evm_snapshot", [])["result"]
+    started = time.perf_counter()
+    try:
+        receipt = simulate_and_send_reallocate(allocations, client=client, vault_address=vault_address,
+                                               sender=sender, private_key=private_key)
+        result = {
+            "success": bool(receipt and receipt["status"] == 1),
+            "gas_used": receipt["gasUsed"] if receipt else None,
+            "utilization": {},
+            "share_price": None,
+        }
+        if result["success"]:
+            for allocation in allocations:
+                mid = market_id(allocation.market_params)
+                total_supply_assets, _, total_borrow_assets, *_ = morpho.functions.market(mid).call()
+                result["utilization"][mid] = (
+                    total_borrow_assets / total_supply_assets if total_supply_assets else 0.0
+                )
+            total_assets = vault.functions.totalAssets().call()
+            total_supply = vault.functions.totalSupply().call()
+            result["share_price"] = total_assets / total_supply if total_supply else None
+    finally:
+        client.provider.make_request("evm_revert", [snapshot])
+
+    result["wall_time"] = time.perf_counter() - started
+    return result
+
+class ScenarioRunner:
+    def __init__(self,
+                 pool: AnvilPool,
+                 db: Optional[DatabaseManager] = None,
+                 vault_address: str = NEW_METAMORPH_VAULT_ADDRESS,
+                 morpho_address: str = MORPHO_ADDRESS,
+                 sender: str = TEST_ACCOUNT,
+                 private_key: str = ANVIL_PRIVATE_KEY):
+        """
+        Evaluate many candidate reallocations against the same chain state.
+
+        Each anvil instance of the pool is driven by one worker thread; every
+        scenario runs between `evm_snapshot` and `evm_revert`.
+
+        Args:
+            pool (AnvilPool): Started pool of anvil instances
+            db (Optional[DatabaseManager]): Database to store results in
+            vault_address (str): MetaMorpho vault the candidates reallocate
+            morpho_address (str): Morpho Blue the vault supplies to
+            sender (str): Allocator of the vault sending the reallocations
+            private_key (str): Key of `sender`, anvil's first dev account by default
+        """
+        self.pool = pool
+        self.db = db
+        self.vault_address = vault_address
+        self.morpho_address = morpho_address
+        self.sender = sender
+        self.private_key = private_key
+        if self.db:
+            self.init_table()
+
+    def init_table(self):
+        """Initialize the scenario results table if it doesn't exist."""
+        with self.db.get_connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scenario_results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    batch_id TEXT NOT NULL,
+                    scenario INTEGER NOT NULL,
+                    success INTEGER NOT NULL,
+                    gas_used INTEGER,
+                    max_utilization REAL,
+                    share_price REAL,
+                    wall_time REAL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
+
+    def _worker(self, client: Web3, tasks: "queue.Queue", results: List[Optional[Dict[str, Any]]]):
+        while True:
+            try:
+                index, allocations = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = run_scenario(client, allocations, self.vault_address, self.morpho_address,
+                                              self.sender, self.private_key)
+            except Exception as e:
+                logger.error(f"Scenario {index} failed: {str(e)}")
+                results[index] = {"success": False, "gas_used": None, "utilization": {},
+                                  "share_price": None, "wall_time": None, "error": str(e)}
+
+    def run(self, candidates: List[List[MarketAllocation]], batch_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Run every candidate once, spread across the pool.
+
+        Args:
+            candidates (List[List[MarketAllocation]]): Candidate reallocations
+            batch_id (Optional[str]): Identifier of the batch in the results table
+
+        Returns:
+            List[Dict[str, Any]]: One result row per candidate, in candidate order
+        """
+        tasks: "queue.Queue" = queue.Queue()
+        for index, allocations in enumerate(candidates):
+            tasks.put((index, allocations))
+        results: List[Optional[Dict[str, Any]]] = [None] * len(candidates)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.pool.clients)) as executor:
+            for client in self.pool.clients:
+                executor.submit(self._worker, client, tasks, results)
+
+        rows = [dict(result, scenario=index) for index, result in enumerate(results)]
+        logger.info(f"Ran {len(rows)} scenarios on {len(self.pool.clients)} instances "
+                    f"in {time.perf_counter() - started:.2f}s "
+                    f"({sum(row['success'] for row in rows)} succeeded)")
+
+        if self.db:
+            self.store_results(batch_id or time.strftime("%Y%m%dT%H%M%S"), rows)
+        return rows
+
+    def store_results(self, batch_id: str, rows: List[Dict[str, Any]]):
+        """Store a batch of scenario results in the database."""
+        with self.db.get_connection() as conn:
+            conn.executemany("""
+                INSERT INTO scenario_results (
+                    batch_id, scenario, success, gas_used,
+                    max_utilization, share_price, wall_time
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (
+                    batch_id,
+                    row["scenario"],
+                    int(row["success"]),
+                    row["gas_used"],
+                    max(row["utilization"].values(), default=None),
+                    row["share_price"],
+                    row["wall_time"],
+                )
+                for row in rows
+            ])
+            conn.commit()
@@ -0,0 +1,388 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from main import DatabaseManager, MorphoMarketOptimizer, solve_allocation
+from market_data import MarketColumns
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+def _float_param(params: Dict[str, str], name: str, default: Optional[float] = None) -> float:
+    if name not in params:
+        if default is None:
+            raise HTTPError(400, f"Missing parameter {name!r}")
+        return default
+    try:
+        return float(params[name])
+    except ValueError:
+        raise HTTPError(400, f"Parameter {name!r} must be a number") from None
+
+def _solve(markets: MarketColumns, params: Dict[str, float]) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Process pool entry point: one silent CBC solve, with its LP build/solve seconds."""
+    from pulp import PULP_CBC_CMD
+
+    timings: Dict[str, float] = {}
+    allocation = solve_allocation(markets, solver=PULP_CBC_CMD(msg=False), timings=timings, **params)
+    return allocation, timings
+
+class AllocationService:
+    def __init__(self,
+                 optimizer: Optional[MorphoMarketOptimizer] = None,
+                 refresh_interval: float = 60.0,
+                 workers: int = 4):
+        """
+        Asyncio HTTP service answering allocation queries.
+
+        Responses are computed from the in-memory market snapshot, refreshed
+        in the background every `refresh_interval` seconds. LP solves run in a
+        process pool. Results (solves and trend statistics) are cached per
+        snapshot, and identical requests arriving while one is being computed
+        wait for that computation instead of starting their own.
+
+        Endpoints (GET, JSON):
+            /snapshot                  latest markets
+            /optimize?available_funds=&max_risk=&max_utilization=
+            /trends?market=&days=
+            /frontier?available_funds=&max_utilization=&points=
+            /health
+
+        Args:
+            optimizer (Optional[MorphoMarketOptimizer]): Source of snapshots
+            refresh_interval (float): Seconds between snapshot refreshes
+            workers (int): Solver processes
+        """
+        self.optimizer = optimizer or MorphoMarketOptimizer(db=DatabaseManager(persistent=True))
+        self.refresh_interval = refresh_interval
+        self.workers = workers
+
+        self.markets = MarketColumns.from_markets([])
+        self.snapshot_time: Optional[float] = None
+        self.version = 0
+        self._results: Dict[Tuple, Any] = {}
+        self._inflight: Dict[Tuple, "asyncio.Future"] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._server: Optional[asyncio.Server] = None
+        self._refresher: Optional[asyncio.Task] = None
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+        self.routes: Dict[str, Callable[[Dict[str, str]], Awaitable[Any]]] = {
+            "/snapshot": self.handle_snapshot,
+            "/optimize": self.handle_optimize,
+            "/trends": self.handle_trends,
+            "/frontier": self.handle_frontier,
+            "/health": self.handle_health,
+            "/metrics": self.handle_metrics,
+        }
+
+    # ------------------------------------------------------------------
+    # Snapshot and caches
+    # ------------------------------------------------------------------
+    async def refresh(self):
+        """Fetch a new snapshot (in a thread) and invalidate the result cache."""
+        markets = await asyncio.to_thread(self.optimizer.fetch_market_data)
+        self.markets = markets
+        self.snapshot_time = time.time()
+        self.version += 1
+        self._results.clear()
+        logger.info(f"Snapshot {self.version}: {len(markets)} markets")
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Snapshot refresh failed, serving the previous one: {str(e)}")
+
+    async def _coalesced(self, key: Tuple, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached result of `key`, or share one computation among concurrent callers."""
+        key = (self.version, *key)
+        while True:
+            if key in self._results:
+                return self._results[key]
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # The computing request was cancelled, not this one: compute it here
+                if not inflight.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved by any waiter; avoids "exception never retrieved" otherwise
+            future.exception()
+            raise
+        else:
+            if key[0] == self.version:
+                self._results[key] = result
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+            # Cancelled (a BaseException): waiters must not wait forever
+            if not future.done():
+                future.cancel()
+
+    async def _solve(self, params: Dict[str, float]) -> Dict[str, float]:
+        if not self.markets:
+            raise HTTPError(503, "No market snapshot yet")
+        loop = asyncio.get_running_loop()
+        allocation, timings = await loop.run_in_executor(self._pool, _solve, self.markets, params)
+        # Recorded here: the worker's registry is a copy that /metrics never sees
+        REGISTRY.observe_stages(timings)
+        return allocation
+
+    # ------------------------------------------------------------------
+    # Handlers
+    # ------------------------------------------------------------------
+    async def handle_health(self, params: Dict[str, str]) -> Dict[str, Any]:
+        return {"status": "ok", "snapshot_version": self.version, "snapshot_time": self.snapshot_time}
+
+    async def handle_snapshot(self, params: Dict[str, str]) -> Dict[str, Any]:
+        fields = ("market", "token", "supply_apy", "borrow_apy", "utilization", "lltv", "max_supply", "risk")
+        return {
+            "snapshot_time": self.snapshot_time,
+            "markets": [{name: market[name] for name in fields} for market in self.markets],
+        }
+
+    async def handle_optimize(self, params: Dict[str, str]) -> Dict[str, Any]:
+        solve_params = {
+            "available_funds": _float_param(params, "available_funds", 1_000_000),
+            "max_risk": _float_param(params, "max_risk", 0.2),
+            "max_utilization": _float_param(params, "max_utilization", 0.85),
+        }
+        key = ("optimize", *sorted(solve_params.items()))
+        allocation = await self._coalesced(key, lambda: self._solve(solve_params))
+        return {
+            "snapshot_time": self.snapshot_time,
+            "allocations": {market: amount for market, amount in allocation.items() if amount},
+        }
+
+    async def handle_trends(self, params: Dict[str, str]) -> Dict[str, Any]:
+        if "market" not in params:
+            raise HTTPError(400, "Missing parameter 'market'")
+        key = (params["market"], int(_float_param(params, "days", 30)))
+        return await self._coalesced(
+            ("trends", *key), lambda: asyncio.to_thread(self.optimizer.analyze_market_trends, *key)
+        )
+
+    async def handle_frontier(self, params: Dict[str, str]) -> Dict[str, Any]:
+        available_funds = _float_param(params, "available_funds", 1_000_000)
+        max_utilization = _float_param(params, "max_utilization", 0.85)
+        points = int(_float_param(params, "points", 10))
+        if not 1 <= points <= 100:
+            raise HTTPError(400, "Parameter 'points' must be between 1 and 100")
+
+        apys = dict(zip(self.markets.keys, self.markets.supply_apy.tolist()))
+        risks = np.linspace(0, float(self.markets.risk.max()) if len(self.markets) else 0.0, points)
+
+        async def point(max_risk: float) -> Dict[str, float]:
+            solve_params = {"available_funds": available_funds, "max_risk": float(max_risk),
+                            "max_utilization": max_utilization}
+            key = ("optimize", *sorted(solve_params.items()))
+            allocation = await self._coalesced(key, lambda: self._solve(solve_params))
+            expected = sum(amount * apys[market] for market, amount in allocation.items() if amount)
+            return {"max_risk": float(max_risk), "expected_yield": expected,
+                    "expected_apy": expected / available_funds if available_funds else 0.0}
+
+        # The frontier's points are solved concurrently across the pool
+        return {"snapshot_time": self.snapshot_time, "frontier": await asyncio.gather(*map(point, risks))}
+
+    async def handle_metrics(self, params: Dict[str, str]) -> str:
+        # Solver processes keep their own registries; this covers fetch, parse and store
+        return REGISTRY.render()
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0)):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                status, body = await self._dispatch(request_line)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if isinstance(body, str):
+                    payload, content_type = body.encode(), "text/plain; version=0.0.4"
+                else:
+                    payload, content_type = json.dumps(body).encode(), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _dispatch(self, request_line: str) -> Tuple[int, Any]:
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            return 400, {"error": "Malformed request line"}
+        if method != "GET":
+            return 405, {"error": f"Method {method} not allowed"}
+
+        url = urlsplit(target)
+        handler = self.routes.get(url.path)
+        if handler is None:
+            return 404, {"error": f"Unknown endpoint {url.path}"}
+        try:
+            return 200, await handler(dict(parse_qsl(url.query)))
+        except HTTPError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:
+            logger.error(f"Error handling {target}: {str(e)}")
+            return 500, {"error": str(e)}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080):
+        """Load the first snapshot, start the solver pool and listen."""
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        await self.refresh()
+        self._refresher = asyncio.create_task(self._refresh_loop())
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Allocation service listening on {host}:{self._server.sockets[0].getsockname()[1]}")
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+        if self._server is not None:
+            self._server.close()
+            # Close idle keep-alive connections and let their handlers return
+            connections = list(self._connections.items())
+            for writer, _ in connections:
+                writer.close()
+            await asyncio.gather(*(task for _, task in connections), return_exceptions=True)
+            await self._server.wait_closed()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8080):
+        await self.start(host, port)
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+async def load_test(host: str = "127.0.0.1",
+                    port: int = 8080,
+                    paths: Optional[List[str]] = None,
+                    rate: float = 300.0,
+                    duration: float = 10.0,
+                    connections: int = 64) -> Dict[str, Any]:
+    """
+    Open-loop load test: issue `rate` requests per second for `duration` seconds.
+
+    Requests are spread over a pool of keep-alive connections and scheduled
+    at fixed times, so slow responses do not lower the offered load; latency
+    is measured from each request's scheduled time.
+
+    Args:
+        host (str): Service host
+        port (int): Service port
+        paths (Optional[List[str]]): Request targets, cycled through
+        rate (float): Requests per second
+        duration (float): Seconds of load
+        connections (int): Keep-alive connections
+
+    Returns:
+        Dict[str, Any]: Request count, errors, achieved rate and latency percentiles (ms)
+    """
+    paths = paths or ["/optimize?available_funds=1000000&max_risk=0.2&max_utilization=0.85"]
+    total = int(rate * duration)
+    idle: "asyncio.Queue" = asyncio.Queue()
+    for _ in range(connections):
+        idle.put_nowait(await asyncio.open_connection(host, port))
+
+    latencies: List[float] = []
+    errors = 0
+
+    async def request(path: str, scheduled: float):
+        nonlocal errors
+        reader, writer = await idle.get()
+        try:
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(next(line.split(b":")[1] for line in head.split(b"\r\n")
+                              if line.lower().startswith(b"content-length")))
+            await reader.readexactly(length)
+            if not head.startswith(b"HTTP/1.1 200"):
+                errors += 1
+            latencies.append(time.perf_counter() - scheduled)
+        except Exception:
+            errors += 1
+        finally:
+            idle.put_nowait((reader, writer))
+
+    started = time.perf_counter()
+    tasks = []
+    for i in range(total):
+        scheduled = started + i / rate
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        tasks.append(asyncio.create_task(request(paths[i % len(paths)], scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    while not idle.empty():
+        _, writer = idle.get_nowait()
+        writer.close()
+
+    latency_ms = np.array(latencies) * 1000
+    return {
+        "requests": total,
+        "errors": errors,
+        "rate": total / elapsed,
+        "p50_ms": float(np.percentile(latency_ms, 50)) if len(latency_ms) else None,
+        "p99_ms": float(np.percentile(latency_ms, 99)) if len(latency_ms) else None,
+        "max_ms": float(latency_ms.max()) if len(latency_ms) else None,
+    }
+
+def main():
+    service = AllocationService()
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple, Any
+
+import numpy as np
+
+from main import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+HISTORY_FIELDS = ("supply_apy", "utilization", "max_supply")
+
+def load_market_history(db: DatabaseManager,
+                        market_keys: List[str],
+                        days: int = 30) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Load the history of several markets as aligned T x M matrices.
+
+    Rows are aligned on snapshot timestamps; a market missing from a snapshot
+    keeps its previous value (or its first known value before it appears).
+
+    Args:
+        db (DatabaseManager): Database with the `markets` table
+        market_keys (List[str]): Markets, in column order
+        days (int): Number of days of history
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, np.ndarray]]: Unix timestamps (T) and one
+            T x M matrix per field of `HISTORY_FIELDS`
+    """
+    columns = {key: i for i, key in enumerate(market_keys)}
+    placeholders = ",".join("?" * len(market_keys))
+
+    with db.get_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT CAST(strftime('%s', timestamp) AS INTEGER), unique_key, {", ".join(HISTORY_FIELDS)}
+            FROM markets
+            WHERE unique_key IN ({placeholders})
+            AND timestamp >= datetime('now', ?)
+            ORDER BY timestamp
+        """, (*market_keys, f'-{days} days')).fetchall()
+
+    if not rows:
+        return np.empty(0), {name: np.empty((0, len(market_keys))) for name in HISTORY_FIELDS}
+
+    stamps = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    column_index = np.fromiter((columns[row[1]] for row in rows), dtype=np.int64, count=len(rows))
+    values = np.array([row[2:] for row in rows], dtype=float)
+    return align_history(stamps, column_index, values, len(market_keys))
+
+def load_columnar_history(directory: str,
+                          market_keys: List[str],
+                          days: int = 30) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Same as `load_market_history`, from the memory-mapped columnar export (see `columnar_store.py`)."""
+    from columnar_store import HistoryReader
+
+    return HistoryReader(directory).market_history(market_keys, days)
+
+HISTORY_SOURCES = ("db", "columnar")
+
+def align_history(stamps: np.ndarray,
+                  column_index: np.ndarray,
+                  values: np.ndarray,
+                  markets: int) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Pivot history rows into aligned T x M matrices (see `load_market_history`).
+
+    Args:
+        stamps (np.ndarray): Unix time of each row
+        column_index (np.ndarray): Market column of each row
+        values (np.ndarray): Rows x `HISTORY_FIELDS` values
+        markets (int): Number of market columns
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, np.ndarray]]: Unix timestamps (T) and one
+            T x M matrix per field of `HISTORY_FIELDS`
+    """
+    timestamps, row_index = np.unique(stamps, return_inverse=True)
+
+    history = {}
+    for f, name in enumerate(HISTORY_FIELDS):
+        matrix = np.full((len(timestamps), markets), np.nan)
+        matrix[row_index, column_index] = values[:, f]
+
+        # Forward-fill gaps, then back-fill the leading ones
+        valid = ~np.isnan(matrix)
+        last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(timestamps))[:, None], 0), axis=0)
+        matrix = np.take_along_axis(matrix, last_valid, axis=0)
+        first = np.where(valid.any(axis=0), valid.argmax(axis=0), 0)
+        leading = np.isnan(matrix)
+        matrix[leading] = np.broadcast_to(matrix[first, np.arange(markets)], matrix.shape)[leading]
+        history[name] = np.nan_to_num(matrix)
+
+    return timestamps.astype(float), history
+
+def _bootstrap_paths(rng: np.random.Generator, portfolio_apy: np.ndarray, block_max_utilization: np.ndarray,
+                     scenarios: int, blocks: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Moving-block bootstrap of joint APY/utilization paths.
+
+    Blocks of consecutive snapshots keep the autocorrelation and the
+    cross-market dependence of the history. Only the path statistics are
+    materialized: the mean portfolio APY (from the precomputed per-block
+    means) and each market's worst utilization (from per-block maxima).
+    """
+    starts = rng.integers(0, len(portfolio_apy), size=(scenarios, blocks))
+    return portfolio_apy[starts].mean(axis=1), block_max_utilization[starts].max(axis=1)
+
+def _gaussian_paths(rng: np.random.Generator, amounts: np.ndarray, apy: np.ndarray, utilization: np.ndarray,
+                    scenarios: int, horizon: int, rank: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Joint Gaussian paths with the historical mean and (low-rank) covariance.
+
+    Returns the mean portfolio APY and each market's worst utilization of
+    every path; utilizations are clipped to [0, 1].
+    """
+    markets = apy.shape[1]
+    levels = np.hstack([apy, utilization])
+    mean = levels.mean(axis=0)
+
+    # Principal components of the covariance, from the SVD of the deviations
+    _, singular, components = np.linalg.svd(levels - mean, full_matrices=False)
+    rank = min(rank, len(singular))
+    loadings = (singular[:rank, None] / np.sqrt(max(len(levels) - 1, 1))) * components[:rank]
+
+    factors = rng.standard_normal((scenarios, horizon, rank))
+    # The portfolio APY is linear in the factors, so only its path mean is needed
+    portfolio_apy = mean[:markets] @ amounts + factors.mean(axis=1) @ (loadings[:, :markets] @ amounts)
+    utilization_paths = mean[markets:] + factors @ loadings[:, markets:]
+    return portfolio_apy, np.clip(utilization_paths.max(axis=1), 0.0, 1.0)
+
+def stress_test(allocation: Dict[str, float],
+                db: Optional[DatabaseManager] = None,
+                scenarios: int = 10_000,
+                horizon: int = 288,
+                days: int = 30,
+                method: str = "bootstrap",
+                alpha: float = 0.05,
+                block: int = 12,
+                rank: int = 32,
+                memory_budget: int = 256 * 1024**2,
+                seed: Optional[int] = None,
+                source: str = "db",
+                location: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Monte Carlo stress test of an allocation against its markets' history.
+
+    Joint APY/utilization paths over `horizon` snapshots are sampled either by
+    block bootstrap of the stored history or from a Gaussian fitted to it.
+    For every path the portfolio yield and the liquidity shortfall (the part
+    of each position that could not be withdrawn at the path's worst
+    utilization) are computed as matrix products. Scenarios are processed in
+    chunks sized to `memory_budget`. The history is read from the database or
+    from the memory-mapped columnar export, with the same result.
+
+    Args:
+        allocation (Dict[str, float]): Allocation in USD by market
+        db (Optional[DatabaseManager]): Database with the market history
+        scenarios (int): Number of sampled paths
+        horizon (int): Path length in snapshots
+        days (int): Days of history to sample from
+        method (str): "bootstrap" or "gaussian"
+        alpha (float): Tail probability of VaR/CVaR
+        block (int): Bootstrap block length in snapshots; paths are whole blocks
+        rank (int): Number of principal components of the Gaussian covariance
+        memory_budget (int): Approximate bytes of sampled paths held at once
+        seed (Optional[int]): Random seed
+        source (str): "db" for the `markets` table or "columnar" for the
+            exported columnar history
+        location (Optional[str]): Columnar history directory, `history` by default
+
+    Returns:
+        Dict[str, Any]: Yield and liquidity shortfall statistics in USD
+    """
+    if method not in ("bootstrap", "gaussian"):
+        raise ValueError(f"Unknown method {method!r}, expected 'bootstrap' or 'gaussian'")
+    if source not in HISTORY_SOURCES:
+        raise ValueError(f"Unknown source {source!r}, expected one of {list(HISTORY_SOURCES)}")
+
+    keys = [key for key, amount in allocation.items() if amount]
+    if not keys:
+        raise ValueError("Allocation is empty")
+    amounts = np.array([allocation[key] for key in keys], dtype=float)
+
+    if source == "columnar":
+        timestamps, history = load_columnar_history(location or "history", keys, days)
+    else:
+        timestamps, history = load_market_history(db or DatabaseManager(), keys, days)
+    if len(timestamps) < 2:
+        raise ValueError(f"Not enough history for {len(keys)} markets over {days} days")
+
+    step_seconds = float(np.median(np.diff(timestamps)))
+    period = horizon * step_seconds / SECONDS_PER_YEAR
+    supply = history["max_supply"][-1]
+    apy, utilization = history["supply_apy"], history["utilization"]
+
+    if method == "bootstrap":
+        block = max(1, min(block, len(timestamps)))
+        blocks = -(-horizon // block)
+        # Per-block statistics of every block start, so paths are sampled block by block
+        windows = np.lib.stride_tricks.sliding_window_view(apy @ amounts, block)
+        block_apy = windows.mean(axis=1)
+        block_max_utilization = np.lib.stride_tricks.sliding_window_view(utilization, block, axis=0).max(axis=2)
+        scenario_bytes = blocks * len(keys) * 8 * 2
+    else:
+        scenario_bytes = horizon * (len(keys) + rank) * 8 * 2
+    chunk = max(1, memory_budget // scenario_bytes)
+    rng = np.random.default_rng(seed)
+
+    started = time.perf_counter()
+    yields = np.empty(scenarios)
+    shortfalls = np.empty(scenarios)
+    for first in range(0, scenarios, chunk):
+        size = min(chunk, scenarios - first)
+        if method == "bootstrap":
+            portfolio_apy, max_utilization = _bootstrap_paths(rng, block_apy, block_max_utilization, size, blocks)
+        else:
+            portfolio_apy, max_utilization = _gaussian_paths(rng, amounts, apy, utilization, size, horizon, rank)
+
+        yields[first:first + size] = portfolio_apy * period
+        liquidity = (1.0 - max_utilization) * supply
+        shortfalls[first:first + size] = np.maximum(amounts - liquidity, 0.0).sum(axis=1)
+
+    expected = float(yields.mean())
+    tail = yields <= np.quantile(yields, alpha)
+    report = {
+        "markets": len(keys),
+        "scenarios": scenarios,
+        "horizon_days": horizon * step_seconds / 86400,
+        "method": method,
+        "history_points": len(timestamps),
+        "expected_yield": expected,
+        "yield_std": float(yields.std()),
+        "yield_percentiles": {f"p{p}": float(np.percentile(yields, p)) for p in (1, 5, 50, 95, 99)},
+        # Losses relative to the expected yield
+        "var": expected - float(np.quantile(yields, alpha)),
+        "cvar": expected - float(yields[tail].mean()),
+        "alpha": alpha,
+        "shortfall_probability": float(np.mean(shortfalls > 0)),
+        "expected_shortfall": float(shortfalls.mean()),
+        "shortfall_p99": float(np.percentile(shortfalls, 99)),
+        "elapsed": time.perf_counter() - started,
+    }
+    logger.info(f"Stress tested {len(keys)} markets over {scenarios} scenarios "
+                f"({chunk} per chunk) in {report['elapsed']:.2f}s")
+    return report
+
+def latest_allocation(db: DatabaseManager) -> Dict[str, float]:
+    """Return the most recently stored allocation."""
+    with db.get_connection() as conn:
+        rows = conn.execute("""
+            SELECT market_key, allocated_amount FROM allocations
+            WHERE timestamp = (SELECT MAX(timestamp) FROM allocations)
+        """).fetchall()
+    return {key: amount for key, amount in rows}
+
+def main():
+    db = DatabaseManager()
+    try:
+        report = stress_test(latest_allocation(db), db)
+        print(json.dumps(report, indent=2))
+    except Exception as e:
+        logger.error(f"Error in stress test: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# (symbol, decimals, price in USD) of the loan and collateral assets
+ASSETS = [
+    ("USDC", 6, 1.0), ("USDT", 6, 1.0), ("DAI", 18, 1.0), ("WETH", 18, 3000.0),
+    ("wstETH", 18, 3500.0), ("WBTC", 8, 60000.0), ("cbBTC", 8, 60000.0), ("sUSDe", 18, 1.1),
+]
+LOAN_WEIGHTS = [0.45, 0.15, 0.05, 0.25, 0.03, 0.04, 0.02, 0.01]
+LLTVS = [0.385, 0.625, 0.77, 0.86, 0.915, 0.945, 0.965]
+FEES = [0.0, 0.05, 0.1, 0.15, 0.25]
+
+def _address(rng: np.random.Generator) -> str:
+    return "0x" + rng.bytes(20).hex()
+
+def generate_markets(n_markets: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate a Morpho API `markets` response with `n_markets` synthetic markets.
+
+    The fields are the ones `MorphoMarketOptimizer.fetch_market_data` queries,
+    with realistic shapes: a few loan assets dominating, the usual LLTVs, a
+    small share of idle markets without collateral, log-normal market sizes
+    and supply APYs consistent with the borrow APY, utilization and fee.
+
+    Args:
+        n_markets (int): Number of markets
+        seed (int): Random seed, the same seed gives the same markets
+
+    Returns:
+        Dict[str, Any]: Decoded GraphQL response
+    """
+    rng = np.random.default_rng(seed)
+    assets = [{"address": _address(rng), "symbol": symbol, "decimals": decimals}
+              for symbol, decimals, _ in ASSETS]
+
+    loan = rng.choice(len(ASSETS), n_markets, p=LOAN_WEIGHTS)
+    collateral = rng.integers(0, len(ASSETS), n_markets)
+    idle = rng.random(n_markets) < 0.02
+    lltv = rng.choice(LLTVS, n_markets)
+    fee = rng.choice(FEES, n_markets)
+    utilization = np.where(idle, 0.0, rng.beta(5, 2, n_markets))
+    # Adaptive-curve IRM: the borrow rate steepens past 90% utilization
+    borrow_apy = np.where(idle, 0.0, 0.04 * np.exp(rng.normal(0, 0.4, n_markets))
+                          * np.where(utilization > 0.9, 1 + 30 * (utilization - 0.9), 1.0))
+    supply_apy = borrow_apy * utilization * (1 - fee)
+    supply_usd = np.exp(rng.normal(np.log(2e6), 2.0, n_markets))
+    keys = rng.bytes(32 * n_markets).hex()
+
+    items = []
+    for i in range(n_markets):
+        symbol, decimals, price = ASSETS[loan[i]]
+        supply_assets = int(supply_usd[i] / price * 10 ** decimals)
+        borrow_assets = int(supply_assets * utilization[i])
+        items.append({
+            "uniqueKey": "0x" + keys[64 * i:64 * (i + 1)],
+            "lltv": "0" if idle[i] else str(int(lltv[i] * 10 ** 18)),
+            "oracleAddress": "0x" + "0" * 40 if idle[i] else _address(rng),
+            "irmAddress": "0x" + "0" * 40 if idle[i] else _address(rng),
+            "loanAsset": assets[loan[i]],
+            "collateralAsset": None if idle[i] else assets[collateral[i]],
+            "state": {
+                "borrowApy": float(borrow_apy[i]),
+                "borrowAssets": str(borrow_assets),
+                "borrowAssetsUsd": borrow_assets / 10 ** decimals * price,
+                "supplyApy": float(supply_apy[i]),
+                "supplyAssets": str(supply_assets),
+                "supplyAssetsUsd": float(supply_usd[i]),
+                "fee": float(fee[i]),
+                "utilization": float(utilization[i]),
+            },
+        })
+    return {"data": {"markets": {"items": items}}}
+
+class StubMorphoAPI:
+    def __init__(self, n_markets: int = 100, seed: int = 0, host: str = "127.0.0.1", port: int = 0):
+        """
+        Local stand-in for the Morpho GraphQL API, serving synthetic markets.
+
+        Every POST gets the same pre-encoded response, so the server adds
+        almost nothing to the timings of the client. Use as a context manager
+        or with `start()`/`stop()`.
+
+        Args:
+            n_markets (int): Number of markets served
+            seed (int): Random seed of the markets
+            host (str): Interface to listen on
+            port (int): Port, any free one by default
+        """
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.set_markets(n_markets, seed)
+
+    def set_markets(self, n_markets: int, seed: int = 0):
+        """Serve `n_markets` synthetic markets from now on."""
+        self.body = json.dumps(generate_markets(n_markets, seed)).encode()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/graphql"
+
+    def start(self) -> "StubMorphoAPI":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests += 1
+                body = stub.body
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="stub-api").start()
+        logger.info(f"Stub Morpho API listening on {self.url}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "StubMorphoAPI":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,70 @@
+"""Byte-for-byte equivalence of abi_codec.py with web3/eth_abi encoding."""
+import random
+
+import pytest
+from eth_abi import encode
+from eth_hash.auto import keccak
+
+from abi_codec import (
+    MARKET_PARAMS_TYPE,
+    compare_with_web3,
+    encode_accept_cap,
+    encode_accrue_interest,
+    encode_set_supply_queue,
+    encode_submit_cap,
+    encode_update_withdraw_queue,
+)
+from Scripter import MarketAllocation, MarketParams
+
+def _address(rng: random.Random) -> str:
+    from web3 import Web3
+
+    return Web3.to_checksum_address("0x" + rng.randbytes(20).hex())
+
+def _market_params(rng: random.Random) -> MarketParams:
+    return MarketParams(_address(rng), _address(rng), _address(rng), _address(rng), rng.randrange(10**18))
+
+def _selector(signature: str) -> bytes:
+    return keccak(signature.encode())[:4]
+
+def random_candidates(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    markets = [_market_params(rng) for _ in range(12)]
+    return [
+        [MarketAllocation(rng.choice(markets), rng.choice([0, 2**256 - 1, rng.randrange(2**128)]))
+         for _ in range(rng.randint(0, 10))]
+        for _ in range(n)
+    ]
+
+def test_reallocate_matches_web3():
+    result = compare_with_web3(random_candidates(500))
+    assert result["match"]
+
+def test_cap_and_accrue_calls_match_eth_abi():
+    rng = random.Random(1)
+    for _ in range(50):
+        params = _market_params(rng)
+        as_tuple = (params.loan_token, params.collateral_token, params.oracle, params.irm, params.lltv)
+        cap = rng.randrange(2**184)
+        assert encode_submit_cap(params, cap) == (
+            _selector(f"submitCap({MARKET_PARAMS_TYPE},uint256)")
+            + encode([MARKET_PARAMS_TYPE, "uint256"], [as_tuple, cap]))
+        assert encode_accept_cap(params) == (
+            _selector(f"acceptCap({MARKET_PARAMS_TYPE})") + encode([MARKET_PARAMS_TYPE], [as_tuple]))
+        assert encode_accrue_interest(params) == (
+            _selector(f"accrueInterest({MARKET_PARAMS_TYPE})") + encode([MARKET_PARAMS_TYPE], [as_tuple]))
+
+def test_queues_match_eth_abi():
+    rng = random.Random(2)
+    for size in range(0, 31, 5):
+        ids = [rng.randbytes(32) for _ in range(size)]
+        assert encode_set_supply_queue(["0x" + market_id.hex() for market_id in ids]) == (
+            _selector("setSupplyQueue(bytes32[])") + encode(["bytes32[]"], [ids]))
+        indexes = [rng.randrange(30) for _ in range(size)]
+        assert encode_update_withdraw_queue(indexes) == (
+            _selector("updateWithdrawQueue(uint256[])") + encode(["uint256[]"], [indexes]))
+
+@pytest.mark.parametrize("market_id", ["0x" + "ab" * 31, "0x" + "ab" * 33, "0x"])
+def test_set_supply_queue_rejects_ids_that_are_not_32_bytes(market_id):
+    with pytest.raises(ValueError):
+        encode_set_supply_queue([market_id])
@@ -0,0 +1,26 @@
+import sqlite3
+
+import pytest
+
+from main import DatabaseManager
+
+def _market(i):
+    return {"market": f"0x{i:064x}", "token": {"symbol": "USDC", "address": "0x" + "11" * 20},
+            "supply_apy": 0.05, "borrow_apy": 0.07, "utilization": 0.8, "lltv": 0.86,
+            "max_supply": 1e6, "risk": 0.1}
+
+def _failing_stream(rows):
+    for i in range(rows):
+        yield _market(i)
+    raise RuntimeError("stream cut")
+
+@pytest.mark.parametrize("persistent", [True, False])
+def test_failed_write_is_not_committed_later(tmp_path, persistent):
+    db = DatabaseManager(str(tmp_path / "markets.db"), persistent=persistent)
+    with pytest.raises(RuntimeError):
+        db.store_market_stream(_failing_stream(5), batch_size=2)
+    db.store_market_stream([_market(100)])
+    db.close()
+
+    with sqlite3.connect(str(tmp_path / "markets.db")) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM markets").fetchone()[0] == 1
@@ -0,0 +1,55 @@
+"""
+Tests of gas_benchmark.py.
+
+The end-to-end test deploys the benchmark vault with
+DeployGasBenchmark.s.sol on a local anvil chain, sends a few allocation
+shapes from both states and fits the planner's gas model to them.
+"""
+import shutil
+
+import pytest
+
+from gas_benchmark import fit_gas_model
+
+requires_foundry = pytest.mark.skipif(shutil.which("anvil") is None or shutil.which("forge") is None,
+                                      reason="needs Foundry (anvil and forge)")
+
+def _bounds_every_row(model, rows) -> bool:
+    return all(model.base_gas + model.withdraw_leg_gas * row["withdrawals"]
+               + model.supply_leg_gas * row["supplies"] >= row["gas_used"]
+               for row in rows if row["success"])
+
+def test_fit_bounds_every_measurement():
+    rows = [
+        {"withdrawals": w, "supplies": s, "success": True,
+         "gas_used": 50_000 + 80_000 * w + 100_000 * s + 7_000 * ((w * 3 + s) % 4)}
+        for w in range(1, 5) for s in range(1, 5)
+    ]
+    rows.append({"withdrawals": 9, "supplies": 9, "success": False, "gas_used": None})
+
+    model = fit_gas_model(rows)
+
+    assert _bounds_every_row(model, rows)
+    assert 70_000 <= model.withdraw_leg_gas <= 90_000
+    assert 90_000 <= model.supply_leg_gas <= 110_000
+
+def test_fit_needs_three_successes():
+    rows = [{"withdrawals": 1, "supplies": 1, "success": True, "gas_used": 200_000}] * 2
+    with pytest.raises(ValueError):
+        fit_gas_model(rows)
+
+@requires_foundry
+def test_benchmark_calibrates_the_gas_model():
+    from gas_benchmark import STATES, GasBenchmark
+
+    with GasBenchmark(n_markets=4, port=8557) as benchmark:
+        rows = benchmark.run(max_legs=3)
+
+    assert len(rows) == len(STATES) * len(list(benchmark.shapes(3)))
+    assert all(row["success"] for row in rows)
+    # Counted from the executed legs, which never exceed the legs sent
+    assert all(row["withdrawals"] >= 1 and row["withdrawals"] + row["supplies"] <= row["legs"] for row in rows)
+
+    model = fit_gas_model(rows)
+    assert _bounds_every_row(model, rows)
+    assert model.withdraw_leg_gas > 0 and model.supply_leg_gas > 0
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start budget of the CLI's own imports, on top of the interpreter's startup
+IMPORT_TIME_BUDGET_MS = 150
+RUNS = 5
+
+# Loaded by the commands that need them, never at startup
+HEAVY_MODULES = ("numpy", "pulp", "requests", "web3", "scipy", "http.server")
+
+def _best_ms(args, runs=RUNS):
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=SCRIPT_DIR, check=True, stdout=subprocess.DEVNULL)
+        best = min(best, (time.perf_counter() - started) * 1000)
+    return best
+
+@pytest.fixture(scope="module")
+def interpreter_ms():
+    return _best_ms(["-c", "pass"])
+
+@pytest.mark.parametrize("args", [
+    ["cli.py", "--help"],
+    # What `trends` and the other light commands load before running
+    ["-c", "import main"],
+], ids=["cli-help", "import-main"])
+def test_cold_start_within_budget(args, interpreter_ms):
+    own = _best_ms(args) - interpreter_ms
+    assert own < IMPORT_TIME_BUDGET_MS, f"{' '.join(args)}: {own:.1f}ms of imports, budget {IMPORT_TIME_BUDGET_MS}ms"
+
+def test_light_imports_skip_heavy_modules():
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, cli, main; print(' '.join(sys.modules))"],
+        cwd=SCRIPT_DIR, check=True, capture_output=True, text=True
+    ).stdout.split()
+    assert [name for name in HEAVY_MODULES if name in loaded] == []
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from json_stream import iter_array_items
+
+ITEMS = [1e-05, -2.5E+10, 0.125, 1e5, 12345678901234567890, -0, 7, True, False, None,
+         "1e-05", {"supply": 1.5e-3, "tags": ["a", 2e2]}, [3.25e-1, []], 1.0]
+
+def _chunks(body: bytes, size: int):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 11, 64, 1 << 16])
+def test_items_cut_at_any_boundary(size):
+    body = json.dumps({"data": {"markets": {"items": ITEMS}}}).encode()
+    assert list(iter_array_items(_chunks(body, size))) == ITEMS
+
+@pytest.mark.parametrize("size", [1, 2, 5, 7])
+def test_exponent_cut_at_boundary(size):
+    body = b'{"data": {"markets": {"items": [1e-05]}}}'
+    assert list(iter_array_items(_chunks(body, size))) == [1e-05]
+
+@pytest.mark.parametrize("body", [
+    b'{"data": {"markets": {"items": [1e]}}}',
+    b'{"data": {"markets": {"items": [1, 2x]}}}',
+    b'{"data": {"markets": {"items": [1, 2',
+])
+@pytest.mark.parametrize("size", [1, 4, 1 << 16])
+def test_malformed_elements_raise(body, size):
+    with pytest.raises(ValueError):
+        list(iter_array_items(_chunks(body, size)))
@@ -0,0 +1,44 @@
+import pytest
+
+from market_data import MarketColumns
+from reallocation import ReallocationLeg, _pair_transfers, build_reallocation_legs
+from Scripter import MarketParams
+from synthetic_markets import generate_markets
+
+def _leg(key: str, current: int, target: int) -> ReallocationLeg:
+    params = MarketParams(loan_token="0x" + "11" * 20, collateral_token="0x" + "22" * 20,
+                          oracle="0x" + key * 40, irm="0x" + "33" * 20, lltv=860000000000000000)
+    return ReallocationLeg(market_key=key, market_params=params, current_assets=current, target_assets=target)
+
+def test_balanced_legs_are_paired():
+    legs = [_leg("a", 1000, 400), _leg("b", 500, 0), _leg("c", 0, 1100)]
+    assert _pair_transfers(legs) == [(0, 0, 600), (1, 0, 500)]
+
+def test_rounding_surplus_goes_to_last_supply():
+    legs = [_leg("a", 1000, 0), _leg("b", 0, 600), _leg("c", 0, 399)]
+    assert _pair_transfers(legs) == [(0, 0, 600), (0, 1, 399), (0, 1, 1)]
+
+def test_rounding_shortfall_is_cut():
+    legs = [_leg("a", 1000, 0), _leg("c", 0, 1001)]
+    assert _pair_transfers(legs) == [(0, 0, 1000)]
+
+@pytest.mark.parametrize("legs", [
+    # Withdrawals far above supplies: 990 units would land in c unchecked
+    [_leg("a", 1000, 0), _leg("c", 0, 10)],
+    # Supplies far above withdrawals
+    [_leg("a", 10, 0), _leg("c", 0, 1000)],
+    [_leg("a", 1000, 0)],
+], ids=["spare-withdrawals", "unfunded-supplies", "no-supply"])
+def test_unbalanced_legs_raise(legs):
+    with pytest.raises(ValueError, match="unbalanced"):
+        _pair_transfers(legs)
+
+def test_solver_dust_does_not_make_negative_targets():
+    markets = MarketColumns.from_api(generate_markets(3, seed=1)["data"]["markets"]["items"])
+    held, empty, other = markets.keys
+    current = {held: markets[held]["supply_assets"] // 10, empty: 0}
+    allocations = {held: -1e-13, empty: -1e-13, other: 0.0}
+
+    legs = build_reallocation_legs(allocations, markets, current_assets=current)
+
+    assert [(leg.market_key, leg.target_assets) for leg in legs] == [(held, 0)]
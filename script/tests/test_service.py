@@ -0,0 +1,101 @@
+"""Request coalescing and an open-loop load test of the allocation service."""
+import asyncio
+import os
+
+import pytest
+
+from main import DatabaseManager, MorphoMarketOptimizer
+from metrics import REGISTRY
+from service import AllocationService, load_test
+from synthetic_markets import StubMorphoAPI
+
+@pytest.fixture
+def optimizer(tmp_path):
+    return MorphoMarketOptimizer(db=DatabaseManager(os.path.join(tmp_path, "service.db"), persistent=True))
+
+def test_followers_take_over_when_the_leader_is_cancelled(optimizer):
+    service = AllocationService(optimizer)
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(60 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    async def scenario():
+        leader = asyncio.create_task(service._coalesced(("key",), compute))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(service._coalesced(("key",), compute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        # One follower recomputes and the others share its result
+        return await asyncio.wait_for(asyncio.gather(*followers), timeout=5)
+
+    assert asyncio.run(scenario()) == [2, 2, 2]
+    assert not service._inflight
+
+def test_followers_get_the_leader_error(optimizer):
+    service = AllocationService(optimizer)
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("solver failed")
+
+    async def scenario():
+        tasks = [asyncio.create_task(service._coalesced(("key",), compute)) for _ in range(3)]
+        return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=5)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(scenario()))
+
+def _stage_count(stage: str) -> int:
+    state = REGISTRY.histograms.get("pipeline_stage_seconds", {}).get((("stage", stage),))
+    return state[-1] if state else 0
+
+def test_worker_solve_timings_reach_the_registry(tmp_path):
+    async def scenario(stub_url: str):
+        service = AllocationService(
+            MorphoMarketOptimizer(api_url=stub_url,
+                                  db=DatabaseManager(os.path.join(tmp_path, "timings.db"), persistent=True)),
+            workers=1
+        )
+        await service.start("127.0.0.1", 0)
+        try:
+            return await service._solve({"available_funds": 1_000_000})
+        finally:
+            await service.stop()
+
+    before = {stage: _stage_count(stage) for stage in ("lp_build", "lp_solve")}
+    with StubMorphoAPI(n_markets=20, seed=0) as stub:
+        allocation = asyncio.run(scenario(stub.url))
+
+    assert sum(allocation.values()) > 0
+    # Solved in a worker process, recorded in this one
+    assert {stage: _stage_count(stage) - count for stage, count in before.items()} == {"lp_build": 1, "lp_solve": 1}
+    assert 'stage="lp_solve"' in REGISTRY.render()
+
+def test_load(tmp_path):
+    """Open-loop load against a 1000-market stub: no errors, offered rate held, cached answers fast."""
+    paths = [f"/optimize?available_funds=1000000&max_risk={risk}&max_utilization=0.85"
+             for risk in (0.1, 0.2, 0.3)] + ["/health", "/frontier?points=5"]
+
+    async def scenario(stub_url: str):
+        service = AllocationService(
+            MorphoMarketOptimizer(api_url=stub_url,
+                                  db=DatabaseManager(os.path.join(tmp_path, "load.db"), persistent=True)),
+            workers=2
+        )
+        await service.start("127.0.0.1", 0)
+        try:
+            port = service._server.sockets[0].getsockname()[1]
+            # Warm the cache, then measure
+            await load_test(port=port, paths=paths, rate=20, duration=1, connections=8)
+            return await load_test(port=port, paths=paths, rate=200, duration=3, connections=32)
+        finally:
+            await service.stop()
+
+    with StubMorphoAPI(n_markets=1000, seed=0) as stub:
+        result = asyncio.run(scenario(stub.url))
+
+    assert result["errors"] == 0
+    assert result["rate"] >= 0.9 * 200
+    assert result["p50_ms"] < 50
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+from pulp import PULP_CBC_CMD
+
+from main import solve_allocation
+
+def _market(key, supply_apy, max_supply, risk=0.0, utilization=0.0):
+    return {"market": key, "token": {"symbol": "USDC", "decimals": 6}, "borrow_apy": 0.0,
+            "supply_apy": supply_apy, "utilization": utilization, "lltv": 0.86,
+            "max_supply": max_supply, "risk": risk}
+
+def _solve(markets, funds, current, **params):
+    return solve_allocation(markets, funds, current_positions=current,
+                            solver=PULP_CBC_CMD(msg=False), **params)
+
+def test_no_wash_trade_below_min_trade_size():
+    # Buying 800 and selling 300 of B used to pass as two legs of a +500 move
+    markets = [_market("A", 0.01, 1e6), _market("B", 0.5, 800), _market("C", 0.3, 1e6)]
+    current = {"A": 9_700, "B": 300, "C": 0}
+
+    allocation = _solve(markets, 10_000, current, gas_cost_per_leg=5, min_trade_size=1_000)
+
+    assert sum(allocation.values()) == pytest.approx(10_000)
+    for key, amount in allocation.items():
+        move = abs(amount - current[key])
+        assert move < 1e-6 or move >= 1_000 - 1e-6, (key, amount)
+
+@pytest.mark.parametrize("seed", range(10))
+def test_net_moves_respect_min_trade_size(seed):
+    rng = random.Random(seed)
+    markets = [_market(f"m{i}", rng.uniform(0.01, 0.2), rng.choice([500, 2_000, 1e6]),
+                       risk=rng.uniform(0, 0.3), utilization=rng.uniform(0.3, 0.9))
+               for i in range(8)]
+    current = {market["market"]: rng.choice([0, 300, 1_500]) for market in markets}
+    funds = sum(current.values())
+
+    allocation = _solve(markets, funds, current, max_risk=0.25, gas_cost_per_leg=5,
+                        min_trade_size=400, turnover_cost=0.0005)
+
+    assert sum(allocation.values()) == pytest.approx(funds)
+    for key, amount in allocation.items():
+        move = abs(amount - current[key])
+        assert move < 1e-6 or move >= 400 - 1e-6, (key, amount, current[key])
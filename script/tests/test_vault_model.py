@@ -0,0 +1,139 @@
+"""
+Tests of vault_model.py.
+
+The vectorized screening must agree with the scalar model on random vault
+states. The differential test executes random allocations on a local anvil
+chain (deployed by gas_benchmark.py), and the model must predict the exact
+withdrawals, supplies and resulting state, or the revert.
+"""
+import random
+import shutil
+
+import pytest
+
+from vault_model import (
+    MAX_UINT256,
+    REALLOCATION_ERRORS,
+    MarketState,
+    ReallocationError,
+    VaultState,
+    screen_reallocations,
+    simulate_reallocate,
+    simulate_withdraw_morpho,
+)
+
+requires_foundry = pytest.mark.skipif(shutil.which("anvil") is None or shutil.which("forge") is None,
+                                      reason="needs Foundry (anvil and forge)")
+
+N_MARKETS = 6
+SEEDS = range(25)
+
+def random_vault(rng: random.Random, n_markets: int = N_MARKETS) -> VaultState:
+    """Markets with random liquidity, vault positions, caps and enabled flags."""
+    markets = {}
+    for i in range(n_markets):
+        total_assets = rng.choice([0, rng.randint(1, 10**6), rng.randint(10**18, 10**24)])
+        # Shares start at 1e6 per asset and drift with accrued interest
+        total_shares = total_assets * 10**6 * rng.randint(90, 100) // 100
+        vault_shares = rng.randint(0, total_shares)
+        markets[f"0x{i:064x}"] = MarketState(
+            market_id=f"0x{i:064x}",
+            total_supply_assets=total_assets,
+            total_supply_shares=total_shares,
+            total_borrow_assets=rng.randint(0, total_assets),
+            vault_supply_shares=vault_shares,
+            cap=rng.choice([0, rng.randint(0, 2 * total_assets + 1), 2**184 - 1]),
+            enabled=rng.random() < 0.9,
+        )
+    morpho_balance = rng.choice([None, rng.randint(0, 10**6), rng.randint(0, 2 * 10**24)])
+    return VaultState(markets, list(markets), morpho_balance)
+
+def random_targets(rng: random.Random, vault: VaultState, market_ids, n_candidates: int):
+    candidates = []
+    for _ in range(n_candidates):
+        row = []
+        for mid in market_ids:
+            held = vault.markets[mid].vault_supply_assets
+            row.append(rng.choice([0, held, rng.randint(0, held + 1), held + rng.randint(0, 10**24)]))
+        if rng.random() < 0.7:
+            row[-1] = MAX_UINT256
+        candidates.append(row)
+    return candidates
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_screening_matches_scalar_model(seed):
+    rng = random.Random(seed)
+    vault = random_vault(rng)
+    market_ids = rng.sample(list(vault.markets), rng.randint(2, N_MARKETS))
+    candidates = random_targets(rng, vault, market_ids, 50)
+
+    screened = screen_reallocations(vault, market_ids, candidates)
+
+    for i, targets in enumerate(candidates):
+        try:
+            result = simulate_reallocate(vault, list(zip(market_ids, targets)))
+        except ReallocationError as e:
+            assert REALLOCATION_ERRORS[screened["error"][i]] == e.error, (i, targets)
+            continue
+        assert screened["ok"][i], (i, REALLOCATION_ERRORS[screened["error"][i]], targets)
+        assert screened["total_withdrawn"][i] == result.total_withdrawn
+        assert screened["total_supplied"][i] == result.total_supplied
+
+def test_withdraw_queue_walk():
+    vault = VaultState({
+        "a": MarketState("a", 1_000, 1_000 * 10**6, 900, vault_supply_shares=500 * 10**6),
+        "b": MarketState("b", 2_000, 2_000 * 10**6, 0, vault_supply_shares=300 * 10**6),
+    }, withdraw_queue=["a", "b"])
+    # 100 available in a, then all of b's 300
+    assert simulate_withdraw_morpho(vault, 1_000) == 1_000 - 100 - 300
+    assert simulate_withdraw_morpho(vault, 50) == 0
+
+@pytest.fixture(scope="module")
+def chain():
+    from gas_benchmark import GasBenchmark
+
+    with GasBenchmark(n_markets=N_MARKETS, port=8556) as benchmark:
+        yield benchmark
+
+def random_allocations(benchmark, rng: random.Random):
+    """Withdraw random amounts (sometimes everything) from some markets and supply them to others."""
+    from reallocation import MAX_UINT256
+    from Scripter import MarketAllocation
+
+    current = benchmark.vault_supply()
+    chosen = rng.sample(range(len(current)), rng.randint(2, len(current)))
+    n_withdrawals = rng.randint(1, len(chosen) - 1)
+
+    allocations, moved = [], 0
+    for i in chosen[:n_withdrawals]:
+        target = 0 if rng.random() < 0.3 else rng.randint(0, current[i])
+        moved += current[i] - target
+        allocations.append(MarketAllocation(benchmark.markets[i], target))
+    supplies = chosen[n_withdrawals:]
+    for j in supplies[:-1]:
+        amount = rng.randint(0, moved)
+        moved -= amount
+        allocations.append(MarketAllocation(benchmark.markets[j], current[j] + amount))
+    # Mostly balanced through `type(uint256).max`; sometimes an explicit, possibly unbalanced, target
+    last = supplies[-1]
+    if rng.random() < 0.8:
+        allocations.append(MarketAllocation(benchmark.markets[last], MAX_UINT256))
+    else:
+        allocations.append(MarketAllocation(benchmark.markets[last], current[last] + rng.randint(0, 2 * moved)))
+    return allocations
+
+@requires_foundry
+@pytest.mark.parametrize("seed", SEEDS)
+def test_model_matches_reallocate(chain, seed):
+    from web3 import Web3
+    from gas_benchmark import ANVIL_PRIVATE_KEY
+    from vault_model import differential_check
+
+    allocations = random_allocations(chain, random.Random(seed))
+    assert differential_check(
+        chain.client,
+        Web3.to_checksum_address(chain.deployment["vault"]),
+        allocations,
+        morpho_address=Web3.to_checksum_address(chain.deployment["morpho"]),
+        private_key=ANVIL_PRIVATE_KEY
+    )
@@ -0,0 +1,432 @@
+import copy
+import logging
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Sequence, Tuple, Any
+
+import numpy as np
+
+from morpho_math import (
+    VIRTUAL_SHARES,
+    VIRTUAL_ASSETS,
+    to_shares_down,
+    to_shares_up,
+    to_assets_down,
+    zero_floor_sub,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_UINT256 = 2**256 - 1
+
+# -------------------------------------------------------------------------
+# State
+# -------------------------------------------------------------------------
+@dataclass
+class MarketState:
+    """Morpho Blue market, the vault's position in it and the vault's config for it."""
+    market_id: str
+    total_supply_assets: int
+    total_supply_shares: int
+    total_borrow_assets: int
+    vault_supply_shares: int = 0
+    cap: int = 0
+    enabled: bool = False
+
+    @property
+    def vault_supply_assets(self) -> int:
+        """Vault supply rounded down, as in `_accruedSupplyBalance`."""
+        return to_assets_down(self.vault_supply_shares, self.total_supply_assets, self.total_supply_shares)
+
+@dataclass
+class VaultState:
+    """
+    State read by `reallocate` and the withdraw queue functions.
+
+    Markets are assumed to be accrued up to the block being modelled.
+    """
+    markets: Dict[str, MarketState]
+    withdraw_queue: List[str] = field(default_factory=list)
+    # Loan token balance of Morpho; None when it does not bind
+    morpho_balance: Optional[int] = None
+
+class ReallocationError(Exception):
+    """Revert of the modelled call; `error` is the ErrorsLib / Morpho error name."""
+    def __init__(self, error: str, market_id: Optional[str] = None):
+        self.error = error
+        self.market_id = market_id
+        super().__init__(f"{error}({market_id})" if market_id else error)
+
+@dataclass
+class ReallocationResult:
+    """Outcome of a successful `reallocate`, with the same amounts as its events."""
+    withdrawals: List[Tuple[str, int, int]]  # (market id, withdrawn assets, withdrawn shares)
+    supplies: List[Tuple[str, int, int]]     # (market id, supplied assets, supplied shares)
+    total_withdrawn: int
+    total_supplied: int
+    state: VaultState
+
+# -------------------------------------------------------------------------
+# reallocate
+# -------------------------------------------------------------------------
+def _morpho_withdraw(vault: VaultState, market: MarketState, assets: int, shares: int) -> Tuple[int, int]:
+    if assets > 0:
+        shares = to_shares_up(assets, market.total_supply_assets, market.total_supply_shares)
+    else:
+        assets = to_assets_down(shares, market.total_supply_assets, market.total_supply_shares)
+
+    if shares > market.vault_supply_shares:
+        raise ReallocationError("ArithmeticUnderflow", market.market_id)
+
+    market.vault_supply_shares -= shares
+    market.total_supply_shares -= shares
+    market.total_supply_assets -= assets
+
+    if market.total_borrow_assets > market.total_supply_assets:
+        raise ReallocationError("InsufficientLiquidity", market.market_id)
+    if vault.morpho_balance is not None:
+        if assets > vault.morpho_balance:
+            raise ReallocationError("TransferFailed", market.market_id)
+        vault.morpho_balance -= assets
+
+    return assets, shares
+
+def _morpho_supply(vault: VaultState, market: MarketState, assets: int) -> int:
+    shares = to_shares_down(assets, market.total_supply_assets, market.total_supply_shares)
+
+    market.vault_supply_shares += shares
+    market.total_supply_shares += shares
+    market.total_supply_assets += assets
+    if vault.morpho_balance is not None:
+        vault.morpho_balance += assets
+
+    return shares
+
+def simulate_reallocate(vault: VaultState,
+                        allocations: Sequence[Tuple[str, int]],
+                        inplace: bool = False) -> ReallocationResult:
+    """
+    Model `MetaMorpho.reallocate` exactly, in integers.
+
+    Args:
+        vault (VaultState): Vault state before the call
+        allocations (Sequence[Tuple[str, int]]): (market id, target assets) in call order
+        inplace (bool): Mutate `vault` instead of a copy
+
+    Returns:
+        ReallocationResult: Withdrawn/supplied amounts and the state after the call
+
+    Raises:
+        ReallocationError: If the call would revert
+    """
+    state = vault if inplace else copy.deepcopy(vault)
+    withdrawals, supplies = [], []
+    total_supplied = 0
+    total_withdrawn = 0
+
+    for market_id, target in allocations:
+        market = state.markets.get(market_id)
+        if market is None:
+            raise ReallocationError("MarketNotCreated", market_id)
+
+        supply_assets = market.vault_supply_assets
+        withdrawn = zero_floor_sub(supply_assets, target)
+
+        if withdrawn > 0:
+            if not market.enabled:
+                raise ReallocationError("MarketNotEnabled", market_id)
+
+            # Guarantees that unknown frontrunning donations can be withdrawn, in order to disable a market.
+            shares = 0
+            if target == 0:
+                shares = market.vault_supply_shares
+                withdrawn = 0
+
+            withdrawn_assets, withdrawn_shares = _morpho_withdraw(state, market, withdrawn, shares)
+            withdrawals.append((market_id, withdrawn_assets, withdrawn_shares))
+            total_withdrawn += withdrawn_assets
+        else:
+            if target == MAX_UINT256:
+                supplied_assets = zero_floor_sub(total_withdrawn, total_supplied)
+            else:
+                supplied_assets = zero_floor_sub(target, supply_assets)
+
+            if supplied_assets == 0:
+                continue
+
+            if market.cap == 0:
+                raise ReallocationError("UnauthorizedMarket", market_id)
+            if supply_assets + supplied_assets > market.cap:
+                raise ReallocationError("SupplyCapExceeded", market_id)
+
+            supplied_shares = _morpho_supply(state, market, supplied_assets)
+            supplies.append((market_id, supplied_assets, supplied_shares))
+            total_supplied += supplied_assets
+
+    if total_withdrawn != total_supplied:
+        raise ReallocationError("InconsistentReallocation")
+
+    return ReallocationResult(withdrawals, supplies, total_withdrawn, total_supplied, state)
+
+# -------------------------------------------------------------------------
+# Withdraw queue
+# -------------------------------------------------------------------------
+def withdrawable(vault: VaultState, market: MarketState, supply_assets: int) -> int:
+    """Model `_withdrawable`: vault supply capped by the market's available liquidity."""
+    available_liquidity = market.total_supply_assets - market.total_borrow_assets
+    if vault.morpho_balance is not None:
+        available_liquidity = min(available_liquidity, vault.morpho_balance)
+    return min(supply_assets, available_liquidity)
+
+def simulate_withdraw_morpho(vault: VaultState, assets: int) -> int:
+    """
+    Model `_simulateWithdrawMorpho`: walk the withdraw queue.
+
+    Returns:
+        int: The remaining assets that could not be withdrawn
+    """
+    for market_id in vault.withdraw_queue:
+        market = vault.markets[market_id]
+        assets = zero_floor_sub(assets, withdrawable(vault, market, market.vault_supply_assets))
+        if assets == 0:
+            break
+    return assets
+
+def max_withdrawable(vault: VaultState, assets: int) -> int:
+    """Assets out of `assets` the vault can pull from Morpho, as in `_maxWithdraw`."""
+    return assets - simulate_withdraw_morpho(vault, assets)
+
+# -------------------------------------------------------------------------
+# Vectorized screening of many candidates
+# -------------------------------------------------------------------------
+REALLOCATION_ERRORS = [
+    "",
+    "MarketNotEnabled",
+    "ArithmeticUnderflow",
+    "InsufficientLiquidity",
+    "TransferFailed",
+    "UnauthorizedMarket",
+    "SupplyCapExceeded",
+    "InconsistentReallocation",
+]
+_ERROR_CODES = {name: code for code, name in enumerate(REALLOCATION_ERRORS)}
+
+def screen_reallocations(vault: VaultState,
+                         market_ids: Sequence[str],
+                         targets: Any) -> Dict[str, np.ndarray]:
+    """
+    Check many candidate `reallocate` calls against the vault's rules at once.
+
+    Every candidate touches the markets in `market_ids` order, each market once,
+    so each column sees the market's initial state. Arithmetic is done on object
+    arrays of Python ints and stays exact.
+
+    Args:
+        vault (VaultState): Vault state before the call
+        market_ids (Sequence[str]): Markets in call order
+        targets: (candidates x markets) target assets, `MAX_UINT256` for "supply the rest"
+
+    Returns:
+        Dict[str, np.ndarray]: `ok` mask, first `error` code per candidate (see
+        `REALLOCATION_ERRORS`), `total_withdrawn` and `total_supplied`
+    """
+    targets = np.asarray(targets, dtype=object)
+    if targets.ndim != 2 or targets.shape[1] != len(market_ids):
+        raise ValueError("targets must be a (candidates x markets) matrix")
+    n = targets.shape[0]
+
+    error = np.zeros(n, dtype=np.int8)
+    total_withdrawn = np.zeros(n, dtype=object)
+    total_supplied = np.zeros(n, dtype=object)
+    balance = None if vault.morpho_balance is None else np.full(n, vault.morpho_balance, dtype=object)
+
+    def fail(mask, name):
+        error[mask & (error == 0)] = _ERROR_CODES[name]
+
+    for column, market_id in enumerate(market_ids):
+        market = vault.markets[market_id]
+        target = targets[:, column]
+        supply_assets = market.vault_supply_assets
+        total_assets, total_shares = market.total_supply_assets, market.total_supply_shares
+
+        withdrawn = np.where(target < supply_assets, supply_assets - target, 0)
+        is_withdrawal = withdrawn > 0
+
+        # Withdrawals; target == 0 burns all shares
+        full_exit = is_withdrawal & (target == 0)
+        withdrawn_assets = np.where(
+            full_exit,
+            to_assets_down(market.vault_supply_shares, total_assets, total_shares),
+            withdrawn
+        )
+        withdrawn_shares = np.where(
+            full_exit,
+            market.vault_supply_shares,
+            (withdrawn * (total_shares + VIRTUAL_SHARES) + total_assets) // (total_assets + VIRTUAL_ASSETS)
+        )
+        withdrawn_assets = np.where(is_withdrawal, withdrawn_assets, 0)
+
+        if not market.enabled:
+            fail(is_withdrawal, "MarketNotEnabled")
+        fail(is_withdrawal & (withdrawn_shares > market.vault_supply_shares), "ArithmeticUnderflow")
+        fail(is_withdrawal & (market.total_borrow_assets > total_assets - withdrawn_assets), "InsufficientLiquidity")
+        if balance is not None:
+            fail(is_withdrawal & (withdrawn_assets > balance), "TransferFailed")
+        total_withdrawn = total_withdrawn + withdrawn_assets
+
+        # Supplies
+        remaining = total_withdrawn - total_supplied
+        supplied = np.where(
+            target == MAX_UINT256,
+            np.where(remaining > 0, remaining, 0),
+            np.where(target > supply_assets, target - supply_assets, 0)
+        )
+        supplied = np.where(is_withdrawal, 0, supplied)
+        is_supply = supplied > 0
+
+        if market.cap == 0:
+            fail(is_supply, "UnauthorizedMarket")
+        fail(is_supply & (supply_assets + supplied > market.cap), "SupplyCapExceeded")
+        total_supplied = total_supplied + supplied
+
+        if balance is not None:
+            balance = balance - withdrawn_assets + supplied
+
+    fail(total_withdrawn != total_supplied, "InconsistentReallocation")
+
+    return {
+        "ok": error == 0,
+        "error": error,
+        "total_withdrawn": total_withdrawn,
+        "total_supplied": total_supplied,
+    }
+
+# -------------------------------------------------------------------------
+# On-chain state and differential check against anvil
+# -------------------------------------------------------------------------
+def market_id(market_params) -> str:
+    """Morpho Blue market id: keccak256(abi.encode(marketParams))."""
+    from eth_utils import keccak
+    from abi_codec import encode_market_params, market_params_tuple
+
+    return "0x" + keccak(encode_market_params(market_params_tuple(market_params))).hex()
+
+def load_vault_state(w3, vault_address: str, market_params_list: List[Any], block="latest",
+                     morpho_address: Optional[str] = None) -> VaultState:
+    """
+    Read the vault's state for the given markets from the chain.
+
+    Args:
+        w3: Connected Web3 instance
+        vault_address (str): MetaMorpho vault
+        market_params_list (List[MarketParams]): Markets to load, besides those
+            of the withdraw queue, which are always loaded
+        block: Block identifier to read at
+        morpho_address (Optional[str]): Morpho Blue, the mainnet deployment by default
+
+    Returns:
+        VaultState: State as seen by `reallocate` if called at `block`'s timestamp
+    """
+    from Scripter import MORPHO_ADDRESS, MORPHO_ABI, VAULT_STATE_ABI, ERC20_BALANCE_ABI
+
+    morpho_address = morpho_address or MORPHO_ADDRESS
+    morpho = w3.eth.contract(address=morpho_address, abi=MORPHO_ABI)
+    vault = w3.eth.contract(address=vault_address, abi=VAULT_STATE_ABI)
+
+    queue_length = vault.functions.withdrawQueueLength().call(block_identifier=block)
+    withdraw_queue = [
+        "0x" + bytes(vault.functions.withdrawQueue(i).call(block_identifier=block)).hex()
+        for i in range(queue_length)
+    ]
+
+    # Every queue market too, as the withdraw queue walk reads them all
+    markets = {}
+    for mid in dict.fromkeys([*(market_id(params) for params in market_params_list), *withdraw_queue]):
+        supply_shares, _, _ = morpho.functions.position(mid, vault_address).call(block_identifier=block)
+        total_supply_assets, total_supply_shares, total_borrow_assets, *_ = (
+            morpho.functions.market(mid).call(block_identifier=block)
+        )
+        cap, enabled, _ = vault.functions.config(mid).call(block_identifier=block)
+        markets[mid] = MarketState(mid, total_supply_assets, total_supply_shares, total_borrow_assets,
+                                   supply_shares, cap, enabled)
+
+    morpho_balance = None
+    if market_params_list:
+        token = w3.eth.contract(address=market_params_list[0].loan_token, abi=ERC20_BALANCE_ABI)
+        morpho_balance = token.functions.balanceOf(morpho_address).call(block_identifier=block)
+
+    return VaultState(markets, withdraw_queue, morpho_balance)
+
+def differential_check(w3, vault_address: str, allocations: List[Any],
+                       morpho_address: Optional[str] = None, private_key: Optional[str] = None) -> bool:
+    """
+    Execute `allocations` on anvil and check the model predicts the exact outcome.
+
+    Markets are accrued first and the reallocation is mined at the same timestamp,
+    so the on-chain call sees exactly the state the model was given. The chain is
+    reverted afterwards.
+
+    Args:
+        w3: Web3 instance connected to anvil
+        vault_address (str): MetaMorpho vault
+        allocations (List[MarketAllocation]): Allocations to execute
+        morpho_address (Optional[str]): Morpho Blue, the mainnet deployment by default
+        private_key (Optional[str]): Key of the vault's allocator (`TEST_ACCOUNT`), Scripter's by default
+
+    Returns:
+        bool: True if the model and the chain agree
+    """
+    from Scripter import MORPHO_ADDRESS, MORPHO_ABI, PRIVATE_KEY, TEST_ACCOUNT, simulate_and_send_reallocate
+    from event_indexer import EVENT_TOPICS, decode_log
+
+    params_list = list({market_id(a.market_params): a.market_params for a in allocations}.values())
+    morpho_address = morpho_address or MORPHO_ADDRESS
+    morpho = w3.eth.contract(address=morpho_address, abi=MORPHO_ABI)
+
+    snapshot = w3.provider.make_request("evm_snapshot", [])["result"]
+    try:
+        for params in params_list:
+            tx_hash = morpho.functions.accrueInterest(
+                (params.loan_token, params.collateral_token, params.oracle, params.irm, params.lltv)
+            ).transact({"from": TEST_ACCOUNT})
+            w3.eth.wait_for_transaction_receipt(tx_hash)
+
+        latest = w3.eth.get_block("latest")
+        state = load_vault_state(w3, vault_address, params_list, morpho_address=morpho_address)
+        try:
+            expected = simulate_reallocate(state, [(market_id(a.market_params), a.assets) for a in allocations])
+        except ReallocationError as e:
+            expected = e
+
+        w3.provider.make_request("evm_setNextBlockTimestamp", [latest["timestamp"]])
+        receipt = simulate_and_send_reallocate(allocations, client=w3, vault_address=vault_address,
+                                               private_key=private_key or PRIVATE_KEY)
+
+        if isinstance(expected, ReallocationError):
+            agree = receipt is None or receipt["status"] == 0
+            logger.info(f"Model predicted revert {expected}; chain {'reverted' if agree else 'succeeded'}")
+            return agree
+        if receipt is None or receipt["status"] == 0:
+            logger.info("Model predicted success; chain reverted")
+            return False
+
+        withdrawals, supplies = [], []
+        for log in receipt["logs"]:
+            if log["address"].lower() != vault_address.lower() or bytes(log["topics"][0]) not in EVENT_TOPICS:
+                continue
+            table, row = decode_log(log)
+            if table == "reallocate_withdraw":
+                withdrawals.append((row[5], int(row[6]), int(row[7])))
+            elif table == "reallocate_supply":
+                supplies.append((row[5], int(row[6]), int(row[7])))
+
+        actual_state = load_vault_state(w3, vault_address, params_list, morpho_address=morpho_address)
+        agree = (
+            withdrawals == expected.withdrawals
+            and supplies == expected.supplies
+            and actual_state.markets == expected.state.markets
+        )
+        logger.info(f"Differential check {'passed' if agree else 'FAILED'} "
+                    f"({len(withdrawals)} withdrawals, {len(supplies)} supplies)")
+        return agree
+    finally:
+        w3.provider.make_request("evm_revert", [snapshot])